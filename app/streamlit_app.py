@@ -1,4 +1,6 @@
 """Streamlit front-end (app/streamlit_app.py)"""
+import os
+import shutil
 import sys
 import uuid
 from pathlib import Path
@@ -11,11 +13,24 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from backend.parser import parse_c_file_to_ast_dict, parse_c_code_str_to_ast
+from backend.parser import (parse_c_file_to_ast_dict, parse_project,
+                            parse_c_code_str_skeleton, code_str_cache_key)
+from backend.layout import plan_layout
+from backend.parse_cache import get_parse_cache
+from backend.embedding_cache import get_embedding_cache
+from backend.compact_ast import CompactAST, parse_c_code_str_to_compact
+from backend.tu_manager import TUManager
 from backend.ast_to_neo4j import push_ast_to_neo4j  # update: should accept instance_id argument
 from backend.vectorizer import attach_embeddings_to_nodes
-from backend.llm_converter import convert_c_to_python
+from backend.llm_client import get_llm_client
+from backend.llm_converter import (CONVERT_WORKERS, ChunkConversionError, convert_c_to_python_stream,
+                                   get_response_cache)
+from backend.chunker import CHUNK_MAX_CHARS
 from backend.utils import ensure_outputs_dir, delete_graph_instance
+from backend.graph_store import MemoryGraphStore, get_graph_store
+
+# Larger ASTs are not expanded into nested dicts for the JSON preview.
+AST_PREVIEW_MAX_NODES = int(os.getenv('AST_PREVIEW_MAX_NODES', '20000'))
 
 st.set_page_config(page_title='Legacy Migration Engine', layout='wide')
 st.title('Legacy Migration Engine — C procedural → OOP Python')
@@ -24,6 +39,31 @@ with st.sidebar:
     st.markdown('## Controls')
     model_choice = st.text_input('LLM model (ollama)', 'llama3.2')
     embed_model = st.text_input('Embedding model (ollama)', 'nomic-embed-text:latest')
+    main_file_only = st.checkbox('Prune headers outside the project (system headers)', value=True)
+    use_parse_cache = st.checkbox('Use parse cache', value=True)
+    parse_workers = st.number_input('Parse worker processes', min_value=1, max_value=32,
+                                    value=min(4, os.cpu_count() or 1))
+    graph_writers = st.number_input('Concurrent graph writers (multi-file)', min_value=1, max_value=16, value=4)
+    context_k = st.number_input('Similar AST nodes in prompt context (top-k)', min_value=1, max_value=200, value=30)
+    convert_workers = st.number_input('Concurrent conversion requests', min_value=1, max_value=32,
+                                      value=CONVERT_WORKERS)
+    chunk_chars = st.number_input('Conversion chunk size (C chars)', min_value=500, max_value=50000,
+                                  value=CHUNK_MAX_CHARS, step=500)
+    parse_cache = get_parse_cache() if use_parse_cache else None
+    if parse_cache is not None:
+        stats = parse_cache.stats()
+        st.caption(f"Parse cache: {stats['hits']} hits / {stats['misses']} misses, "
+                   f"{stats['entries']} entries ({stats['bytes'] // 1024} KiB)")
+    use_embed_cache = st.checkbox('Use embedding cache', value=True)
+    if use_embed_cache:
+        stats = get_embedding_cache().stats()
+        st.caption(f"Embedding cache: {stats['hit_rate']:.0%} hit rate, "
+                   f"{stats['entries']} vectors ({stats['bytes'] // 1024} KiB)")
+    use_llm_cache = st.checkbox('Use LLM response cache', value=True)
+    if use_llm_cache:
+        stats = get_response_cache().stats()
+        st.caption(f"LLM response cache: {stats['hits']} hits / {stats['misses']} misses "
+                   f"({stats['hit_rate']:.0%}), {stats['entries']} responses ({stats['bytes'] // 1024} KiB)")
 
 # Accept multiple files so that we can decide on ephemeral graph vs. persistent graph
 uploaded_files = st.file_uploader('Upload C file(s)', type=['c', 'h', 'txt'], accept_multiple_files=True)
@@ -34,6 +74,19 @@ if (uploaded_files is None) or (len(uploaded_files) == 0):
 else:
     files_to_process = uploaded_files
 
+if st.button('Preview layout'):
+    # Declarations only (function bodies skipped): shows the planned classes
+    # before any parsing, graph, embedding or LLM work happens.
+    outline = []
+    if files_to_process:
+        for file in files_to_process:
+            outline.extend(parse_c_code_str_skeleton(file.getvalue().decode('utf-8'),
+                                                     filename=Path(file.name).name))
+    elif code.strip():
+        outline = parse_c_code_str_skeleton(code)
+    st.subheader('Planned layout')
+    st.json(plan_layout(outline))
+
 if st.button('Run migration'):
     # Prepare output directory
     out_dir = ensure_outputs_dir('outputs')
@@ -42,82 +95,171 @@ if st.button('Run migration'):
     instance_id = str(uuid.uuid4())
     st.info(f"Migration Instance ID: {instance_id}")
 
-    # If files were uploaded, process all of them and accumulate their code
-    # Otherwise, use the pasted code
-    aggregated_ast = None
-    if files_to_process:
-        for file in files_to_process:
-            code = file.read().decode('utf-8')
+    # Single-file graphs are thrown away after conversion, so keep them in process;
+    # multi-file migrations persist in Neo4j to preserve inter-file relations.
+    single_file = (files_to_process and len(files_to_process) == 1) or (not files_to_process)
+    graph_store = MemoryGraphStore() if single_file else get_graph_store()
+
+    upload_dir = None
+    try:
+        # If files were uploaded, process all of them and accumulate their code
+        # Otherwise, use the pasted code
+        aggregated_ast = None
+        code_path = 'temp.c'  # name the converted code is parsed under
+        if files_to_process:
+            # Write the upload set to disk so sources can include each other's headers,
+            # then parse the .c files in a worker pool and push each as it finishes.
+            # Each run gets its own directory; parse cache entries are keyed relative
+            # to it, so an unchanged set still hits the cache.
+            uploads = []
+            for file in files_to_process:
+                name = Path(file.name).name
+                if name.endswith('.txt'):
+                    name = name[:-4] + '.c'
+                uploads.append((name, file.getvalue().decode('utf-8')))
+            upload_dir = out_dir / 'uploads' / instance_id
+            upload_dir.mkdir(parents=True, exist_ok=True)
+            sources = {}
+            for name, code in uploads:
+                (upload_dir / name).write_text(code)
+                sources[str(upload_dir / name)] = code
+                code_path = str(upload_dir / name)
+            targets = [p for p in sources if p.endswith('.c')] or list(sources)
+            # the uploaded headers are project code: keep them, prune everything else
+            include_roots = [str(upload_dir)] if main_file_only else None
+            for result in parse_project(targets, workers=parse_workers, main_file_only=main_file_only,
+                                        include_roots=include_roots,
+                                        use_cache=parse_cache is not None, compact=True):
+                # ASTs stay in the columnar CompactAST form from here on; node
+                # dicts are only built a batch at a time while pushing
+                ast = result.ast
+                if result.errors:
+                    st.warning(f"{Path(result.path).name}: {len(result.errors)} error(s), "
+                               f"first: {result.errors[0]}")
+                    ast = parse_c_code_str_to_compact(sources[result.path], filename=result.path,
+                                                      main_file_only=main_file_only, include_roots=include_roots)
+                # Push AST to Neo4j with the instance tag
+                push_ast_to_neo4j(ast, instance_id, store=graph_store, writers=graph_writers,
+                                  source=sources.get(result.path))
+                # Aggregate the files' top-level declarations under the first root
+                if aggregated_ast is None or not len(aggregated_ast):
+                    aggregated_ast = ast
+                else:
+                    aggregated_ast.graft(ast)
+        else:
+            # Use pasted code – treat as a single file
+            if not code.strip():
+                st.error('Please provide C code first')
+                st.stop()
+            # Unchanged code comes from the parse cache; otherwise keep the pasted
+            # document's TU across reruns and reparse it in place. Pasted code lives
+            # in the working directory, whose headers count as project code.
+            include_roots = [os.getcwd()] if main_file_only else None
+            if 'tu_manager' not in st.session_state:
+                st.session_state['tu_manager'] = TUManager(args=[f'-I{os.getcwd()}'])
+            tu_manager = st.session_state['tu_manager']
+            cache_key = (code_str_cache_key(parse_cache, code, main_file_only=main_file_only,
+                                            include_roots=include_roots) if parse_cache else None)
+            ast = parse_cache.lookup(cache_key) if parse_cache else None
+            if ast is None:
+                try:
+                    update = tu_manager.update('pasted', code)
+                    ast = tu_manager.ast_dict('pasted', main_file_only=main_file_only, include_roots=include_roots)
+                    if update.reparsed:
+                        st.caption(f"Reparsed in {update.elapsed * 1000:.0f} ms — changed: {len(update.changed)}, "
+                                   f"added: {len(update.added)}, removed: {len(update.removed)} declarations")
+                    if parse_cache is not None:
+                        parse_cache.store(cache_key, ast, update.tu)
+                except Exception:
+                    tmp = out_dir / 'tmp_input.c'
+                    tmp.write_text(code)
+                    ast = parse_c_file_to_ast_dict(str(tmp), main_file_only=main_file_only, cache=parse_cache,
+                                                   include_roots=[str(out_dir)] if main_file_only else None)
+            ast = CompactAST.from_dict(ast)
+            push_ast_to_neo4j(ast, instance_id, store=graph_store, source=code)
+            aggregated_ast = ast
+
+        st.success('AST pushed to the in-memory graph' if single_file else 'AST pushed to Neo4j')
+
+        # Attach embeddings
+        with st.spinner('Attaching embeddings (sample)...'):
             try:
-                ast = parse_c_code_str_to_ast(code)
-            except Exception:
-                tmp = out_dir / 'tmp_input.c'
-                tmp.write_text(code)
-                ast = parse_c_file_to_ast_dict(str(tmp))
-            # Push AST to Neo4j with the instance tag (update backend function accordingly)
-            push_ast_to_neo4j(ast, instance_id)
-            # Optionally aggregate the ASTs if later needed for conversion
-            if aggregated_ast is None:
-                aggregated_ast = ast
-            else:
-                # Merge ASTs as appropriate (this is simplified)
-                aggregated_ast['nodes'].extend(ast.get('nodes', []))
-    else:
-        # Use pasted code – treat as a single file
-        if not code.strip():
-            st.error('Please provide C code first')
-            st.stop()
-        try:
-            ast = parse_c_code_str_to_ast(code)
-        except Exception:
-            tmp = out_dir / 'tmp_input.c'
-            tmp.write_text(code)
-            ast = parse_c_file_to_ast_dict(str(tmp))
-        push_ast_to_neo4j(ast, instance_id)
-        aggregated_ast = ast
-
-    st.success('AST pushed to Neo4j')
-
-    # Attach embeddings
-    with st.spinner('Attaching embeddings (sample)...'):
-        try:
-            attach_embeddings_to_nodes(limit=2000, model=embed_model)
-        except Exception as e:
-            st.warning(f'Embedding step had an issue: {e}')
-        st.success('Embeddings attached (sample)')
+                attach_embeddings_to_nodes(limit=2000, model=embed_model, store=graph_store,
+                                           use_cache=use_embed_cache, migration_id=instance_id)
+            except Exception as e:
+                st.warning(f'Embedding step had an issue: {e}')
+            st.success('Embeddings attached (sample)')
 
-    # Convert C to Python using the aggregated code (or latest file's code)
-    with st.spinner('Converting C to OOP Python using Ollama...'):
+        # Convert C to Python using the aggregated code (or latest file's code),
+        # showing the Python as it streams in
+        st.subheader('Generated Python')
+        status = st.empty()
+        live_code = st.empty()
+        llm_client = get_llm_client()
+        calls_before = llm_client.call_count
+        status.info('Converting C to OOP Python...')
         try:
             # If multiple files, you might want to combine code in a custom way.
             # Here we simply use the code from the last processed file.
-            py = convert_c_to_python(code, model=model_choice)
+            py = ''
+            for py in convert_c_to_python_stream(code, model=model_choice, top_k_context=context_k,
+                                                 store=graph_store, migration_id=instance_id,
+                                                 embed_model=embed_model, workers=convert_workers,
+                                                 max_chunk_chars=chunk_chars, filename=code_path,
+                                                 use_cache=use_llm_cache):
+                live_code.code(py, language='python')
+            status.success('Conversion complete')
+        except ChunkConversionError as e:
+            # keep what did convert, but make the gaps impossible to miss
+            py = e.code
+            live_code.code(py, language='python')
+            status.warning(f"Conversion incomplete: {len(e.failed)} chunk(s) were not converted")
+            for title, error in e.failed:
+                st.warning(f"{title}: {error}")
         except Exception as e:
-            st.error(f'Conversion failed: {e}')
+            status.error(f'Conversion failed: {e}')
             py = ''
-        st.success('Conversion complete')
+            live_code.code('# conversion failed', language='python')
+        calls = llm_client.call_stats(since=calls_before)
+        if calls:
+            ttfts = sorted(c.ttft for c in calls)
+            rates = [c.tokens_per_s for c in calls if c.tokens_per_s]
+            st.caption(f"{len(calls)} LLM calls: median time to first token {ttfts[len(ttfts) // 2]:.2f}s, "
+                       f"{sum(rates) / len(rates) if rates else 0:.0f} tokens/sec on average")
+            with st.expander('LLM call timings'):
+                st.dataframe([c._asdict() for c in calls])
+    finally:
+        # parsing and conversion are done with the on-disk copies
+        if upload_dir is not None:
+            shutil.rmtree(upload_dir, ignore_errors=True)
 
     ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-    ast_path = out_dir / f'ast_{ts}.json'
+    ast_path = out_dir / f'ast_{ts}.compact.json'
     gen_path = out_dir / f'generated_{ts}.py'
-    ast_path.write_text(str(aggregated_ast))
+    # Interned/columnar serialization (CompactAST.from_json reads it back),
+    # a fraction of the size of the nested dict
+    aggregated_ast = aggregated_ast if aggregated_ast is not None else CompactAST()
+    ast_json = aggregated_ast.to_json()
+    ast_path.write_text(ast_json)
     gen_path.write_text(py)
 
-    st.subheader('Generated Python')
-    st.code(py if py else '# conversion failed', language='python')
     st.download_button('Download generated .py', data=py, file_name=gen_path.name, mime='text/x-python')
 
     st.subheader('AST (JSON)')
-    st.json(aggregated_ast)
-    st.download_button('Download AST JSON', data=str(aggregated_ast), file_name=ast_path.name)
-
-    st.info('Neo4j contains AST nodes labeled :ASTNode and relationships :CHILD')
+    if len(aggregated_ast) <= AST_PREVIEW_MAX_NODES:
+        st.json(aggregated_ast.to_dict())
+    else:
+        st.caption(f"{len(aggregated_ast)} nodes (~{aggregated_ast.memory_bytes() // 1024} KiB) — "
+                   f"too large to preview; download the compact JSON below")
+    st.download_button('Download AST JSON (compact)', data=ast_json, file_name=ast_path.name)
 
     # For a single file migration, delete the temporary graph instance after conversion.
-    if (files_to_process and len(files_to_process) == 1) or (not files_to_process):
-        delete_graph_instance(instance_id)
-        st.info("Temporary AST graph for this migration instance has been deleted.")
+    if single_file:
+        removed = delete_graph_instance(instance_id, store=graph_store)
+        st.info(f"Temporary AST graph for this migration instance has been deleted "
+                f"({removed['nodes']} nodes, {removed['relationships']} relationships).")
     else:
+        st.info('Neo4j contains AST nodes labeled :ASTNode and relationships :CHILD')
         st.info("Graph created for the multi‐file migration instance (preserving inter‐file relations).")
 
 st.markdown('---')
@@ -1,52 +1,231 @@
-"""Push AST dict into Neo4j as nodes and CHILD relationships."""
+"""Push AST dict (or CompactAST) into Neo4j as nodes and CHILD relationships."""
+import os
 import uuid
-from backend.neo4j_client import run_cypher
+import time
+from collections import defaultdict
+from backend.call_graph import CallGraphDeriver
+from backend.code_units import mark_code_units
+from backend.compact_ast import CompactAST
+from backend.graph_store import GraphStore, Neo4jGraphStore, get_graph_store
+from backend.parser import record_to_dict
 import ujson as json
-from typing import Dict, Any
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Set, Union
 
-def visit(node, instance_id, parent_id=None):
-    # Ensure each node has a unique id.
-    node_id = node.get("id")
-    if not node_id:
-        node_id = str(uuid.uuid4())
-        node["id"] = node_id
+# Number of nodes written per UNWIND transaction in bulk mode.
+DEFAULT_BATCH_SIZE = 1000
 
-    # Build properties from all keys except 'children'
-    props = {k: v for k, v in node.items() if k != "children"}
+def flatten_ast(ast_dict: dict) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """
+    Walk the AST in pre-order and yield (node_row, edge_row) pairs.
+    edge_row is None for the root. A parent is always yielded before its children.
+    """
+    stack = [(ast_dict, None)]
+    while stack:
+        node, parent_id = stack.pop()
+        node_id = node.get("id")
+        if not node_id:
+            node_id = str(uuid.uuid4())
+            node["id"] = node_id
+        props = {k: v for k, v in node.items() if k != "children"}
+        edge = {'parent_id': parent_id, 'child_id': node_id} if parent_id else None
+        yield {'node_id': node_id, 'props': props}, edge
+        for child in reversed(node.get("children", [])):
+            stack.append((child, node_id))
+
+def records_to_rows(records: Iterable, prefix: Optional[str] = None) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """
+    Turn parser ASTRecords into (node_row, edge_row) pairs as records arrive.
+    Sequential record ids are made globally unique with a per-stream prefix.
+    """
+    prefix = prefix or uuid.uuid4().hex
+    for rec in records:
+        node_id = f"{prefix}-{rec.node_id}"
+        props = record_to_dict(rec)
+        props['id'] = node_id
+        props['ordinal'] = rec.ordinal
+        edge = None
+        if rec.parent_id is not None:
+            edge = {'parent_id': f"{prefix}-{rec.parent_id}", 'child_id': node_id}
+        yield {'node_id': node_id, 'props': props}, edge
+
+def compact_rows(ast: CompactAST, prefix: Optional[str] = None) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """flatten_ast for a CompactAST: node dicts are built one row at a time, never the whole tree."""
+    for i, (node_row, edge_row) in enumerate(records_to_rows(ast.iter_records(), prefix)):
+        extra = ast.extras.get(i)
+        if extra:
+            node_row['props'].update((k, v) for k, v in extra.items() if k != 'id')
+        yield node_row, edge_row
+
+def ast_rows(ast: Union[dict, CompactAST]) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """(node_row, edge_row) pairs of a nested AST dict or a CompactAST, in pre-order."""
+    if isinstance(ast, CompactAST):
+        return compact_rows(ast)
+    return flatten_ast(ast)
+
+def symbol_link_rows(node_rows: Iterable[dict]) -> Dict[str, List[dict]]:
+    """
+    Group the Symbol links implied by a batch of node rows by relationship type:
+    a node with a USR DECLARES (or DEFINES) it, a reference REFERENCES its target.
+    """
+    links = defaultdict(list)
+    for row in node_rows:
+        props = row['props']
+        if props.get('usr'):
+            rel = 'DEFINES' if props.get('definition') else 'DECLARES'
+            links[rel].append({'node_id': row['node_id'], 'usr': props['usr'],
+                               'name': props.get('spelling'), 'kind': props.get('kind')})
+        elif props.get('ref_usr'):
+            links['REFERENCES'].append({'node_id': row['node_id'], 'usr': props['ref_usr'],
+                                        'name': props.get('spelling'), 'kind': None})
+    return links
+
+def is_repeated_header_decl(props: dict, main_file: Optional[str], known: Set[str],
+                            defined: Set[str]) -> bool:
+    """
+    True for a top-level declaration that comes from outside the main file and
+    whose USR is already in `known`, unless it is the first definition of that
+    USR (in `defined`), e.g. `struct S { ... }` after a forward `struct S;`.
+    Kept USRs are added to `known`, and to `defined` when they are definitions.
+    """
+    usr = props.get('usr')
+    if not usr:
+        return False
+    definition = bool(props.get('definition'))
+    if usr in known and (not definition or usr in defined):
+        if main_file is None or os.path.abspath(str(props.get('location'))) != main_file:
+            return True
+    known.add(usr)
+    if definition:
+        defined.add(usr)
+    return False
+
+def skip_repeated_headers(rows: Iterable[Tuple[dict, Optional[dict]]], known: Set[str],
+                          defined: Optional[Set[str]] = None) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """
+    Drop top-level header subtrees (e.g. a shared struct from student.h) whose
+    USR was already written for the instance, so every file including the
+    header does not add another copy. `known` and `defined` are the USRs
+    already declared and defined (see is_repeated_header_decl); a definition
+    is only dropped once its USR has one. Rows must be in pre-order with the
+    TU root first; everything after a skipped top-level row up to the next
+    one belongs to its subtree.
+    """
+    defined = set() if defined is None else defined
+    root_id = main_file = None
+    skipping = False
+    for node_row, edge_row in rows:
+        if root_id is None:
+            root_id = node_row['node_id']
+            spelling = node_row['props'].get('spelling')
+            main_file = os.path.abspath(spelling) if spelling else None
+        elif edge_row and edge_row['parent_id'] == root_id:
+            skipping = is_repeated_header_decl(node_row['props'], main_file, known, defined)
+        if not skipping:
+            yield node_row, edge_row
 
-    query = """
-    MERGE (n:ASTNode {node_id: $node_id})
-    SET n += $props, n.migration_id = $instance_id
+def push_rows_batched(rows: Iterable[Tuple[dict, Optional[dict]]], instance_id: str,
+                      batch_size: int = DEFAULT_BATCH_SIZE, store: Optional[GraphStore] = None,
+                      dedupe_symbols: bool = True, derive_edges: bool = True,
+                      source: Optional[str] = None) -> Optional[str]:
+    """
+    Write (node_row, edge_row) pairs in batches; on Neo4j that is one
+    parameterized UNWIND per transaction.
+    Each node batch is followed by the CHILD edges into it; since parents come
+    first, both ends of every edge already exist when it is merged. Nodes are
+    then linked to the instance's canonical Symbol per USR and, with
+    `dedupe_symbols`, header subtrees already written for the instance are skipped.
+    With `derive_edges`, the file's CALLS/USES_TYPE/READS_GLOBAL/WRITES_GLOBAL
+    edges (backend.call_graph) replace the ones from its previous ingest.
+    Code unit roots are annotated with their source text (backend.code_units);
+    pass `source` when the main file is not on disk.
+    Returns the id of the first (root) node.
     """
-    params = {'node_id': node_id, 'props': props, 'instance_id': instance_id}
-    run_cypher(query, params)
+    store = store or get_graph_store()
+    store.register_instance(instance_id)
+    start = time.perf_counter()
+    rows = mark_code_units(rows, source)
+    deriver = CallGraphDeriver() if derive_edges else None
+    if deriver:
+        # before header skipping, so globals declared in shared headers are known
+        rows = deriver.observe(rows)
+    if dedupe_symbols:
+        rows = skip_repeated_headers(rows, store.known_symbols(instance_id),
+                                     store.defined_symbols(instance_id))
+    root_id = None
+    nodes, edges = [], []
+    count = 0
 
-    # If there's a parent, create the relationship from parent to current node.
-    if parent_id:
-        rel_query = """
-        MATCH (p:ASTNode {node_id: $parent_id}), (c:ASTNode {node_id: $child_id})
-        MERGE (p)-[:CHILD]->(c)
-        """
-        rel_params = {'parent_id': parent_id, 'child_id': node_id}
-        run_cypher(rel_query, rel_params)
+    def flush():
+        if nodes:
+            store.write_nodes(nodes, instance_id)
+        if edges:
+            store.write_edges(edges)
+        for rel, links in symbol_link_rows(nodes).items():
+            store.write_symbol_links(rel, links, instance_id)
+        nodes.clear()
+        edges.clear()
 
-    # Process children if present, and pass current node id as parent_id.
-    for child in node.get("children", []):
-        visit(child, instance_id, parent_id=node_id)
-    return node_id
+    for node_row, edge_row in rows:
+        if root_id is None:
+            root_id = node_row['node_id']
+        nodes.append(node_row)
+        if edge_row:
+            edges.append(edge_row)
+        count += 1
+        if len(nodes) >= batch_size:
+            flush()
+    flush()
+    if deriver and deriver.source:
+        store.replace_derived_edges(instance_id, deriver.source, deriver.edges())
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"Pushed {count} AST nodes in {elapsed:.2f}s ({rate:.0f} nodes/sec)")
+    return root_id
+
+def push_ast_batched(ast_dict: Union[dict, CompactAST], instance_id: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                     store: Optional[GraphStore] = None, source: Optional[str] = None) -> str:
+    """Push a nested AST dict (or a CompactAST) in UNWIND batches."""
+    return push_rows_batched(ast_rows(ast_dict), instance_id, batch_size=batch_size, store=store,
+                             source=source)
+
+def push_records_to_neo4j(records: Iterable, instance_id: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                          store: Optional[GraphStore] = None, source: Optional[str] = None) -> Optional[str]:
+    """
+    Stream parser records straight into Neo4j, so writing starts while libclang
+    is still walking the tree, e.g. push_records_to_neo4j(iter_c_file_records(path), iid).
+    """
+    return push_rows_batched(records_to_rows(records), instance_id, batch_size=batch_size, store=store,
+                             source=source)
 
-def push_ast_to_neo4j(ast_dict: dict, instance_id: str):
+def push_ast_to_neo4j(ast_dict: Union[dict, CompactAST], instance_id: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                      store: Optional[GraphStore] = None, writers: int = 1, source: Optional[str] = None):
     """
-    Recursively push AST nodes into Neo4j with a migration instance identifier.
+    Push AST nodes into Neo4j (or another GraphStore) with a migration instance identifier.
+    `ast_dict` is a nested AST dict or a CompactAST.
+    Uses batched UNWIND ingestion; batch_size=0 writes one node (and its edge) at a time.
+    With writers > 1 on Neo4j, top-level subtrees are written concurrently
+    on the async driver (see backend.neo4j_async). `source` is the main file's
+    text when it is not on disk (pasted code), for code unit extraction.
     """
-    return visit(ast_dict, instance_id)
+    if not batch_size:
+        return push_ast_batched(ast_dict, instance_id, batch_size=1, store=store, source=source)
+    if writers > 1 and (store is None or isinstance(store, Neo4jGraphStore)):
+        store = store or get_graph_store()
+        store.register_instance(instance_id)
+        from backend.neo4j_async import push_ast_concurrently
+        return push_ast_concurrently(ast_dict, instance_id, workers=writers, batch_size=batch_size,
+                                     known_symbols=store.known_symbols(instance_id),
+                                     defined_symbols=store.defined_symbols(instance_id), source=source)
+    return push_ast_batched(ast_dict, instance_id, batch_size=batch_size, store=store, source=source)
 
 if __name__ == '__main__':
     import sys, pathlib
     if len(sys.argv) < 2:
-        print("Usage: python backend/ast_to_neo4j.py path/to/ast.json")
+        print("Usage: python backend/ast_to_neo4j.py path/to/ast.json [batch_size]")
         raise SystemExit(1)
     ast = json.loads(open(sys.argv[1]).read())
-    root = push_ast_to_neo4j(ast, "demo-instance")
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BATCH_SIZE
+    root = push_ast_to_neo4j(ast, "demo-instance", batch_size=batch_size)
     print("root node id", root)
 
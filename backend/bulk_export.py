@@ -0,0 +1,233 @@
+"""
+backend/bulk_export.py
+Stream ASTs into CSV files for `neo4j-admin database import full`, and load
+them with the offline importer when the caller says the database is empty
+(and stopped, which rules out asking the server). Symbols are deduplicated
+per USR across all files of an export and the call-graph edges between them
+are derived per file, as in batched ingestion. The export includes the
+instance's Migration node, so TTL sweeps see bulk-loaded instances too.
+"""
+import csv
+import gzip
+import hashlib
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from backend.ast_to_neo4j import records_to_rows, skip_repeated_headers, symbol_link_rows
+from backend.call_graph import CallGraphDeriver
+from backend.code_units import mark_code_units
+from backend.parser import ASTRecord, iter_c_file_records
+
+NODE_HEADER = ['node_id:ID(ASTNode)', 'kind', 'spelling', 'location', 'line:int', 'column:int',
+               'type', 'usr', 'ref_usr', 'definition:boolean', 'operator', 'ordinal:int', 'stub:boolean',
+               'unit:boolean', 'end_line:int', 'source', 'migration_id', ':LABEL']
+REL_HEADER = [':START_ID(ASTNode)', ':END_ID(ASTNode)', ':TYPE']
+SYMBOL_HEADER = ['symbol_id:ID(Symbol)', 'usr', 'name', 'kind', 'migration_id', ':LABEL']
+SYMBOL_REL_HEADER = [':START_ID(ASTNode)', ':END_ID(Symbol)', ':TYPE']
+DERIVED_HEADER = [':START_ID(Symbol)', ':END_ID(Symbol)', ':TYPE', 'source', 'count:int']
+MIGRATION_HEADER = ['migration_id:ID(Migration)', 'created_at:long', ':LABEL']
+
+def stable_prefix(migration_id: str, source: str) -> str:
+    """Id prefix for one source file; the same inputs always produce the same ids."""
+    digest = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:12]
+    return f"{migration_id}-{digest}"
+
+def _open(path: Path, compress: bool):
+    if compress:
+        return gzip.open(str(path) + '.gz', 'wt', newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+class CSVExporter:
+    """
+    Write node and CHILD relationship rows for any number of record streams
+    into one nodes.csv / relationships.csv pair (optionally gzip-compressed),
+    plus symbols.csv / symbol_links.csv for the canonical Symbol per USR and
+    derived.csv for the call-graph edges between Symbols and migrations.csv
+    for the instance's Migration node.
+    Header subtrees already exported from an earlier stream are skipped.
+    """
+
+    def __init__(self, out_dir: str, migration_id: str, compress: bool = False):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.migration_id = migration_id
+        self.compress = compress
+        suffix = '.gz' if compress else ''
+        self.nodes_path = self.out_dir / f'nodes.csv{suffix}'
+        self.rels_path = self.out_dir / f'relationships.csv{suffix}'
+        self.symbols_path = self.out_dir / f'symbols.csv{suffix}'
+        self.migrations_path = self.out_dir / f'migrations.csv{suffix}'
+        self.symbol_links_path = self.out_dir / f'symbol_links.csv{suffix}'
+        self.derived_path = self.out_dir / f'derived.csv{suffix}'
+        self._nodes_f = _open(self.out_dir / 'nodes.csv', compress)
+        self._rels_f = _open(self.out_dir / 'relationships.csv', compress)
+        self._links_f = _open(self.out_dir / 'symbol_links.csv', compress)
+        self._derived_f = _open(self.out_dir / 'derived.csv', compress)
+        self._nodes = csv.writer(self._nodes_f)
+        self._rels = csv.writer(self._rels_f)
+        self._links = csv.writer(self._links_f)
+        self._derived = csv.writer(self._derived_f)
+        self._nodes.writerow(NODE_HEADER)
+        self._rels.writerow(REL_HEADER)
+        self._links.writerow(SYMBOL_REL_HEADER)
+        self._derived.writerow(DERIVED_HEADER)
+        self.node_count = 0
+        self.rel_count = 0
+        self.symbols = {}  # usr -> [name, kind]
+        self._known = set()  # top-level USRs already exported
+        self._defined = set()  # ... and those exported with a definition
+
+    def write_records(self, records: Iterable[ASTRecord], prefix: str):
+        deriver = CallGraphDeriver()
+        rows = mark_code_units(records_to_rows(records, prefix=prefix))
+        rows = skip_repeated_headers(deriver.observe(rows), self._known, self._defined)
+        for node_row, edge_row in rows:
+            props = node_row['props']
+            node_id = node_row['node_id']
+            self._nodes.writerow([
+                node_id, props['kind'], props['spelling'], props['location'], props['line'],
+                props['column'], props['type'], props['usr'], props.get('ref_usr', ''),
+                'true' if props.get('definition') else 'false', props.get('operator', ''), props['ordinal'],
+                'true' if props.get('stub') else 'false', 'true' if props.get('unit') else 'false',
+                props.get('end_line', ''), props.get('source', ''), self.migration_id,
+                'ASTNode;CodeUnit' if props.get('unit') else 'ASTNode',
+            ])
+            self.node_count += 1
+            if edge_row:
+                self._rels.writerow([edge_row['parent_id'], node_id, 'CHILD'])
+                self.rel_count += 1
+            for rel, links in symbol_link_rows([node_row]).items():
+                for link in links:
+                    sym = self.symbols.setdefault(link['usr'], [link['name'], None])
+                    sym[1] = link['kind'] or sym[1]
+                    self._links.writerow([node_id, self._symbol_id(link['usr']), rel])
+                    self.rel_count += 1
+        for rel, edges in deriver.edges().items():
+            for edge in edges:
+                for usr in (edge['src'], edge['dst']):
+                    self.symbols.setdefault(usr, [None, None])
+                self._derived.writerow([self._symbol_id(edge['src']), self._symbol_id(edge['dst']),
+                                        rel, deriver.source, edge['count']])
+                self.rel_count += 1
+
+    def _symbol_id(self, usr: str) -> str:
+        return f"{self.migration_id}|{usr}"
+
+    def close(self):
+        with _open(self.out_dir / 'symbols.csv', self.compress) as f:
+            writer = csv.writer(f)
+            writer.writerow(SYMBOL_HEADER)
+            for usr, (name, kind) in self.symbols.items():
+                writer.writerow([self._symbol_id(usr), usr, name or '', kind or '', self.migration_id, 'Symbol'])
+        with _open(self.out_dir / 'migrations.csv', self.compress) as f:
+            writer = csv.writer(f)
+            writer.writerow(MIGRATION_HEADER)
+            writer.writerow([self.migration_id, int(time.time() * 1000), 'Migration'])
+        self._nodes_f.close()
+        self._rels_f.close()
+        self._links_f.close()
+        self._derived_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export_files(paths: Iterable[str], out_dir: str, migration_id: str, compress: bool = False,
+                 main_file_only: bool = False) -> CSVExporter:
+    """Parse each C file and stream its AST into the CSV pair under `out_dir`."""
+    start = time.perf_counter()
+    with CSVExporter(out_dir, migration_id, compress=compress) as exporter:
+        for path in paths:
+            exporter.write_records(iter_c_file_records(path, main_file_only=main_file_only),
+                                   stable_prefix(migration_id, path))
+    elapsed = time.perf_counter() - start
+    print(f"Exported {exporter.node_count} nodes, {len(exporter.symbols)} symbols and "
+          f"{exporter.rel_count} relationships in {elapsed:.2f}s to {out_dir}")
+    return exporter
+
+def neo4j_admin_path() -> Optional[str]:
+    return os.getenv('NEO4J_ADMIN') or shutil.which('neo4j-admin')
+
+def bulk_import(exporter: CSVExporter, database: str = 'neo4j', overwrite: bool = False):
+    """
+    Run the offline importer on the exported CSVs. neo4j-admin must run on the
+    database host and the target database must be stopped. Unless `overwrite`
+    is given, neo4j-admin refuses to import into an existing database.
+    """
+    admin = neo4j_admin_path()
+    if not admin:
+        raise RuntimeError("neo4j-admin not found; set NEO4J_ADMIN or add it to PATH")
+    cmd = [admin, 'database', 'import', 'full',
+           f'--nodes={exporter.nodes_path}', f'--nodes={exporter.symbols_path}',
+           f'--nodes={exporter.migrations_path}',
+           f'--relationships={exporter.rels_path}', f'--relationships={exporter.symbol_links_path}',
+           f'--relationships={exporter.derived_path}',
+           '--multiline-fields=true',  # code unit source text spans lines
+           f'--overwrite-destination={str(overwrite).lower()}', database]
+    subprocess.run(cmd, check=True)
+
+def load_files(paths: list, migration_id: str, out_dir: str = 'outputs/bulk', compress: bool = True,
+               main_file_only: bool = False, force: Optional[str] = None, empty_database: bool = False) -> str:
+    """
+    Load C files into the graph, choosing the fastest safe path: the offline
+    bulk importer when the caller states the database is empty and stopped
+    (`empty_database`; the importer overwrites it, and a stopped database
+    cannot be asked), batched transactions otherwise. `force` may be 'bulk'
+    (which still requires `empty_database`) or 'batched'. If the import
+    fails, the files are loaded batched instead. Returns the path taken.
+    """
+    from backend.ast_to_neo4j import push_rows_batched
+
+    mode = force
+    if mode is None:
+        mode = 'bulk' if empty_database and neo4j_admin_path() else 'batched'
+    elif mode == 'bulk' and not empty_database:
+        raise ValueError("the bulk import overwrites the target database; "
+                         "confirm it is empty and stopped with empty_database=True (--empty-database)")
+
+    start = time.perf_counter()
+    if mode == 'bulk':
+        exporter = export_files(paths, out_dir, migration_id, compress=compress, main_file_only=main_file_only)
+        try:
+            bulk_import(exporter, overwrite=True)
+        except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+            print(f"Bulk import failed ({e}); loading with batched transactions instead")
+            mode = 'batched'
+    if mode == 'batched':
+        for path in paths:
+            rows = records_to_rows(iter_c_file_records(path, main_file_only=main_file_only),
+                                   prefix=stable_prefix(migration_id, path))
+            push_rows_batched(rows, migration_id)
+    print(f"Loaded {len(paths)} file(s) via {mode} path in {time.perf_counter() - start:.2f}s")
+    return mode
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Export or load C ASTs for Neo4j.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    exp = sub.add_parser('export', help='write nodes/relationships CSVs for neo4j-admin import')
+    load = sub.add_parser('load', help='bulk import into an empty database, else batched transactions')
+    load.add_argument('--empty-database', action='store_true',
+                      help='the database is empty and stopped: use the offline importer')
+    for p in (exp, load):
+        p.add_argument('files', nargs='+')
+        p.add_argument('--migration-id', default='bulk-instance')
+        p.add_argument('--out', default='outputs/bulk')
+        p.add_argument('--main-file-only', action='store_true')
+    exp.add_argument('--gzip', action='store_true')
+    load.add_argument('--force', choices=['bulk', 'batched'])
+    args = parser.parse_args()
+    if args.cmd == 'load' and args.force == 'bulk' and not args.empty_database:
+        parser.error('--force bulk overwrites the database; add --empty-database to confirm it is empty')
+    if args.cmd == 'export':
+        export_files(args.files, args.out, args.migration_id, compress=args.gzip,
+                     main_file_only=args.main_file_only)
+    else:
+        load_files(args.files, args.migration_id, out_dir=args.out,
+                   main_file_only=args.main_file_only, force=args.force, empty_database=args.empty_database)
@@ -0,0 +1,160 @@
+"""Size-bounded on-disk key/value cache backed by SQLite, with LRU eviction."""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+# Keys per IN (...) query; stays under SQLite's default host-parameter limit.
+_SQL_VARS = 500
+
+class DiskCache:
+    """
+    Store bytes values under string keys in a single SQLite file.
+    Entries are evicted least-recently-used first once `max_bytes` is exceeded,
+    and expire after `ttl` seconds when a ttl is given.
+    Hit/miss counters are kept per instance.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: Optional[float] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)')
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: bytes):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, sqlite3.Binary(value), len(value), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def get_many(self, keys: Iterable[str], count: bool = True) -> Dict[str, bytes]:
+        """
+        Values for whichever of `keys` are present, in one transaction. Each key
+        counts as a hit or miss unless `count` is False (the caller counts).
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_VARS):
+                chunk = keys[i:i + _SQL_VARS]
+                marks = ','.join('?' * len(chunk))
+                for key, value, created in self._conn.execute(
+                        f'SELECT key, value, created FROM entries WHERE key IN ({marks})', chunk):
+                    if self.ttl is not None and now - created > self.ttl:
+                        continue
+                    found[key] = value
+            missing = [k for k in keys if k not in found]
+            if self.ttl is not None and missing:
+                # drop the expired ones among them
+                self._conn.executemany('DELETE FROM entries WHERE key = ? AND created < ?',
+                                       [(k, now - self.ttl) for k in missing])
+            self._conn.executemany('UPDATE entries SET accessed = ? WHERE key = ?',
+                                   [(now, k) for k in found])
+            self._conn.commit()
+            if count:
+                self.hits += len(found)
+                self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                [(k, sqlite3.Binary(v), len(v), now, now) for k, v in items.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.on_evict(key)
+            total -= size
+            self.evictions += 1
+
+    def record(self, hit: bool):
+        """Count one lookup, for callers that probe with get_many(count=False)."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def on_evict(self, key: str):
+        """Hook for subclasses that keep side files next to an entry."""
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def cache_dir() -> Path:
+    """Root directory for on-disk caches (CACHE_DIR, default outputs/cache)."""
+    return Path(os.getenv('CACHE_DIR', os.path.join('outputs', 'cache')))
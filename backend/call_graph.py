@@ -0,0 +1,122 @@
+"""
+backend/call_graph.py
+Derive function-level edges from parser output at ingest time.
+
+The pass rides along the (node_row, edge_row) stream that ingestion already
+produces and keeps only the current ancestor path. Per source file it counts:
+
+  CALLS          function -> called function        (CALL_EXPR)
+  USES_TYPE      function -> struct/union/typedef   (TYPE_REF, MEMBER_REF_EXPR)
+  READS_GLOBAL   function -> global variable        (DECL_REF_EXPR)
+  WRITES_GLOBAL  function -> global variable        (assigned, ++/--, address taken)
+
+Both ends are USRs of the instance's canonical Symbol nodes, so everything a
+function touches is one hop away from its Symbol.
+"""
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+DERIVED_EDGE_TYPES = ('CALLS', 'USES_TYPE', 'READS_GLOBAL', 'WRITES_GLOBAL')
+
+ASSIGNMENT_OPERATORS = frozenset({'=', '*=', '/=', '%=', '+=', '-=', '<<=', '>>=', '&=', '^=', '|='})
+MUTATING_UNARY_OPERATORS = frozenset({'++', '--', '&'})
+
+# Expressions that still denote (part of) their first operand's storage.
+_LVALUE_WRAPPERS = frozenset({'MEMBER_REF_EXPR', 'ARRAY_SUBSCRIPT_EXPR', 'PAREN_EXPR', 'UNEXPOSED_EXPR'})
+
+class CallGraphDeriver:
+    """
+    Feed one file's rows (root first, pre-order) through feed() or observe(),
+    then read edges(). Rows whose parent was never fed (e.g. the inside of a
+    header subtree skipped by ingestion) are ignored.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.globals = set()
+        self.counts = Counter()  # (rel, function usr, target usr) -> occurrences
+        # [node_id, props, ordinal, enclosing function usr, children seen]
+        self._path = []
+
+    def feed(self, node_row: dict, edge_row: Optional[dict]):
+        props = node_row['props']
+        if edge_row is None:
+            spelling = props.get('spelling')
+            self.source = os.path.abspath(spelling) if spelling else None
+            self._path = [[node_row['node_id'], props, 0, None, 0]]
+            return
+        path = self._path
+        while path and path[-1][0] != edge_row['parent_id']:
+            path.pop()
+        if not path:
+            return
+        parent = path[-1]
+        ordinal = parent[4]
+        parent[4] += 1
+        kind = props.get('kind')
+        function = parent[3]
+        if kind == 'FUNCTION_DECL' and props.get('definition'):
+            function = props.get('usr')
+        elif kind == 'VAR_DECL' and len(path) == 1 and props.get('usr'):
+            self.globals.add(props['usr'])
+        elif function and props.get('ref_usr'):
+            self._classify(function, kind, props['ref_usr'], ordinal)
+        path.append([node_row['node_id'], props, ordinal, function, 0])
+
+    def observe(self, rows: Iterable[Tuple[dict, Optional[dict]]]) -> Iterator[Tuple[dict, Optional[dict]]]:
+        """Pass rows through unchanged while deriving edges from them."""
+        for node_row, edge_row in rows:
+            self.feed(node_row, edge_row)
+            yield node_row, edge_row
+
+    def _classify(self, function: str, kind: str, target: str, ordinal: int):
+        if kind == 'CALL_EXPR':
+            self.counts['CALLS', function, target] += 1
+        elif kind == 'TYPE_REF':
+            self.counts['USES_TYPE', function, target] += 1
+        elif kind == 'MEMBER_REF_EXPR' and '@FI@' in target:
+            # field USRs extend their record's USR: c:@S@Student@FI@name
+            self.counts['USES_TYPE', function, target.rsplit('@FI@', 1)[0]] += 1
+        elif kind == 'DECL_REF_EXPR' and target in self.globals:
+            op = self._write_operator(ordinal)
+            if op != '=':
+                self.counts['READS_GLOBAL', function, target] += 1
+            if op is not None:
+                self.counts['WRITES_GLOBAL', function, target] += 1
+
+    def _write_operator(self, ordinal: int) -> Optional[str]:
+        """The operator that modifies the reference about to be appended, if any."""
+        for _, props, parent_ordinal, _, _ in reversed(self._path):
+            kind = props.get('kind')
+            if kind in _LVALUE_WRAPPERS and ordinal == 0:
+                ordinal = parent_ordinal
+                continue
+            op = props.get('operator')
+            if kind in ('BINARY_OPERATOR', 'COMPOUND_ASSIGNMENT_OPERATOR'):
+                return op if ordinal == 0 and op in ASSIGNMENT_OPERATORS else None
+            if kind == 'UNARY_OPERATOR':
+                return op if op in MUTATING_UNARY_OPERATORS else None
+            return None
+        return None
+
+    def edges(self) -> Dict[str, List[dict]]:
+        """Derived edges grouped by type as [{'src', 'dst', 'count'}] rows."""
+        grouped = defaultdict(list)
+        for (rel, src, dst), count in self.counts.items():
+            grouped[rel].append({'src': src, 'dst': dst, 'count': count})
+        return grouped
+
+if __name__ == '__main__':
+    import sys
+    from backend.ast_to_neo4j import records_to_rows
+    from backend.parser import iter_c_file_records
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.call_graph path/to/file.c")
+        raise SystemExit(1)
+    deriver = CallGraphDeriver()
+    for _ in deriver.observe(records_to_rows(iter_c_file_records(sys.argv[1]))):
+        pass
+    for rel, rows in sorted(deriver.edges().items()):
+        for row in sorted(rows, key=lambda r: (r['src'], r['dst'])):
+            print(f"{row['src']} -[{rel} x{row['count']}]-> {row['dst']}")
@@ -0,0 +1,302 @@
+"""
+backend/chunker.py
+Split a C file into declaration-aligned, class-sized chunks for conversion,
+and stitch the converted Python chunks back into one module.
+
+Units are the file's top-level definitions (functions, structs/unions/enums,
+typedefs, globals) sliced from the source by their libclang extents, with the
+comment block right above each. Units are grouped by the class layout from
+backend.layout: a struct, its typedefs and its methods form one chunk (split
+in source order when larger than CHUNK_MAX_CHARS); the remaining units are
+packed in source order. Each chunk carries the declarations it refers to from
+other chunks as read-only context.
+"""
+import ast
+import os
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from backend.layout import plan_layout, record_class_names
+
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', '4000'))
+CHUNK_CONTEXT_MAX_CHARS = int(os.getenv('CHUNK_CONTEXT_MAX_CHARS', '3000'))
+
+# A top-level definition; start/end are byte offsets, owner is its planned class.
+Unit = namedtuple('Unit', ['kind', 'name', 'start', 'end', 'text', 'owner'])
+# units in source order; context is C for reference only (not to be converted).
+Chunk = namedtuple('Chunk', ['index', 'title', 'owner', 'units', 'text', 'context'])
+
+_DEFINITION_ONLY = ('FUNCTION_DECL', 'STRUCT_DECL', 'UNION_DECL', 'ENUM_DECL', 'VAR_DECL')
+_TYPE_KINDS = ('STRUCT_DECL', 'UNION_DECL', 'ENUM_DECL', 'TYPEDEF_DECL')
+_IDENT = re.compile(r'[A-Za-z_]\w*')
+_DEFINE = re.compile(r'^\s*#\s*define\s+([A-Za-z_]\w*)')
+# the comment block source_units keeps above a unit
+_LEADING_COMMENTS = re.compile(r'\A(?:\s*(?://[^\n]*|/\*.*?\*/))*\s*', re.S)
+
+def _through_semicolon(data: bytes, end: int) -> int:
+    # declaration extents stop before the ';'
+    i = end
+    while i < len(data) and data[i:i + 1].isspace():
+        i += 1
+    return i + 1 if data[i:i + 1] == b';' else end
+
+def _with_leading_comment(data: bytes, start: int, floor: int) -> int:
+    """Move `start` back over the comment block directly above it (not past `floor`)."""
+    begin = i = start
+    while i > floor and data[i - 1:i] in (b' ', b'\t'):
+        i -= 1
+    while i > floor:
+        line_start = max(data.rfind(b'\n', floor, i - 1) + 1, floor)
+        line = data[line_start:i].strip()
+        if line.startswith(b'//'):
+            begin = i = line_start
+        elif line.endswith(b'*/'):
+            open_at = data.rfind(b'/*', floor, i)
+            if open_at < 0:
+                break
+            begin = i = max(data.rfind(b'\n', floor, open_at) + 1, floor)
+        else:
+            break
+    return begin
+
+def source_units(code: str, outline: list) -> List[Unit]:
+    """
+    Top-level definitions of `code` in source order, from an outline of
+    parser.parse_c_code_str_skeleton(..., bodies=True). Overlapping extents
+    (the struct inside `typedef struct {...} T;`) become one unit.
+    """
+    data = code.encode('utf-8')
+    records = record_class_names(outline)
+    plan = plan_layout(outline)
+    method_owner = {m: cls for cls, c in plan['classes'].items() for m in c['methods']}
+    found = []
+    for d in outline:
+        kind, name = d['kind'], d['name']
+        if kind in _DEFINITION_ONLY and not d.get('is_definition'):
+            continue
+        start, end = d['extent']
+        if kind != 'FUNCTION_DECL':
+            end = _through_semicolon(data, end)
+        if kind == 'FUNCTION_DECL':
+            owner = method_owner.get(name)
+        else:
+            owner = records.get(name) if kind in _TYPE_KINDS else None
+        found.append([kind, name, start, end, owner])
+    found.sort(key=lambda u: (u[2], -u[3]))
+    merged = []
+    for u in found:
+        if merged and u[2] < merged[-1][3]:
+            last = merged[-1]
+            last[3] = max(last[3], u[3])
+            last[4] = last[4] or u[4]
+            last[1] = last[1] or u[1]
+            continue
+        merged.append(u)
+    units = []
+    floor = 0
+    for kind, name, start, end, owner in merged:
+        start = _with_leading_comment(data, start, floor)
+        units.append(Unit(kind, name, start, end, data[start:end].decode('utf-8', errors='replace'), owner))
+        floor = end
+    return units
+
+def _pack(units: List[Unit], max_chars: int) -> List[List[Unit]]:
+    """Consecutive groups of at most `max_chars` (a larger unit stands alone)."""
+    groups, size = [], 0
+    for u in units:
+        if not groups or size + len(u.text) > max_chars:
+            groups.append([])
+            size = 0
+        groups[-1].append(u)
+        size += len(u.text)
+    return groups
+
+def _signature(u: Unit) -> str:
+    """The unit's declaration up to its body (storage class and return type included), on one line."""
+    head = _LEADING_COMMENTS.sub('', u.text, count=1)
+    head = head.split('{', 1)[0]
+    return ' '.join(head.split())
+
+def _defines(code: str) -> Dict[str, str]:
+    """#define lines (with continuations) by macro name."""
+    macros = {}
+    lines = code.splitlines()
+    i = 0
+    while i < len(lines):
+        m = _DEFINE.match(lines[i])
+        j = i
+        while lines[j].endswith('\\') and j + 1 < len(lines):
+            j += 1
+        if m:
+            macros.setdefault(m.group(1), '\n'.join(lines[i:j + 1]))
+        i = j + 1
+    return macros
+
+def _includes(code: str) -> List[str]:
+    lines = (line.strip() for line in code.splitlines())
+    return list(dict.fromkeys(line for line in lines if line.startswith('#include')))
+
+def _chunk_context(chunk_units: List[Unit], others: Dict[str, Unit], macros: Dict[str, str],
+                   includes: List[str], max_chars: int) -> str:
+    """Includes, macros and other chunks' declarations the chunk refers to."""
+    names = set(_IDENT.findall('\n'.join(u.text for u in chunk_units)))
+    own = {u.name for u in chunk_units}
+    lines = list(includes)
+    lines += [macros[n] for n in sorted(names & macros.keys())]
+    for name in sorted(names & others.keys() - own):
+        u = others[name]
+        if u.kind == 'FUNCTION_DECL':
+            target = f"{u.owner}.{u.name}" if u.owner else u.name
+            lines.append(f"{_signature(u)};  // Python: {target}")
+        else:
+            lines.append(u.text if len(u.text) <= 600 else _signature(u) + ' ...')
+    context = '\n'.join(lines)
+    if len(context) > max_chars:
+        context = context[:max_chars].rsplit('\n', 1)[0] + '\n// ... (context truncated)'
+    return context
+
+def plan_chunks(code: str, outline: list, max_chars: int = CHUNK_MAX_CHARS,
+                context_chars: int = CHUNK_CONTEXT_MAX_CHARS) -> List[Chunk]:
+    """Declaration-aligned chunks of `code`, each a class (or part of one) or a run of other units."""
+    units = source_units(code, outline)
+    by_owner, free = {}, []
+    for u in units:
+        if u.owner:
+            by_owner.setdefault(u.owner, []).append(u)
+        else:
+            free.append(u)
+    drafts = []
+    for owner, owned in by_owner.items():
+        parts = _pack(owned, max_chars)
+        for i, part in enumerate(parts, 1):
+            title = f"class {owner}" + (f" (part {i}/{len(parts)})" if len(parts) > 1 else '')
+            drafts.append((part[0].start, title, owner, part))
+    for i, part in enumerate(_pack(free, max_chars), 1):
+        drafts.append((part[0].start, f"module part {i}", None, part))
+    drafts.sort(key=lambda d: d[0])
+
+    others = {}
+    for u in units:
+        if u.name:
+            others.setdefault(u.name, u)
+    macros, includes = _defines(code), _includes(code)
+    return [Chunk(i, title, owner, part, '\n\n'.join(u.text for u in part),
+                  _chunk_context(part, others, macros, includes, context_chars))
+            for i, (_, title, owner, part) in enumerate(drafts)]
+
+def _segment(lines: List[str], node: ast.AST) -> str:
+    start = min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])])
+    return '\n'.join(lines[start - 1:node.end_lineno])
+
+def _member_name(node: ast.AST) -> Optional[str]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.name
+    if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+        return node.targets[0].id
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return node.target.id
+    return None
+
+def _is_main_guard(node: ast.AST) -> bool:
+    test = getattr(node, 'test', None)
+    return (isinstance(node, ast.If) and isinstance(test, ast.Compare)
+            and isinstance(test.left, ast.Name) and test.left.id == '__name__')
+
+def stitch_modules(parts: List[str]) -> str:
+    """
+    Join converted chunks into one module: module docstrings merged, imports
+    deduplicated and hoisted, classes split across chunks merged (first
+    definition of a member wins), duplicate functions resolved to the fullest
+    definition, and a single `if __name__ == '__main__'` block at the end.
+    Chunks that do not parse are appended verbatim.
+    """
+    docstrings, future, imports, from_imports = [], {}, {}, {}
+    blocks, by_name, seen_text = [], {}, set()
+    main_guard, verbatim = None, []
+    for n, part in enumerate(parts):
+        try:
+            tree = ast.parse(part)
+        except SyntaxError:
+            verbatim.append(f"# --- chunk {n} could not be parsed; included as generated ---\n{part.strip()}")
+            continue
+        lines = part.splitlines()
+        body = tree.body
+        doc = ast.get_docstring(tree, clean=True)
+        if doc:
+            docstrings.append(doc)
+            body = body[1:]
+        for node in body:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    imports.setdefault((alias.name, alias.asname), None)
+            elif isinstance(node, ast.ImportFrom):
+                target = future if node.module == '__future__' else from_imports
+                names = target.setdefault(('.' * node.level) + (node.module or ''), {})
+                for alias in node.names:
+                    names.setdefault((alias.name, alias.asname), None)
+            elif _is_main_guard(node):
+                text = _segment(lines, node)
+                if main_guard is None or len(text) > len(main_guard):
+                    main_guard = text
+            else:
+                name = _member_name(node)
+                text = _segment(lines, node)
+                is_def = isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                key = ('def' if is_def else type(node).__name__, name)
+                existing = by_name.get(key) if name else None
+                if existing is None:
+                    if not name and text in seen_text:
+                        continue
+                    seen_text.add(text)
+                    block = {'text': text, 'members': set()}
+                    if isinstance(node, ast.ClassDef):
+                        block['members'] = {_member_name(s) for s in node.body} - {None}
+                    blocks.append(block)
+                    if name:
+                        by_name[key] = block
+                elif isinstance(node, ast.ClassDef):
+                    for stmt in node.body:
+                        member = _member_name(stmt)
+                        if member and member not in existing['members']:
+                            existing['text'] += '\n\n' + _segment(lines, stmt)
+                            existing['members'].add(member)
+                elif is_def and len(text) > len(existing['text']):
+                    # a chunk may stub out a function another chunk defines
+                    existing['text'] = text
+
+    out = []
+    if docstrings:
+        doc = '\n\n'.join(dict.fromkeys(docstrings)).replace('"""', '\\"\\"\\"')
+        out.append(f'"""\n{doc}\n"""')
+    header = []
+    for module, names in future.items():
+        header.append(f"from {module} import " + ', '.join(_alias(*a) for a in names))
+    header += [f"import {_alias(*a)}" for a in imports]
+    for module, names in from_imports.items():
+        header.append(f"from {module} import " + ', '.join(_alias(*a) for a in names))
+    if header:
+        out.append('\n'.join(header))
+    out += [b['text'] for b in blocks]
+    out += verbatim
+    if main_guard:
+        out.append(main_guard)
+    return '\n\n\n'.join(out) + '\n'
+
+def _alias(name: str, asname: Optional[str]) -> str:
+    return f"{name} as {asname}" if asname else name
+
+if __name__ == '__main__':
+    import sys
+    from backend.parser import parse_c_code_str_skeleton
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.chunker path/to/file.c [max_chars]")
+        raise SystemExit(1)
+    path = sys.argv[1]
+    max_chars = int(sys.argv[2]) if len(sys.argv) > 2 else CHUNK_MAX_CHARS
+    code = open(path).read()
+    chunks = plan_chunks(code, parse_c_code_str_skeleton(code, filename=path, bodies=True), max_chars)
+    for c in chunks:
+        print(f"{c.index:>4} {c.title:<40} {len(c.units):>3} units {len(c.text):>6} chars "
+              f"(+{len(c.context)} context)")
+    print(f"{len(chunks)} chunks, {sum(len(c.text) for c in chunks)} of {len(code)} source chars")
@@ -0,0 +1,114 @@
+"""
+backend/code_units.py
+Extract embeddable code units from parser output at ingest time.
+
+A code unit is a top-level function definition, struct/union/enum
+definition, typedef or global variable of the main file or of a project
+header (one under the main file's directory), with the exact source text of
+its libclang extent (extent_start/extent_end on top-level records). The
+unit is attached to its AST subtree root: that node gets `unit: true` and
+`source` (next to `end_line`), and is labelled CodeUnit in Neo4j. Only code
+units are embedded (see backend.vectorizer).
+"""
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+UNIT_KINDS = frozenset({'FUNCTION_DECL', 'STRUCT_DECL', 'UNION_DECL', 'ENUM_DECL',
+                        'TYPEDEF_DECL', 'VAR_DECL'})
+
+# Prototypes, forward declarations and `extern` variable declarations carry
+# no code worth embedding.
+_DEFINITION_ONLY = frozenset({'FUNCTION_DECL', 'STRUCT_DECL', 'UNION_DECL', 'ENUM_DECL', 'VAR_DECL'})
+
+def load_source(root_props: dict, source: Optional[str] = None) -> Optional[bytes]:
+    """The main file's bytes: `source` if given, else the file named by the TU root."""
+    if source is not None:
+        return source.encode('utf-8')
+    path = root_props.get('spelling')
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+def is_unit(props: dict) -> bool:
+    """True for a top-level cursor that forms a code unit, wherever it lives."""
+    kind = props.get('kind')
+    if kind not in UNIT_KINDS or props.get('extent_start') is None or not props.get('spelling'):
+        return False
+    return kind not in _DEFINITION_ONLY or bool(props.get('definition'))
+
+def _unit_file_bytes(location, main_file: Optional[str], files: Dict[str, Optional[bytes]]) -> Optional[bytes]:
+    # the main file's bytes are seeded into `files`; project headers are read once
+    if location is None or main_file is None:
+        return files.get(main_file)
+    path = os.path.abspath(str(location))
+    if path not in files:
+        root = os.path.dirname(main_file)
+        inside = os.path.commonpath([root, path]) == root
+        files[path] = load_source({'spelling': path}) if inside else None
+    return files[path]
+
+def annotate_unit(props: dict, main_file: Optional[str], files: Dict[str, Optional[bytes]]) -> bool:
+    """
+    Set `unit` and `source` on a top-level node's props if it forms a code
+    unit. `files` maps absolute paths to their bytes (None: not a project file)
+    and is filled in as project headers are met.
+    """
+    if not is_unit(props):
+        return False
+    data = _unit_file_bytes(props.get('location'), main_file, files)
+    if data is None:
+        return False
+    text = data[props['extent_start']:props['extent_end']].decode('utf-8', errors='replace')
+    if not text.strip():
+        return False
+    props['unit'] = True
+    props['source'] = text
+    return True
+
+def mark_code_units(rows: Iterable[Tuple[dict, Optional[dict]]],
+                    source: Optional[str] = None) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """
+    Pass (node_row, edge_row) pairs through, annotating the code unit roots.
+    Rows must be in pre-order with the TU root first. Without `source` the
+    main file is read from disk; if it cannot be, no units are marked.
+    """
+    root_id = main_file = None
+    files = {}
+    for node_row, edge_row in rows:
+        if root_id is None:
+            root_id = node_row['node_id']
+            spelling = node_row['props'].get('spelling')
+            main_file = os.path.abspath(spelling) if spelling else None
+            files[main_file] = load_source(node_row['props'], source)
+            if files[main_file] is None:
+                print(f"No source for {spelling}; main file code units not extracted")
+        elif edge_row and edge_row['parent_id'] == root_id:
+            annotate_unit(node_row['props'], main_file, files)
+        yield node_row, edge_row
+
+def extract_code_units(ast_dict: dict, source: Optional[str] = None) -> List[dict]:
+    """Code units of a nested AST dict as [{'kind', 'spelling', 'line', 'end_line', 'source'}]."""
+    main_file = os.path.abspath(ast_dict['spelling']) if ast_dict.get('spelling') else None
+    files = {main_file: load_source(ast_dict, source)}
+    units = []
+    for child in ast_dict.get('children', []):
+        props = {k: v for k, v in child.items() if k != 'children'}
+        if annotate_unit(props, main_file, files):
+            units.append({k: props.get(k) for k in ('kind', 'spelling', 'line', 'end_line', 'source')})
+    return units
+
+def unit_text(props: dict, max_chars: int) -> str:
+    """The text embedded for a code unit: its kind and name, then its source."""
+    return f"{props.get('kind')} {props.get('spelling')}\n{(props.get('source') or '')[:max_chars]}"
+
+if __name__ == '__main__':
+    import sys
+    from backend.parser import parse_c_file_to_ast_dict
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.code_units path/to/file.c")
+        raise SystemExit(1)
+    ast = parse_c_file_to_ast_dict(sys.argv[1])
+    for u in extract_code_units(ast):
+        print(f"{u['kind']:<14} {u['spelling']:<24} lines {u['line']}-{u['end_line']} "
+              f"({len(u['source'])} chars)")
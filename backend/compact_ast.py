@@ -0,0 +1,348 @@
+"""
+backend/compact_ast.py
+Columnar, string-interned AST container.
+
+Instead of one dict per cursor, every node is a row index into parallel
+integer arrays; kind, file, type, spelling and USR strings are stored once
+in string tables. Nodes are kept in document order, so a node's subtree is
+the contiguous run of rows that follows it.
+"""
+from array import array
+from typing import Iterable, Iterator, Optional
+
+import ujson as json
+
+from backend.parser import ASTRecord, build_ast_dict
+
+FORMAT = 'compact-ast/1'
+
+# Keys of the dict format that are stored column-wise; anything else on a
+# node (e.g. 'id', 'pruned_nodes', the extents of top-level cursors) is kept
+# in a sparse per-node extras map.
+_EXTENT_KEYS = ('extent_start', 'extent_end', 'end_line')
+_COLUMN_KEYS = {'kind', 'spelling', 'location', 'line', 'column', 'type', 'usr', 'stub',
+                'ref_usr', 'definition', 'operator', 'children'}
+
+class StringTable:
+    """Append-only list of unique strings with a reverse index."""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values = []
+        self._index = {}
+        for v in values:
+            self.intern(v)
+
+    def intern(self, value: str) -> int:
+        idx = self._index.get(value)
+        if idx is None:
+            idx = len(self.values)
+            self.values.append(value)
+            self._index[value] = idx
+        return idx
+
+    def __getitem__(self, idx: int) -> str:
+        return self.values[idx]
+
+    def __len__(self):
+        return len(self.values)
+
+class NodeView:
+    """Lazy read-only view of one row of a CompactAST."""
+    __slots__ = ('ast', 'index')
+
+    def __init__(self, ast: 'CompactAST', index: int):
+        self.ast = ast
+        self.index = index
+
+    kind = property(lambda self: self.ast.kinds[self.ast.kind[self.index]])
+    spelling = property(lambda self: self.ast.strings[self.ast.spelling[self.index]])
+    type = property(lambda self: self.ast.types[self.ast.type[self.index]])
+    usr = property(lambda self: self.ast.strings[self.ast.usr[self.index]])
+    line = property(lambda self: self.ast.line[self.index])
+    column = property(lambda self: self.ast.column[self.index])
+    stub = property(lambda self: bool(self.ast.stub[self.index]))
+    definition = property(lambda self: bool(self.ast.definition[self.index]))
+
+    @property
+    def ref_usr(self) -> Optional[str]:
+        r = self.ast.ref_usr[self.index]
+        return None if r < 0 else self.ast.strings[r]
+
+    @property
+    def operator(self) -> Optional[str]:
+        o = self.ast.operator[self.index]
+        return None if o < 0 else self.ast.strings[o]
+
+    @property
+    def file(self) -> Optional[str]:
+        f = self.ast.file[self.index]
+        return None if f < 0 else self.ast.files[f]
+
+    @property
+    def parent(self) -> Optional['NodeView']:
+        p = self.ast.parent[self.index]
+        return None if p < 0 else NodeView(self.ast, p)
+
+    @property
+    def children(self) -> Iterator['NodeView']:
+        return (NodeView(self.ast, c) for c in self.ast.child_indices(self.index))
+
+    def __repr__(self):
+        return f"<NodeView {self.index} {self.kind} {self.spelling!r}>"
+
+class CompactAST:
+    """
+    Parallel arrays (array module) indexed by node row, plus string tables.
+    Build with from_records() straight from the parser, or from_dict() from
+    an existing nested AST; to_dict() converts back losslessly.
+    """
+
+    def __init__(self):
+        self.kinds = StringTable()
+        self.files = StringTable()
+        self.types = StringTable()
+        self.strings = StringTable()  # spellings and USRs (own and referenced)
+        self.parent = array('i')
+        self.kind = array('H')
+        self.file = array('i')
+        self.type = array('i')
+        self.spelling = array('i')
+        self.usr = array('i')
+        self.line = array('I')
+        self.column = array('I')
+        self.stub = array('b')
+        self.ref_usr = array('i')
+        self.definition = array('b')
+        self.operator = array('i')
+        self.extras = {}
+        self.empty_children = True
+        self._first_child = None
+        self._next_sibling = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    def append(self, parent: int, kind: str, spelling: str, type_: str, usr: str,
+               file: Optional[str], line: int, column: int, stub: bool = False,
+               ref_usr: Optional[str] = None, definition: bool = False,
+               operator: Optional[str] = None) -> int:
+        self.parent.append(parent)
+        self.kind.append(self.kinds.intern(kind))
+        self.file.append(-1 if file is None else self.files.intern(file))
+        self.type.append(self.types.intern(type_))
+        self.spelling.append(self.strings.intern(spelling))
+        self.usr.append(self.strings.intern(usr))
+        self.line.append(line)
+        self.column.append(column)
+        self.stub.append(1 if stub else 0)
+        self.ref_usr.append(-1 if not ref_usr else self.strings.intern(ref_usr))
+        self.definition.append(1 if definition else 0)
+        self.operator.append(-1 if not operator else self.strings.intern(operator))
+        self._first_child = None
+        return len(self.parent) - 1
+
+    @classmethod
+    def from_records(cls, records: Iterable[ASTRecord], empty_children: bool = True) -> 'CompactAST':
+        """
+        Build from parser records (e.g. iter_c_file_records). Record node ids
+        must be the sequential document-order ids iter_ast_records assigns.
+        """
+        ast = cls()
+        ast.empty_children = empty_children
+        pruned = 0
+        for rec in records:
+            if rec.node_id != len(ast):
+                raise ValueError(f"record {rec.node_id} out of document order")
+            ast.append(-1 if rec.parent_id is None else rec.parent_id, rec.kind, rec.spelling,
+                       rec.type, rec.usr, rec.file, rec.line, rec.column, rec.stub,
+                       rec.ref_usr, rec.definition, rec.operator)
+            if rec.extent:
+                ast.extras[rec.node_id] = dict(zip(_EXTENT_KEYS, rec.extent))
+            pruned += rec.stub
+        if pruned:
+            ast.extras.setdefault(0, {})['pruned_nodes'] = pruned
+        return ast
+
+    @classmethod
+    def from_dict(cls, root: dict) -> 'CompactAST':
+        """Build from the nested dict format produced by backend.parser."""
+        ast = cls()
+        if not root:
+            return ast
+        ast.empty_children = None
+        stack = [(root, -1)]
+        while stack:
+            node, parent = stack.pop()
+            location = node.get('location')
+            idx = ast.append(parent, node['kind'], node['spelling'], node['type'], node['usr'],
+                             None if location in (None, 'None') else location,
+                             node['line'], node['column'], node.get('stub', False),
+                             node.get('ref_usr'), node.get('definition', False), node.get('operator'))
+            extra = {k: v for k, v in node.items() if k not in _COLUMN_KEYS}
+            if extra:
+                ast.extras[idx] = extra
+            children = node.get('children')
+            if ast.empty_children is None and not children:
+                ast.empty_children = children is not None
+            for child in reversed(children or []):
+                stack.append((child, idx))
+        if ast.empty_children is None:
+            ast.empty_children = True
+        return ast
+
+    def iter_records(self) -> Iterator[ASTRecord]:
+        child_count = array('I', [0]) * len(self)
+        for i in range(len(self)):
+            p = self.parent[i]
+            f = self.file[i]
+            r = self.ref_usr[i]
+            o = self.operator[i]
+            ordinal = 0
+            if p >= 0:
+                ordinal = child_count[p]
+                child_count[p] += 1
+            extra = self.extras.get(i)
+            extent = None
+            if extra and _EXTENT_KEYS[0] in extra:
+                extent = tuple(extra[k] for k in _EXTENT_KEYS)
+            yield ASTRecord(
+                i, None if p < 0 else p, ordinal,
+                self.kinds[self.kind[i]], self.strings[self.spelling[i]], self.types[self.type[i]],
+                self.strings[self.usr[i]], None if f < 0 else self.files[f],
+                self.line[i], self.column[i], bool(self.stub[i]),
+                None if r < 0 else self.strings[r], bool(self.definition[i]),
+                None if o < 0 else self.strings[o], extent,
+            )
+
+    def graft(self, other: 'CompactAST'):
+        """
+        Append the top-level subtrees of `other` under this root, e.g. to
+        aggregate the files of a project into one tree. `other`'s root row is
+        dropped, as are the extras on it.
+        """
+        if not len(self):
+            raise ValueError("cannot graft onto an empty CompactAST")
+        offset = len(self) - 1  # other's row i (i >= 1) becomes row offset + i
+        for rec in other.iter_records():
+            if rec.parent_id is None:
+                continue
+            self.append(0 if rec.parent_id == 0 else offset + rec.parent_id, rec.kind, rec.spelling,
+                        rec.type, rec.usr, rec.file, rec.line, rec.column, rec.stub,
+                        rec.ref_usr, rec.definition, rec.operator)
+        for i, extra in other.extras.items():
+            if i:
+                self.extras[offset + i] = dict(extra)
+
+    def to_dict(self) -> dict:
+        """Convert back to the nested dict format."""
+        if not len(self):
+            return {}
+        root = build_ast_dict(self.iter_records(), empty_children=self.empty_children)
+        # pruned_nodes, like any other non-column key, comes back from extras
+        root.pop('pruned_nodes', None)
+        if self.extras:
+            # rows are in pre-order; walk the dict the same way
+            stack, i = [root], 0
+            while stack:
+                node = stack.pop()
+                if i in self.extras:
+                    node.update(self.extras[i])
+                i += 1
+                stack.extend(reversed(node.get('children', [])))
+        return root
+
+    def node(self, index: int) -> NodeView:
+        return NodeView(self, index)
+
+    @property
+    def root(self) -> Optional[NodeView]:
+        return NodeView(self, 0) if len(self) else None
+
+    def _build_links(self):
+        n = len(self)
+        first = array('i', [-1]) * n
+        nxt = array('i', [-1]) * n
+        last = array('i', [-1]) * n
+        for i in range(1, n):
+            p = self.parent[i]
+            if first[p] < 0:
+                first[p] = i
+            else:
+                nxt[last[p]] = i
+            last[p] = i
+        self._first_child, self._next_sibling = first, nxt
+
+    def child_indices(self, index: int) -> Iterator[int]:
+        if self._first_child is None:
+            self._build_links()
+        c = self._first_child[index]
+        while c >= 0:
+            yield c
+            c = self._next_sibling[c]
+
+    def memory_bytes(self) -> int:
+        """Approximate payload size: arrays plus string table contents."""
+        arrays = (self.parent, self.kind, self.file, self.type, self.spelling,
+                  self.usr, self.line, self.column, self.stub, self.ref_usr, self.definition,
+                  self.operator)
+        size = sum(a.itemsize * len(a) for a in arrays)
+        for table in (self.kinds, self.files, self.types, self.strings):
+            size += sum(len(s) for s in table.values)
+        return size
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'format': FORMAT,
+            'kinds': self.kinds.values, 'files': self.files.values,
+            'types': self.types.values, 'strings': self.strings.values,
+            'parent': self.parent.tolist(), 'kind': self.kind.tolist(), 'file': self.file.tolist(),
+            'type': self.type.tolist(), 'spelling': self.spelling.tolist(), 'usr': self.usr.tolist(),
+            'line': self.line.tolist(), 'column': self.column.tolist(), 'stub': self.stub.tolist(),
+            'ref_usr': self.ref_usr.tolist(), 'definition': self.definition.tolist(),
+            'operator': self.operator.tolist(),
+            'extras': {str(k): v for k, v in self.extras.items()},
+            'empty_children': self.empty_children,
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> 'CompactAST':
+        data = json.loads(text)
+        if data.get('format') != FORMAT:
+            raise ValueError(f"not a {FORMAT} document")
+        ast = cls()
+        ast.kinds = StringTable(data['kinds'])
+        ast.files = StringTable(data['files'])
+        ast.types = StringTable(data['types'])
+        ast.strings = StringTable(data['strings'])
+        for name in ('parent', 'kind', 'file', 'type', 'spelling', 'usr', 'line', 'column', 'stub'):
+            getattr(ast, name).extend(data[name])
+        # documents written before the symbol/operator columns existed lack them
+        n = len(ast.parent)
+        ast.ref_usr.extend(data.get('ref_usr') or [-1] * n)
+        ast.definition.extend(data.get('definition') or [0] * n)
+        ast.operator.extend(data.get('operator') or [-1] * n)
+        ast.extras = {int(k): v for k, v in data['extras'].items()}
+        ast.empty_children = data['empty_children']
+        return ast
+
+def parse_c_file_to_compact(path: str, main_file_only: bool = False,
+                            include_roots: Optional[list] = None) -> CompactAST:
+    """Parse a C file straight into a CompactAST without building node dicts."""
+    from backend.parser import iter_c_file_records
+    return CompactAST.from_records(iter_c_file_records(path, main_file_only, include_roots))
+
+def parse_c_code_str_to_compact(code: str, filename='temp.c', main_file_only: bool = False,
+                                include_roots: Optional[list] = None) -> CompactAST:
+    """String-input counterpart of parse_c_file_to_compact."""
+    from backend.parser import iter_c_code_str_records
+    records = iter_c_code_str_records(code, filename, main_file_only, include_roots)
+    return CompactAST.from_records(records, empty_children=False)
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.compact_ast path/to/file.c")
+        raise SystemExit(1)
+    ast = parse_c_file_to_compact(sys.argv[1])
+    print(f"{len(ast)} nodes, {len(ast.kinds)} kinds, {len(ast.files)} files, "
+          f"{len(ast.types)} types, {len(ast.strings)} strings, ~{ast.memory_bytes()} bytes")
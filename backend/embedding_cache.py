@@ -0,0 +1,54 @@
+"""Persistent cache of text embeddings keyed by model and normalized text."""
+import hashlib
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from backend.cache import DiskCache, cache_dir
+
+EMBED_CACHE_MAX_BYTES = int(os.getenv('EMBED_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share an entry."""
+    return ' '.join(text.split())
+
+class EmbeddingCache(DiskCache):
+    """
+    Embeddings stored as raw float32 bytes (4 bytes per dimension instead of
+    JSON text), keyed by a hash of the model name and the normalized text.
+    Size-bounded with LRU eviction like every DiskCache.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = EMBED_CACHE_MAX_BYTES):
+        super().__init__(path or str(cache_dir() / 'embeddings.sqlite'), max_bytes=max_bytes)
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        h = hashlib.sha256(model.encode('utf-8'))
+        h.update(b'\0' + normalize_text(text).encode('utf-8'))
+        return h.hexdigest()
+
+    def lookup(self, model: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """Cached vectors for whichever of `texts` have one, keyed by text."""
+        keys = {self.make_key(model, t): t for t in texts}
+        found = {}
+        for key, blob in self.get_many(keys).items():
+            vec = array('f')
+            vec.frombytes(blob)
+            found[keys[key]] = vec.tolist()
+        return found
+
+    def store(self, model: str, embeddings: Dict[str, List[float]]):
+        self.put_many({self.make_key(model, t): array('f', v).tobytes() for t, v in embeddings.items()})
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _default_cache
+    # retrieval runs in conversion worker threads
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+    return _default_cache
@@ -0,0 +1,534 @@
+"""
+backend/graph_store.py
+Pluggable storage for the AST graph.
+
+The pipeline only needs a handful of graph operations: bulk node/edge
+ingestion, canonical per-USR Symbol nodes and the call/type-usage edges
+derived between them, reading node properties back for context and
+embedding, attaching embeddings, nearest-neighbour search over them and
+deleting a migration instance. GraphStore names them;
+Neo4jGraphStore runs them as Cypher, MemoryGraphStore keeps everything in
+process (adjacency lists plus property indexes) for throwaway single-file
+runs and for use without a database.
+"""
+import heapq
+import math
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from backend.call_graph import DERIVED_EDGE_TYPES
+from backend.neo4j_client import run_cypher, write_batches
+
+NODE_BATCH_QUERY = """
+UNWIND $rows AS row
+MERGE (n:ASTNode {node_id: row.node_id})
+SET n += row.props, n.migration_id = $instance_id
+FOREACH (_ IN CASE WHEN row.props.unit THEN [1] ELSE [] END | SET n:CodeUnit)
+"""
+
+EDGE_BATCH_QUERY = """
+UNWIND $rows AS row
+MATCH (p:ASTNode {node_id: row.parent_id}), (c:ASTNode {node_id: row.child_id})
+MERGE (p)-[:CHILD]->(c)
+"""
+
+EMBEDDING_BATCH_QUERY = """
+UNWIND $rows AS row
+MATCH (n:ASTNode {node_id: row.node_id})
+SET n.embedding = row.embedding
+"""
+
+# Typed links from AST nodes to the instance's canonical Symbol for a USR.
+SYMBOL_LINK_TYPES = ('DECLARES', 'DEFINES', 'REFERENCES')
+
+SYMBOL_LINK_QUERIES = {rel: f"""
+UNWIND $rows AS row
+MERGE (s:Symbol {{symbol_id: $instance_id + '|' + row.usr}})
+ON CREATE SET s.usr = row.usr, s.migration_id = $instance_id, s.name = row.name
+SET s.kind = coalesce(row.kind, s.kind)
+WITH s, row
+MATCH (n:ASTNode {{node_id: row.node_id}})
+MERGE (n)-[:{rel}]->(s)
+""" for rel in SYMBOL_LINK_TYPES}
+
+# Symbol -> Symbol edges from backend.call_graph, tagged with the file they came from.
+DERIVED_EDGE_QUERIES = {rel: f"""
+UNWIND $rows AS row
+MERGE (a:Symbol {{symbol_id: $instance_id + '|' + row.src}})
+ON CREATE SET a.usr = row.src, a.migration_id = $instance_id
+MERGE (b:Symbol {{symbol_id: $instance_id + '|' + row.dst}})
+ON CREATE SET b.usr = row.dst, b.migration_id = $instance_id
+MERGE (a)-[r:{rel} {{source: $source}}]->(b)
+SET r.count = row.count
+""" for rel in DERIVED_EDGE_TYPES}
+
+_DERIVED_PATTERN = '|'.join(DERIVED_EDGE_TYPES)
+
+CLEAR_DERIVED_QUERY = f"""
+MATCH (:Symbol {{migration_id: $mid}})-[r:{_DERIVED_PATTERN}]->()
+WHERE r.source = $source
+DELETE r
+"""
+
+# One hop from each function's Symbol, found through the symbol_id constraint.
+RELATED_SYMBOLS_QUERY = f"""
+UNWIND $usrs AS usr
+MATCH (f:Symbol {{symbol_id: $mid + '|' + usr}})-[r:{_DERIVED_PATTERN}]-(s:Symbol)
+RETURN usr AS from_usr, type(r) AS rel, startNode(r) = f AS outgoing,
+       s.usr AS usr, s.name AS name, s.kind AS kind, sum(r.count) AS count
+"""
+
+KNOWN_SYMBOLS_QUERY = """
+MATCH (s:Symbol {migration_id: $mid})
+WHERE (s)<-[:DECLARES|DEFINES]-()
+RETURN s.usr AS usr
+"""
+
+DEFINED_SYMBOLS_QUERY = """
+MATCH (s:Symbol {migration_id: $mid})
+WHERE (s)<-[:DEFINES]-()
+RETURN s.usr AS usr
+"""
+
+VECTOR_INDEX_NAME = 'astnode_embedding'
+
+# queryNodes cannot filter, so fetch this many times k and keep the instance's;
+# while that leaves fewer than k, fetch 4x more, up to VECTOR_MAX_CANDIDATES.
+VECTOR_OVERSAMPLE = int(os.getenv('VECTOR_OVERSAMPLE', '10'))
+VECTOR_MAX_CANDIDATES = int(os.getenv('VECTOR_MAX_CANDIDATES', '10000'))
+
+# One row: how many hits the index returned, and the instance's best k of them.
+SIMILAR_NODES_QUERY = f"""
+CALL db.index.vector.queryNodes('{VECTOR_INDEX_NAME}', $candidates, $embedding)
+YIELD node, score
+WITH collect({{node: node, score: score}}) AS hits
+RETURN size(hits) AS fetched,
+       [h IN hits WHERE $mid IS NULL OR h.node.migration_id = $mid |
+        {{node_id: h.node.node_id, kind: h.node.kind, spelling: h.node.spelling, source: h.node.source,
+          score: h.score}}][..$k] AS nodes
+"""
+
+REGISTER_INSTANCE_QUERY = """
+MERGE (m:Migration {migration_id: $instance_id})
+ON CREATE SET m.created_at = timestamp()
+"""
+
+# Labels whose nodes carry a migration_id and are removed with their instance.
+INSTANCE_LABELS = ['ASTNode', 'Symbol']
+
+# Instances written without register_instance (e.g. before Migration nodes
+# existed) get one dated now, so a later sweep collects them.
+BACKFILL_INSTANCES_QUERY = """
+MATCH (n:{label}) WHERE n.migration_id IS NOT NULL
+WITH DISTINCT n.migration_id AS mid
+WHERE NOT EXISTS {{ MATCH (:Migration {{migration_id: mid}}) }}
+MERGE (m:Migration {{migration_id: mid}})
+ON CREATE SET m.created_at = timestamp(), m.backfilled = true
+RETURN count(m) AS c
+"""
+
+# Upper bound on nodes deleted per transaction (with their relationships).
+DELETE_BATCH_SIZE = 5000
+
+DELETE_BATCH_QUERY = """
+MATCH (n:{label} {{migration_id: $mid}})
+WITH n LIMIT $batch
+WITH collect(n) AS batch
+UNWIND batch AS m
+OPTIONAL MATCH (m)-[r]-()
+WITH batch, count(DISTINCT r) AS rels
+FOREACH (n IN batch | DETACH DELETE n)
+RETURN size(batch) AS nodes, rels
+"""
+
+_FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _checked(fields: Iterable[str]) -> List[str]:
+    # property names are interpolated into Cypher, so only plain identifiers pass
+    fields = list(fields)
+    for f in fields:
+        if not _FIELD.match(f):
+            raise ValueError(f"invalid property name: {f!r}")
+    return fields
+
+class GraphStore:
+    """Graph operations used by ingestion, context retrieval, embedding and teardown."""
+
+    def write_nodes(self, rows: List[dict], instance_id: str):
+        """Upsert ASTNodes from [{'node_id', 'props'}] and tag them with `instance_id`."""
+        raise NotImplementedError
+
+    def write_edges(self, rows: List[dict]):
+        """Create CHILD edges from [{'parent_id', 'child_id'}]; both ends must exist."""
+        raise NotImplementedError
+
+    def write_symbol_links(self, rel: str, rows: List[dict], instance_id: str):
+        """
+        Link nodes to canonical Symbols with `rel` (one of SYMBOL_LINK_TYPES)
+        from [{'node_id', 'usr', 'name', 'kind'}]; Symbols are created on first use.
+        """
+        raise NotImplementedError
+
+    def known_symbols(self, instance_id: str) -> Set[str]:
+        """USRs that already have a declaration or definition in `instance_id`."""
+        raise NotImplementedError
+
+    def defined_symbols(self, instance_id: str) -> Set[str]:
+        """USRs that already have a definition in `instance_id`."""
+        raise NotImplementedError
+
+    def replace_derived_edges(self, instance_id: str, source: str, edges: Dict[str, List[dict]]):
+        """
+        Replace the derived edges that came from `source` (one file) with
+        `edges`, {rel: [{'src', 'dst', 'count'}]} keyed by DERIVED_EDGE_TYPES.
+        Edges from other files of the instance are left alone.
+        """
+        raise NotImplementedError
+
+    def related_symbols(self, instance_id: str, usrs: Iterable[str]) -> List[dict]:
+        """
+        Derived neighbours of the given Symbols as [{'from_usr', 'rel',
+        'outgoing', 'usr', 'name', 'kind', 'count'}].
+        """
+        raise NotImplementedError
+
+    def fetch_nodes(self, fields: Iterable[str], limit: int, migration_id: Optional[str] = None,
+                    units_only: bool = False) -> List[dict]:
+        """
+        Return up to `limit` nodes as dicts of node_id plus the requested
+        properties; with `units_only`, just code unit roots (backend.code_units).
+        """
+        raise NotImplementedError
+
+    def get_nodes(self, node_ids: Iterable[str], fields: Iterable[str]) -> List[dict]:
+        """The given nodes (those that exist) as dicts of node_id plus the requested properties."""
+        raise NotImplementedError
+
+    def set_embeddings(self, rows: List[dict]):
+        """Attach vectors from [{'node_id', 'embedding'}]."""
+        raise NotImplementedError
+
+    def similar_nodes(self, embedding: List[float], k: int, migration_id: Optional[str] = None) -> List[dict]:
+        """
+        The `k` embedded nodes closest to `embedding` by cosine similarity, best
+        first, as [{'node_id', 'kind', 'spelling', 'score'}].
+        """
+        raise NotImplementedError
+
+    def register_instance(self, instance_id: str):
+        """Record that `instance_id` exists and when it was first written (for TTL sweeps)."""
+        raise NotImplementedError
+
+    def expired_instances(self, max_age_seconds: float) -> List[str]:
+        """
+        Registered instances created more than `max_age_seconds` ago. Instances
+        found with no registration are registered as of now, so they expire
+        `max_age_seconds` after the first sweep that sees them.
+        """
+        raise NotImplementedError
+
+    def delete_instance(self, instance_id: str, batch_size: int = DELETE_BATCH_SIZE) -> dict:
+        """
+        Remove every node (and its edges) created for a migration instance.
+        Returns {'nodes': n, 'relationships': r} removed.
+        """
+        raise NotImplementedError
+
+class Neo4jGraphStore(GraphStore):
+    """
+    GraphStore backed by the shared Neo4j driver in backend.neo4j_client.
+    The vector index on ASTNode.embedding is created with the dimension of
+    the first embeddings written.
+    """
+
+    def __init__(self):
+        self._vector_index = False
+
+    def ensure_vector_index(self, dimensions: int):
+        run_cypher(
+            f'CREATE VECTOR INDEX {VECTOR_INDEX_NAME} IF NOT EXISTS FOR (n:ASTNode) ON (n.embedding) '
+            f"OPTIONS {{indexConfig: {{`vector.dimensions`: {int(dimensions)}, "
+            f"`vector.similarity_function`: 'cosine'}}}}"
+        )
+        self._vector_index = True
+
+    def write_nodes(self, rows, instance_id):
+        write_batches(NODE_BATCH_QUERY, [rows], {'instance_id': instance_id})
+
+    def write_edges(self, rows):
+        write_batches(EDGE_BATCH_QUERY, [rows])
+
+    def write_symbol_links(self, rel, rows, instance_id):
+        write_batches(SYMBOL_LINK_QUERIES[rel], [rows], {'instance_id': instance_id})
+
+    def known_symbols(self, instance_id):
+        return {r['usr'] for r in run_cypher(KNOWN_SYMBOLS_QUERY, {'mid': instance_id})}
+
+    def defined_symbols(self, instance_id):
+        return {r['usr'] for r in run_cypher(DEFINED_SYMBOLS_QUERY, {'mid': instance_id})}
+
+    def replace_derived_edges(self, instance_id, source, edges):
+        run_cypher(CLEAR_DERIVED_QUERY, {'mid': instance_id, 'source': source})
+        for rel, rows in edges.items():
+            if rows:
+                write_batches(DERIVED_EDGE_QUERIES[rel], [rows],
+                              {'instance_id': instance_id, 'source': source})
+
+    def related_symbols(self, instance_id, usrs):
+        return [dict(r) for r in run_cypher(RELATED_SYMBOLS_QUERY, {'mid': instance_id, 'usrs': list(usrs)})]
+
+    def fetch_nodes(self, fields, limit, migration_id=None, units_only=False):
+        returns = ', '.join(['n.node_id AS node_id'] + [f'n.{f} AS {f}' for f in _checked(fields)])
+        label = 'CodeUnit' if units_only else 'ASTNode'
+        if migration_id is None:
+            query = f'MATCH (n:{label}) RETURN {returns} LIMIT $limit'
+        else:
+            query = f'MATCH (n:{label} {{migration_id: $mid}}) RETURN {returns} LIMIT $limit'
+        return [dict(r) for r in run_cypher(query, {'limit': limit, 'mid': migration_id})]
+
+    def get_nodes(self, node_ids, fields):
+        returns = ', '.join(['n.node_id AS node_id'] + [f'n.{f} AS {f}' for f in _checked(fields)])
+        return [dict(r) for r in run_cypher(f'MATCH (n:ASTNode) WHERE n.node_id IN $ids RETURN {returns}',
+                                            {'ids': list(node_ids)})]
+
+    def set_embeddings(self, rows):
+        if rows and not self._vector_index:
+            self.ensure_vector_index(len(rows[0]['embedding']))
+        write_batches(EMBEDDING_BATCH_QUERY, [rows])
+
+    def similar_nodes(self, embedding, k, migration_id=None):
+        candidates = min(k * VECTOR_OVERSAMPLE if migration_id else k, VECTOR_MAX_CANDIDATES)
+        params = {'embedding': list(embedding), 'k': k, 'mid': migration_id}
+        while True:
+            rows = run_cypher(SIMILAR_NODES_QUERY, dict(params, candidates=candidates))
+            fetched, nodes = (rows[0]['fetched'], rows[0]['nodes']) if rows else (0, [])
+            # enough hits for this instance, or the index has no more to give
+            if len(nodes) >= k or fetched < candidates or candidates >= VECTOR_MAX_CANDIDATES:
+                return [dict(n) for n in nodes]
+            candidates = min(candidates * 4, VECTOR_MAX_CANDIDATES)
+
+    def register_instance(self, instance_id):
+        run_cypher(REGISTER_INSTANCE_QUERY, {'instance_id': instance_id})
+
+    def expired_instances(self, max_age_seconds):
+        for label in INSTANCE_LABELS:
+            run_cypher(BACKFILL_INSTANCES_QUERY.format(label=label))
+        cutoff = int((time.time() - max_age_seconds) * 1000)
+        rows = run_cypher('MATCH (m:Migration) WHERE m.created_at < $cutoff RETURN m.migration_id AS id',
+                          {'cutoff': cutoff})
+        return [r['id'] for r in rows]
+
+    def delete_instance(self, instance_id, batch_size=DELETE_BATCH_SIZE):
+        # Each statement is its own small transaction and goes through the
+        # migration_id index, so memory stays flat however big the instance is.
+        # A batch's relationships are counted, then deleted with its nodes, so
+        # no batch rescans what earlier ones already removed.
+        removed = {'nodes': 0, 'relationships': 0}
+        params = {'mid': instance_id, 'batch': batch_size}
+        for label in INSTANCE_LABELS:
+            while True:
+                rows = run_cypher(DELETE_BATCH_QUERY.format(label=label), params)
+                if not rows or not rows[0]['nodes']:
+                    break
+                removed['nodes'] += rows[0]['nodes']
+                removed['relationships'] += rows[0]['rels']
+        run_cypher('MATCH (m:Migration {migration_id: $mid}) DELETE m', params)
+        return removed
+
+class MemoryGraphStore(GraphStore):
+    """
+    In-process GraphStore: node properties by id, parent/child adjacency
+    lists, indexes on migration_id, kind and usr, Symbols keyed by
+    (migration_id, usr) with their typed links, and derived Symbol edges with
+    a per-Symbol adjacency index. Embeddings are also kept unit-normalized for
+    brute-force cosine search. Nothing leaves the process.
+    """
+
+    INDEXED = ('migration_id', 'kind', 'usr', 'unit')
+
+    def __init__(self):
+        self.nodes = {}
+        self.children = defaultdict(list)
+        self.parent = {}
+        self.indexes = {prop: defaultdict(set) for prop in self.INDEXED}
+        self.instances = {}  # migration_id -> created_at (epoch seconds)
+        self.symbols = {}  # (migration_id, usr) -> {'usr', 'name', 'kind', 'links': {(rel, node_id)}}
+        self.derived = {}  # (migration_id, source) -> {rel: rows}
+        self.symbol_edges = defaultdict(Counter)  # (migration_id, usr) -> {(rel, outgoing, usr): count}
+        self.vectors = {}  # node_id -> unit-length embedding
+
+    def _index(self, node_id, props, add=True):
+        for prop, index in self.indexes.items():
+            value = props.get(prop)
+            if value is None:
+                continue
+            if add:
+                index[value].add(node_id)
+            else:
+                index[value].discard(node_id)
+                if not index[value]:
+                    del index[value]
+
+    def write_nodes(self, rows, instance_id):
+        for row in rows:
+            node_id = row['node_id']
+            props = self.nodes.get(node_id)
+            if props is None:
+                props = self.nodes[node_id] = {'node_id': node_id}
+            else:
+                self._index(node_id, props, add=False)
+            props.update(row['props'])
+            props['migration_id'] = instance_id
+            self._index(node_id, props)
+
+    def write_edges(self, rows):
+        for row in rows:
+            p, c = row['parent_id'], row['child_id']
+            if p not in self.nodes or c not in self.nodes or self.parent.get(c) == p:
+                continue
+            self.children[p].append(c)
+            self.parent[c] = p
+
+    def write_symbol_links(self, rel, rows, instance_id):
+        for row in rows:
+            if row['node_id'] not in self.nodes:
+                continue
+            sym = self.symbols.get((instance_id, row['usr']))
+            if sym is None:
+                sym = self.symbols[(instance_id, row['usr'])] = {
+                    'usr': row['usr'], 'name': row.get('name'), 'kind': None, 'links': set()}
+            if row.get('kind'):
+                sym['kind'] = row['kind']
+            sym['links'].add((rel, row['node_id']))
+
+    def known_symbols(self, instance_id):
+        return {usr for (mid, usr), sym in self.symbols.items()
+                if mid == instance_id and any(rel != 'REFERENCES' for rel, _ in sym['links'])}
+
+    def defined_symbols(self, instance_id):
+        return {usr for (mid, usr), sym in self.symbols.items()
+                if mid == instance_id and any(rel == 'DEFINES' for rel, _ in sym['links'])}
+
+    def _adjacency(self, instance_id, edges, sign):
+        for rel, rows in edges.items():
+            for row in rows:
+                out = self.symbol_edges[(instance_id, row['src'])]
+                out[(rel, True, row['dst'])] += sign * row['count']
+                back = self.symbol_edges[(instance_id, row['dst'])]
+                back[(rel, False, row['src'])] += sign * row['count']
+                for counter in (out, back):
+                    for key in [k for k, v in counter.items() if v <= 0]:
+                        del counter[key]
+
+    def replace_derived_edges(self, instance_id, source, edges):
+        old = self.derived.pop((instance_id, source), None)
+        if old:
+            self._adjacency(instance_id, old, -1)
+        edges = {rel: list(rows) for rel, rows in edges.items() if rows}
+        if edges:
+            self.derived[(instance_id, source)] = edges
+            self._adjacency(instance_id, edges, 1)
+
+    def related_symbols(self, instance_id, usrs):
+        out = []
+        for usr in usrs:
+            for (rel, outgoing, other), count in self.symbol_edges.get((instance_id, usr), {}).items():
+                sym = self.symbols.get((instance_id, other), {})
+                out.append({'from_usr': usr, 'rel': rel, 'outgoing': outgoing, 'usr': other,
+                            'name': sym.get('name'), 'kind': sym.get('kind'), 'count': count})
+        return out
+
+    def lookup(self, prop: str, value) -> set:
+        """Node ids whose indexed property `prop` equals `value`."""
+        return set(self.indexes[prop].get(value, ()))
+
+    def fetch_nodes(self, fields, limit, migration_id=None, units_only=False):
+        ids = self.nodes.keys() if migration_id is None else self.indexes['migration_id'].get(migration_id, ())
+        if units_only:
+            units = self.indexes['unit'].get(True, set())
+            ids = [i for i in ids if i in units]
+        out = []
+        for node_id in ids:
+            if len(out) >= limit:
+                break
+            props = self.nodes[node_id]
+            row = {'node_id': node_id}
+            row.update({f: props.get(f) for f in fields})
+            out.append(row)
+        return out
+
+    def get_nodes(self, node_ids, fields):
+        out = []
+        for node_id in node_ids:
+            props = self.nodes.get(node_id)
+            if props is not None:
+                row = {'node_id': node_id}
+                row.update({f: props.get(f) for f in fields})
+                out.append(row)
+        return out
+
+    def set_embeddings(self, rows):
+        for row in rows:
+            props = self.nodes.get(row['node_id'])
+            if props is not None:
+                props['embedding'] = row['embedding']
+                norm = math.sqrt(sum(x * x for x in row['embedding'])) or 1.0
+                self.vectors[row['node_id']] = [x / norm for x in row['embedding']]
+
+    def similar_nodes(self, embedding, k, migration_id=None):
+        norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+        query = [x / norm for x in embedding]
+        ids = self.vectors.keys() if migration_id is None else self.indexes['migration_id'].get(migration_id, ())
+        scored = ((sum(a * b for a, b in zip(query, self.vectors[i])), i) for i in ids if i in self.vectors)
+        out = []
+        for score, node_id in heapq.nlargest(k, scored):
+            props = self.nodes[node_id]
+            out.append({'node_id': node_id, 'kind': props.get('kind'), 'spelling': props.get('spelling'),
+                        'source': props.get('source'), 'score': score})
+        return out
+
+    def register_instance(self, instance_id):
+        self.instances.setdefault(instance_id, time.time())
+
+    def expired_instances(self, max_age_seconds):
+        now = time.time()
+        for mid in list(self.indexes['migration_id']) + [mid for mid, _ in self.symbols]:
+            self.instances.setdefault(mid, now)
+        cutoff = now - max_age_seconds
+        return [mid for mid, created in self.instances.items() if created < cutoff]
+
+    def delete_instance(self, instance_id, batch_size=DELETE_BATCH_SIZE):
+        doomed = set(self.indexes['migration_id'].get(instance_id, ()))
+        rels = 0
+        for node_id in doomed:
+            props = self.nodes.pop(node_id)
+            self._index(node_id, props, add=False)
+            self.vectors.pop(node_id, None)
+            for child in self.children.pop(node_id, ()):
+                self.parent.pop(child, None)
+                rels += 1
+            p = self.parent.pop(node_id, None)
+            if p is not None and p not in doomed:
+                self.children[p].remove(node_id)
+                rels += 1
+        symbols = [key for key in self.symbols if key[0] == instance_id]
+        for key in symbols:
+            rels += len(self.symbols.pop(key)['links'])
+        for key in [k for k in self.derived if k[0] == instance_id]:
+            rels += sum(len(rows) for rows in self.derived.pop(key).values())
+        for key in [k for k in self.symbol_edges if k[0] == instance_id]:
+            del self.symbol_edges[key]
+        self.instances.pop(instance_id, None)
+        return {'nodes': len(doomed) + len(symbols), 'relationships': rels}
+
+_default_store = None
+
+def get_graph_store() -> GraphStore:
+    """The process-wide default store (Neo4j)."""
+    global _default_store
+    if _default_store is None:
+        _default_store = Neo4jGraphStore()
+    return _default_store
@@ -0,0 +1,84 @@
+"""
+backend/layout.py
+Plan the Python class/module layout of a C file from its declaration outline.
+"""
+import re
+from typing import Dict, Optional
+
+# Qualifier keywords, array bounds and pointer/reference sigils; digits inside
+# identifiers (Vec3) are kept.
+_QUALIFIERS = re.compile(r'\b(const|volatile|restrict|struct|union|enum)\b|\[[^\]]*\]|[*&]')
+
+def _base_type_name(type_spelling: str) -> str:
+    """'const struct Point *' -> 'Point'."""
+    return ' '.join(_QUALIFIERS.sub(' ', type_spelling).split())
+
+def record_class_names(outline: list) -> Dict[str, str]:
+    """Map every name that refers to a struct/union (tag or typedef) to its class name."""
+    names = {}
+    for d in outline:
+        if d['kind'] in ('STRUCT_DECL', 'UNION_DECL') and d['name']:
+            names[d['name']] = d['name']
+    for d in outline:
+        if d['kind'] == 'TYPEDEF_DECL':
+            target = _base_type_name(d.get('underlying_type', ''))
+            if target in names:
+                names[d['name']] = names[target]
+            elif 'struct ' in d.get('underlying_type', '') or 'union ' in d.get('underlying_type', ''):
+                # typedef struct { ... } Name; -- the tag is anonymous
+                names[d['name']] = d['name']
+    return names
+
+def _owner(func: dict, records: Dict[str, str]) -> Optional[str]:
+    # A function belongs to the struct it takes (first match wins) ...
+    for param in func.get('params', []):
+        owner = records.get(_base_type_name(param['type']))
+        if owner:
+            return owner
+    # ... or, failing that, the struct it constructs and returns.
+    return records.get(_base_type_name(func.get('result_type', '')))
+
+def plan_layout(outline: list) -> dict:
+    """
+    Group an outline from parser.parse_*_skeleton into planned classes.
+    Structs become classes holding their fields; each function is attached as a
+    method of the first struct it takes as a parameter (or returns), and the
+    rest stay module-level functions alongside globals and enums.
+    """
+    records = record_class_names(outline)
+    classes = {}
+    for d in outline:
+        if d['kind'] in ('STRUCT_DECL', 'UNION_DECL') and d['name'] in records:
+            cls = classes.setdefault(records[d['name']], {'fields': [], 'methods': []})
+            if d.get('fields'):
+                cls['fields'] = [f['name'] for f in d['fields']]
+    for name, target in records.items():
+        classes.setdefault(target, {'fields': [], 'methods': []})
+
+    plan = {'classes': classes, 'functions': [], 'globals': [], 'enums': []}
+    seen = set()
+    for d in outline:
+        kind = d['kind']
+        if kind == 'FUNCTION_DECL':
+            if d['name'] in seen:
+                continue
+            seen.add(d['name'])
+            owner = _owner(d, records)
+            if owner:
+                classes[owner]['methods'].append(d['name'])
+            else:
+                plan['functions'].append(d['name'])
+        elif kind == 'VAR_DECL':
+            plan['globals'].append(d['name'])
+        elif kind == 'ENUM_DECL':
+            plan['enums'].append(d['name'] or ', '.join(d.get('constants', [])))
+    return plan
+
+if __name__ == '__main__':
+    import sys
+    import ujson as json
+    from backend.parser import parse_c_file_skeleton
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.layout path/to/file.c")
+        raise SystemExit(1)
+    print(json.dumps(plan_layout(parse_c_file_skeleton(sys.argv[1])), indent=2))
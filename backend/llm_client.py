@@ -0,0 +1,577 @@
+"""
+backend/llm_client.py
+Pooled, rate-limit-aware clients for the LLM providers.
+
+Every completion goes through one asyncio scheduler running on a background
+thread, so calls from any thread (e.g. the chunked converter's workers) share
+the same limits. Per provider it caps requests in flight and spends a
+tokens-per-minute budget that follows the provider's rate-limit headers.
+Transient failures (429, 5xx, timeouts, dropped connections) are retried
+with jittered exponential backoff, honouring Retry-After. A request that
+still fails moves on to the next provider; the next request starts again
+from the first one.
+
+HTTP connections are kept alive: Groq through a pooled requests.Session,
+Ollama through one shared ollama.Client (httpx).
+
+stream() uses the providers' streaming modes (server-sent events on Groq's
+OpenAI-compatible endpoint, NDJSON chunks on Ollama) and hands text deltas to
+the caller as they arrive. A stream is retried or failed over only until its
+first token; after that a failure is raised, since the caller has already
+seen part of the text. Every call, streamed or not, records its
+time-to-first-token and tokens/sec (CallStats, see call_stats()).
+"""
+import asyncio
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+import ollama
+import requests
+import ujson as json
+from requests.adapters import HTTPAdapter
+
+GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_MODEL = "llama3-8b-8192"
+MAX_TOKENS = 2048
+GROQ_TEMPERATURE = 0.2
+
+# Requests in flight and tokens per minute per provider (0 = no token budget).
+# The Groq budget is a starting point; x-ratelimit-* headers take over.
+GROQ_CONCURRENCY = int(os.getenv('GROQ_CONCURRENCY', '4'))
+GROQ_TPM = int(os.getenv('GROQ_TPM', '30000'))
+OLLAMA_CONCURRENCY = int(os.getenv('OLLAMA_CONCURRENCY', '1'))
+OLLAMA_TPM = int(os.getenv('OLLAMA_TPM', '0'))
+
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '4'))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '120'))
+
+# Per-call stats kept in memory for call_stats().
+LLM_STATS_KEEP = int(os.getenv('LLM_STATS_KEEP', '1000'))
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# tokens: prompt + output, for the budget; ttft and duration in seconds, set by LLMClient.
+Completion = namedtuple('Completion', ['text', 'provider', 'model', 'tokens', 'output_tokens', 'ttft', 'duration'],
+                        defaults=(None, None, None))
+
+# One finished call. Streamed calls rate output tokens over the time after the
+# first token; non-streamed calls have ttft == duration and use the whole call.
+CallStats = namedtuple('CallStats', ['provider', 'model', 'streamed', 'ttft', 'duration', 'output_tokens',
+                                     'tokens_per_s'])
+
+class ProviderError(Exception):
+    """A failed provider call; `retryable` failures are retried with backoff."""
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.partial = False  # set when a stream fails after its first token
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit reset value: '7.66s', '2m59.56s', '120ms' or plain seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough prompt size for budgeting (~4 characters per token)."""
+    return sum(len(t) for t in texts) // 4 + 1
+
+class TokenBudget:
+    """
+    Tokens-per-minute budget that refills continuously. Rate-limit headers
+    correct it: the remaining count is taken as an upper bound and an empty
+    window blocks spending until it resets. Thread-safe, since headers are
+    read on the HTTP worker threads.
+    """
+
+    def __init__(self, tpm: int):
+        self.capacity = tpm
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def delay(self, cost: int) -> float:
+        """Seconds until `cost` tokens can be spent (0 when they can be now)."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if not self.capacity:
+                return 0.0
+            self._refill(now)
+            cost = min(cost, self.capacity)  # a request larger than the window waits for a full one
+            return 0.0 if self.tokens >= cost else (cost - self.tokens) * 60.0 / self.capacity
+
+    def spend(self, cost: int):
+        with self._lock:
+            if self.capacity:
+                self._refill(time.monotonic())
+                self.tokens -= min(cost, self.capacity)
+
+    def refund(self, tokens: int):
+        with self._lock:
+            if self.capacity and tokens > 0:
+                self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], reset: Optional[float]):
+        with self._lock:
+            if limit:
+                self.capacity = limit
+            if remaining is not None and self.capacity:
+                self._refill(time.monotonic())
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+class Provider:
+    """One LLM backend: its default model, request parameters and limits."""
+    name = ''
+
+    def __init__(self, model: str, concurrency: int, tpm: int,
+                 temperature: Optional[float] = None, max_tokens: Optional[int] = None):
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.budget = TokenBudget(tpm)
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, on the scheduler's loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def cost(self, system_prompt: str, user_message: str) -> int:
+        return estimate_tokens(system_prompt, user_message) + (self.max_tokens or 0)
+
+    def send(self, system_prompt: str, user_message: str, model: str) -> Completion:
+        """Blocking call; raises ProviderError."""
+        raise NotImplementedError
+
+    def stream(self, system_prompt: str, user_message: str, model: str) -> Iterator[Union[str, dict]]:
+        """
+        Blocking generator of text deltas, ending with a usage dict
+        ({'tokens', 'output_tokens'}) when the provider reports one. Raises
+        ProviderError.
+        """
+        raise NotImplementedError
+
+class GroqProvider(Provider):
+    name = 'groq'
+
+    def __init__(self, api_key: str, model: str = GROQ_MODEL, concurrency: int = GROQ_CONCURRENCY,
+                 tpm: int = GROQ_TPM, url: str = GROQ_CHAT_URL):
+        super().__init__(model, concurrency, tpm, temperature=GROQ_TEMPERATURE, max_tokens=MAX_TOKENS)
+        self.url = url
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('https://', adapter)
+
+    def _observe_headers(self, headers):
+        def number(name):
+            try:
+                return int(float(headers[name]))
+            except (KeyError, ValueError):
+                return None
+        self.budget.observe(number('x-ratelimit-limit-tokens'), number('x-ratelimit-remaining-tokens'),
+                            parse_duration(headers.get('x-ratelimit-reset-tokens')))
+        if number('x-ratelimit-remaining-requests') == 0:
+            self.budget.pause(parse_duration(headers.get('x-ratelimit-reset-requests')) or 1.0)
+
+    def _post(self, system_prompt, user_message, model, stream=False):
+        data = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
+        }
+        if stream:
+            data["stream"] = True
+        try:
+            resp = self.session.post(self.url, json=data, timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+                                     stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise ProviderError(f"groq: {e}", retryable=True)
+        self._observe_headers(resp.headers)
+        if resp.status_code >= 400:
+            raise ProviderError(f"groq: HTTP {resp.status_code}: {resp.text[:200]}",
+                                retryable=resp.status_code in RETRYABLE_STATUS,
+                                retry_after=parse_duration(resp.headers.get('retry-after')))
+        return resp
+
+    def send(self, system_prompt, user_message, model):
+        resp = self._post(system_prompt, user_message, model)
+        try:
+            result = resp.json()
+            text = result['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            # a truncated or unexpected body; worth another try
+            raise ProviderError(f"groq: malformed response ({type(e).__name__}: {e}): {resp.text[:200]}",
+                                retryable=True)
+        usage = result.get('usage') or {}
+        return Completion(text, self.name, model, usage.get('total_tokens'), usage.get('completion_tokens'))
+
+    def stream(self, system_prompt, user_message, model):
+        resp = self._post(system_prompt, user_message, model, stream=True)
+        resp.encoding = 'utf-8'  # text/event-stream carries no charset
+        usage = None
+        try:
+            with resp:
+                for line in resp.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    payload = line[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+                    deltas, event_usage = _parse_sse_event(payload)
+                    usage = event_usage or usage
+                    yield from deltas
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            raise ProviderError(f"groq: stream interrupted: {e}", retryable=True)
+        if usage:
+            yield {'tokens': usage.get('total_tokens'), 'output_tokens': usage.get('completion_tokens')}
+
+def _parse_sse_event(payload: str):
+    # one `data:` event of an OpenAI-style stream -> (text deltas, usage or None)
+    try:
+        event = json.loads(payload)
+        if event.get('error'):
+            raise ProviderError(f"groq: {event['error']}", retryable=True)
+        # Groq reports usage on the last chunk under x_groq
+        usage = (event.get('x_groq') or {}).get('usage') or event.get('usage')
+        deltas = [d for d in ((c.get('delta') or {}).get('content') for c in event.get('choices') or []) if d]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ProviderError(f"groq: malformed stream event ({type(e).__name__}: {e}): {payload[:200]}",
+                            retryable=True)
+    return deltas, usage
+
+class OllamaProvider(Provider):
+    name = 'ollama'
+
+    def __init__(self, model: str = 'llama3.2', concurrency: int = OLLAMA_CONCURRENCY, tpm: int = OLLAMA_TPM):
+        super().__init__(model, concurrency, tpm)
+        # host from OLLAMA_HOST; one httpx client keeps its connections alive
+        self.client = ollama.Client(timeout=LLM_READ_TIMEOUT)
+
+    def send(self, system_prompt, user_message, model):
+        try:
+            try:
+                resp = self.client.chat(model=model, messages=[{"role": "system", "content": system_prompt},
+                                                               {"role": "user", "content": user_message}])
+            except ollama.ResponseError as e:
+                if e.status_code != 404:
+                    raise
+                # fallback: try generate
+                resp = self.client.generate(model=model, prompt=system_prompt + "\n\n" + user_message)
+        except ollama.ResponseError as e:
+            raise ProviderError(f"ollama: {e}", retryable=e.status_code in RETRYABLE_STATUS)
+        except Exception as e:
+            # connection refused, timeouts and other transport errors
+            raise ProviderError(f"ollama: {e}", retryable=True)
+        usage = _ollama_usage(resp)
+        return Completion(extract_text_from_ollama_response(resp), self.name, model,
+                          usage['tokens'], usage['output_tokens'])
+
+    def stream(self, system_prompt, user_message, model):
+        try:
+            try:
+                parts = self.client.chat(model=model, stream=True,
+                                         messages=[{"role": "system", "content": system_prompt},
+                                                   {"role": "user", "content": user_message}])
+                first = next(parts, None)  # the request is only sent on the first read
+            except ollama.ResponseError as e:
+                if e.status_code != 404:
+                    raise
+                parts = self.client.generate(model=model, prompt=system_prompt + "\n\n" + user_message,
+                                             stream=True)
+                first = next(parts, None)
+            if first is not None:
+                yield from _ollama_part(first)
+            for part in parts:
+                yield from _ollama_part(part)
+        except ollama.ResponseError as e:
+            raise ProviderError(f"ollama: {e}", retryable=e.status_code in RETRYABLE_STATUS)
+        except ProviderError:
+            raise
+        except Exception as e:
+            raise ProviderError(f"ollama: {e}", retryable=True)
+
+def _ollama_usage(resp) -> dict:
+    if hasattr(resp, 'model_dump'):
+        resp = resp.model_dump()
+    if not isinstance(resp, dict):
+        return {'tokens': None, 'output_tokens': None}
+    prompt, output = resp.get('prompt_eval_count'), resp.get('eval_count')
+    return {'tokens': (prompt or 0) + (output or 0) or None, 'output_tokens': output}
+
+def _ollama_part(part) -> Iterator[Union[str, dict]]:
+    # one streamed chat/generate chunk: its text, then usage on the final ("done") chunk
+    if hasattr(part, 'model_dump'):
+        part = part.model_dump()
+    text = extract_text_from_ollama_response(part) if isinstance(part, dict) else str(part)
+    if text:
+        yield text
+    if isinstance(part, dict) and part.get('done'):
+        yield _ollama_usage(part)
+
+def extract_text_from_ollama_response(resp) -> str:
+    # Ollama client returns different shapes across versions; support common ones
+    if hasattr(resp, 'model_dump'):
+        resp = resp.model_dump()  # ChatResponse / GenerateResponse objects
+    if isinstance(resp, dict):
+        message = resp.get('message')
+        if isinstance(message, dict) and isinstance(message.get('content'), str):
+            return message['content']
+        if 'response' in resp and isinstance(resp['response'], str):
+            return resp['response']
+        if 'text' in resp and isinstance(resp['text'], str):
+            return resp['text']
+        if 'outputs' in resp and isinstance(resp['outputs'], list):
+            # find first output with 'content' or 'text'
+            for out in resp['outputs']:
+                if isinstance(out, dict):
+                    for k in ('content','text'):
+                        if k in out and isinstance(out[k], str):
+                            return out[k]
+        # try to stringify
+        return json.dumps(resp)
+    # if string directly
+    if isinstance(resp, str):
+        return resp
+    return str(resp)
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Jittered exponential backoff, never shorter than the server's Retry-After."""
+    delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+    return max(delay, retry_after or 0.0)
+
+_END = object()
+
+class CompletionStream:
+    """
+    Text deltas of one streamed completion, in order, as they arrive. Once
+    iterated to the end, `completion` holds the final Completion; a failed
+    call raises from the iteration.
+    """
+
+    def __init__(self, deltas: queue.Queue, future):
+        self._deltas = deltas
+        self._future = future
+        self.completion = None
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            delta = self._deltas.get()
+            if delta is _END:
+                break
+            yield delta
+        self.completion = self._future.result()
+
+class LLMClient:
+    """
+    Schedules completions over `providers` (in failover order) on a private
+    event loop thread. complete() and stream() are the blocking entry points;
+    acomplete() can be awaited on the client's loop.
+    """
+
+    def __init__(self, providers: Sequence[Provider], max_retries: int = LLM_MAX_RETRIES):
+        self.providers = {p.name: p for p in providers}
+        self.order = [p.name for p in providers]
+        self.max_retries = max_retries
+        self.retries = 0
+        self.failovers = 0
+        self.calls = deque(maxlen=LLM_STATS_KEEP)
+        self.call_count = 0
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                # blocking HTTP runs here; one thread per request slot
+                workers = sum(p.concurrency for p in self.providers.values())
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm'))
+                threading.Thread(target=loop.run_forever, name='llm-scheduler', daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def complete(self, system_prompt: str, user_message: str, providers: Optional[List[str]] = None,
+                 models: Optional[Dict[str, str]] = None) -> Completion:
+        """Blocking completion; see acomplete."""
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete(system_prompt, user_message, providers, models), self._ensure_loop())
+        return future.result()
+
+    def stream(self, system_prompt: str, user_message: str, providers: Optional[List[str]] = None,
+               models: Optional[Dict[str, str]] = None) -> CompletionStream:
+        """Streaming completion: iterate the result for text deltas; see acomplete."""
+        deltas = queue.Queue()
+
+        async def run():
+            try:
+                return await self.acomplete(system_prompt, user_message, providers, models, sink=deltas)
+            finally:
+                deltas.put(_END)
+
+        return CompletionStream(deltas, asyncio.run_coroutine_threadsafe(run(), self._ensure_loop()))
+
+    async def acomplete(self, system_prompt: str, user_message: str, providers: Optional[List[str]] = None,
+                        models: Optional[Dict[str, str]] = None, sink: Optional[queue.Queue] = None) -> Completion:
+        """
+        Try `providers` (default: all, in order) until one answers. `models`
+        overrides the model per provider name. With a `sink` the call is
+        streamed and each text delta is put on it as it arrives.
+        """
+        errors = []
+        names = [n for n in (providers or self.order) if n in self.providers]
+        for i, name in enumerate(names):
+            provider = self.providers[name]
+            model = (models or {}).get(name) or provider.model
+            try:
+                return await self._call(provider, system_prompt, user_message, model, sink)
+            except ProviderError as e:
+                if e.partial:
+                    raise RuntimeError(f"{name} failed mid-stream: {e}")
+                errors.append(str(e))
+                if i + 1 < len(names):
+                    self.failovers += 1
+                    print(f"{name} failed for this request ({e}); trying {names[i + 1]}")
+        raise RuntimeError("All LLM providers failed: " + ' / '.join(errors or ['no provider configured']))
+
+    @staticmethod
+    def _send(provider: Provider, system_prompt: str, user_message: str, model: str) -> Completion:
+        start = time.perf_counter()
+        completion = provider.send(system_prompt, user_message, model)
+        duration = time.perf_counter() - start
+        return completion._replace(ttft=duration, duration=duration)
+
+    @staticmethod
+    def _pump(provider: Provider, system_prompt: str, user_message: str, model: str,
+              sink: queue.Queue) -> Completion:
+        # runs on an executor thread: forwards deltas to `sink` and times the stream
+        start = time.perf_counter()
+        first = None
+        parts = []
+        usage = {}
+        try:
+            for item in provider.stream(system_prompt, user_message, model):
+                if isinstance(item, dict):
+                    usage = item
+                    continue
+                if first is None:
+                    first = time.perf_counter()
+                parts.append(item)
+                sink.put(item)
+        except ProviderError as e:
+            e.partial = first is not None
+            raise
+        end = time.perf_counter()
+        # without reported usage, count deltas (about one token each)
+        return Completion(''.join(parts), provider.name, model, usage.get('tokens'),
+                          usage.get('output_tokens') or len(parts), (first or end) - start, end - start)
+
+    def _record(self, completion: Completion, streamed: bool) -> CallStats:
+        generating = completion.duration - completion.ttft if streamed else completion.duration
+        tokens = completion.output_tokens or 0
+        stats = CallStats(completion.provider, completion.model, streamed, completion.ttft, completion.duration,
+                          tokens, tokens / generating if generating > 0 else 0.0)
+        self.calls.append(stats)
+        self.call_count += 1
+        print(f"{stats.provider} {stats.model}: TTFT {stats.ttft:.2f}s, {tokens} tokens in "
+              f"{stats.duration:.2f}s ({stats.tokens_per_s:.0f} tokens/sec)")
+        return stats
+
+    async def _call(self, provider: Provider, system_prompt: str, user_message: str, model: str,
+                    sink: Optional[queue.Queue] = None) -> Completion:
+        cost = provider.cost(system_prompt, user_message)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            async with provider.semaphore:
+                while True:
+                    wait = provider.budget.delay(cost)
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                provider.budget.spend(cost)
+                try:
+                    if sink is not None:
+                        completion = await loop.run_in_executor(
+                            None, self._pump, provider, system_prompt, user_message, model, sink)
+                    else:
+                        completion = await loop.run_in_executor(
+                            None, self._send, provider, system_prompt, user_message, model)
+                except ProviderError as e:
+                    error = e
+                else:
+                    if completion.tokens:
+                        provider.budget.refund(cost - completion.tokens)
+                    self._record(completion, sink is not None)
+                    return completion
+            if error.retry_after:
+                provider.budget.pause(error.retry_after)
+            if error.partial or not error.retryable or attempt == self.max_retries:
+                raise error
+            self.retries += 1
+            await asyncio.sleep(backoff_delay(attempt, error.retry_after))
+
+    def call_stats(self, since: int = 0) -> List[CallStats]:
+        """
+        Recorded calls, oldest first (at most the last LLM_STATS_KEEP); with
+        `since`, an earlier call_count, only the calls made after it.
+        """
+        calls = list(self.calls)
+        return calls[len(calls) - min(len(calls), self.call_count - since):]
+
+    def stats(self) -> dict:
+        return {'retries': self.retries, 'failovers': self.failovers,
+                'budgets': {n: round(p.budget.tokens) for n, p in self.providers.items() if p.budget.capacity}}
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_llm_client() -> LLMClient:
+    """Groq (when GROQ_API_KEY is set), then Ollama."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            providers = [GroqProvider(GROQ_API_KEY)] if GROQ_API_KEY else []
+            _default_client = LLMClient(providers + [OllamaProvider()])
+    return _default_client
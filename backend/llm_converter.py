@@ -1,110 +1,387 @@
 """Convert C code to OOP Python using Ollama LLaMA 3.2 with AST context from Neo4j."""
-import ollama
-from backend.parser import parse_c_file_to_ast_dict, parse_c_code_str_to_ast
-from backend.neo4j_client import run_cypher
+from backend.parser import parse_c_code_str_skeleton
+from backend.cache import DiskCache, cache_dir
+from backend.chunker import CHUNK_MAX_CHARS, Chunk, plan_chunks, stitch_modules
+from backend.graph_store import GraphStore, get_graph_store
+# provider settings moved to backend.llm_client; still importable from here
+from backend.llm_client import (GROQ_API_KEY, GROQ_CHAT_URL, GROQ_MODEL, GROQ_TEMPERATURE, MAX_TOKENS,
+                                extract_text_from_ollama_response, get_llm_client)
+from backend.retrieval import retrieve_similar
+from backend.vectorizer import DEFAULT_EMBED_MODEL
 import ujson as json
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import queue
 import re
+import threading
 import os
-import requests
+import time
 
 # default model (change if you prefer another installed model)
 # DEFAULT_MODEL = 'llama3.2'
 DEFAULT_MODEL = 'llama3.2'
-GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
-GROQ_MODEL = "llama3-8b-8192"
 OLLAMA_URL = "http://host.docker.internal:11434"
 
-def get_top_ast_context(limit: int = 20) -> str:
-    rows = run_cypher('MATCH (n:ASTNode) RETURN n.node_id AS id, n.nodetype AS nodetype, n.name AS name LIMIT $l', {'l': limit})
-    snippets = []
-    for r in rows:
-        snippets.append(f"- {r.get('nodetype','')}: {r.get('name','')}")
-    return '\n'.join(snippets)
-
-def extract_text_from_ollama_response(resp) -> str:
-    # Ollama client returns different shapes across versions; support common ones
-    if isinstance(resp, dict):
-        if 'response' in resp and isinstance(resp['response'], str):
-            return resp['response']
-        if 'text' in resp and isinstance(resp['text'], str):
-            return resp['text']
-        if 'outputs' in resp and isinstance(resp['outputs'], list):
-            # find first output with 'content' or 'text'
-            for out in resp['outputs']:
-                if isinstance(out, dict):
-                    for k in ('content','text'):
-                        if k in out and isinstance(out[k], str):
-                            return out[k]
-        # try to stringify
-        return json.dumps(resp)
-    # if string directly
-    if isinstance(resp, str):
-        return resp
-    return str(resp)
-
-def convert_c_to_python(code: str, model: str = DEFAULT_MODEL, top_k_context: int = 30) -> str:
-    """
-    Convert C source `code` to OOP Python code. Uses short AST context pulled from Neo4j.
-    Tries Groq first, falls back to Ollama if Groq fails.
-    """
-    context = get_top_ast_context(limit=top_k_context)
-
-    system_prompt = (
-        "You are an expert engineer that converts procedural C code into readable, well-structured OOP Python 3 code.\n"
-        "Rules:\n"
-        "1) Convert C structs with related functions into Python classes.\n"
-        "2) Preserve naming where appropriate and document behavior with docstrings.\n"
-        "3) Provide a short mapping summary of how C constructs map to Python (at top).\n        "
-        "4) Return only the Python source code (no back-and-forth commentary).\n"
-    )
+# Chunks converted concurrently by convert_c_to_python_chunked.
+CONVERT_WORKERS = int(os.getenv('CONVERT_WORKERS', '4'))
 
-    user_message = f"// AST context:\n{context}\n\n// C Source:\n{code}\n\n// Conversion instructions:\nConvert the above C into OOP Python with classes, methods, and clear docstrings. Output valid Python code."
+# Minimum seconds between partial-module updates while chunks stream in.
+STREAM_REFRESH_S = float(os.getenv('STREAM_REFRESH_S', '0.1'))
 
-    # Try Groq first
-    if GROQ_API_KEY:
+# Response cache bounds; LLM_CACHE_TTL is in seconds, 0 keeps entries until evicted.
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(30 * 24 * 3600)))
+
+class ResponseCache(DiskCache):
+    """
+    LLM completions keyed by a hash of everything that determines them:
+    provider, model, system prompt, user message, temperature and max_tokens.
+    Used per request, so with chunked conversion the unchanged chunks of an
+    edited file are served from cache. LRU size bound plus a TTL.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 ttl: Optional[float] = LLM_CACHE_TTL or None):
+        super().__init__(path or str(cache_dir() / 'llm.sqlite'), max_bytes=max_bytes, ttl=ttl)
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, user_message: str,
+                 temperature: Optional[float], max_tokens: Optional[int]) -> str:
+        payload = json.dumps([provider, model, system_prompt, user_message, temperature, max_tokens])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def lookup(self, keys: Iterable[str]) -> Optional[str]:
+        """
+        The answer stored under the first of `keys` that has one (a request
+        has one key per provider). Counts a single hit or miss per call.
+        """
+        keys = list(keys)
+        found = self.get_many(keys, count=False)
+        self.record(bool(found))
+        for key in keys:
+            if key in found:
+                return found[key].decode('utf-8')
+        return None
+
+    def store(self, key: str, text: str):
+        self.put(key, text.encode('utf-8'))
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    # first use may come from several conversion workers at once
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+    return _response_cache
+
+def _unit_line(n: dict) -> str:
+    # kind, name and the unit's first source line (a function's signature)
+    line = f"- {n.get('kind') or ''}: {n.get('spelling') or ''}"
+    head = (n.get('source') or '').strip().split('\n', 1)[0].strip()
+    return f"{line} | {head}" if head else line
+
+def get_top_ast_context(limit: int = 20, store: Optional[GraphStore] = None, code: Optional[str] = None,
+                        migration_id: Optional[str] = None, embed_model: str = DEFAULT_EMBED_MODEL) -> str:
+    """
+    AST context lines for the prompt. Given the `code` being converted and its
+    `migration_id`, these are the `limit` code units most similar to it (vector
+    search); otherwise, or if retrieval fails, the first `limit` code units.
+    """
+    store = store or get_graph_store()
+    if code and migration_id:
         try:
-            print("Trying Groq for code generation...")
-            headers = {
-                "Authorization": f"Bearer {GROQ_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": GROQ_MODEL,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                "max_tokens": 2048,
-                "temperature": 0.2
-            }
-            resp = requests.post(GROQ_CHAT_URL, headers=headers, json=data, timeout=60)
-            resp.raise_for_status()
-            result = resp.json()
-            code = result['choices'][0]['message']['content']
-            print("Using Groq for code generation.")
-            python_code = extract_python_code(code)
-            return python_code
+            result = retrieve_similar(code, migration_id, k=limit, model=embed_model, store=store)
+            if result.nodes:
+                return '\n'.join(_unit_line(n) for n in result.nodes)
         except Exception as e:
-            print(f"Groq code generation failed: {e}")
+            print(f"Similarity retrieval failed, using unranked context: {e}")
+    rows = store.fetch_nodes(['kind', 'spelling', 'source'], limit, migration_id=migration_id, units_only=True)
+    return '\n'.join(_unit_line(r) for r in rows)
 
-    # Fallback to Ollama
-    print("Falling back to Ollama for code generation...")
-    try:
-        resp = ollama.chat(model=model, messages=[{"role":"system", "content": system_prompt},
-                                                 {"role":"user", "content": user_message}])
-    except Exception as e:
-        # fallback: try generate
+def get_function_context(code: str, migration_id: str, store: Optional[GraphStore] = None,
+                         limit: int = 40, outline: Optional[list] = None,
+                         names: Optional[set] = None) -> str:
+    """
+    Call-graph context for the functions defined in `code`: callers, callees and
+    the types and globals each one uses, read one hop from its Symbol. Pass the
+    code's `outline` to skip reparsing, and `names` to keep only those functions.
+    """
+    store = store or get_graph_store()
+    # bodies are skipped in skeleton mode, so every main-file function counts
+    functions = {d['usr']: d['name'] for d in (outline or parse_c_code_str_skeleton(code))
+                 if d['kind'] == 'FUNCTION_DECL' and (names is None or d['name'] in names)}
+    lines = []
+    for r in store.related_symbols(migration_id, functions):
+        name = r.get('name') or r['usr']
+        if r['outgoing']:
+            lines.append(f"- {functions[r['from_usr']]} {r['rel']} {name}")
+        elif r['rel'] == 'CALLS':
+            lines.append(f"- {name} CALLS {functions[r['from_usr']]}")
+    # a typedef and its struct share a name; list each line once
+    return '\n'.join(list(dict.fromkeys(lines))[:limit])
+
+SYSTEM_PROMPT = (
+    "You are an expert engineer that converts procedural C code into readable, well-structured OOP Python 3 code.\n"
+    "Rules:\n"
+    "1) Convert C structs with related functions into Python classes.\n"
+    "2) Preserve naming where appropriate and document behavior with docstrings.\n"
+    "3) Provide a short mapping summary of how C constructs map to Python (at top).\n        "
+    "4) Return only the Python source code (no back-and-forth commentary).\n"
+)
+
+CHUNK_RULES = (
+    "5) The C source is one part of a larger file that is converted part by part and then joined.\n"
+    "   Convert only the code under '// C Source'; the '// Declarations' are defined in other parts,\n"
+    "   so use them under the Python names given but do not redefine them.\n"
+    "6) Functions planned as methods of a class go inside `class <Name>:`, even if the class body\n"
+    "   is only these methods.\n"
+)
+
+def generate_text(system_prompt: str, user_message: str, model: str = DEFAULT_MODEL,
+                  use_cache: bool = True, on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    One completion for the prompt through the pooled provider client
+    (backend.llm_client): Groq first when GROQ_API_KEY is set, failing over
+    to Ollama for this request only. Returns the raw text. An answer any
+    provider gave to the same request before is served from the response
+    cache; pass use_cache=False to bypass it. With `on_delta` the response is
+    streamed and each piece of text is passed to it as it arrives (a cached
+    answer in one piece).
+    """
+    client = get_llm_client()
+    models = {'ollama': model}
+    keys = {}
+    for name in client.order:
+        p = client.providers[name]
+        # Ollama runs with its default sampling options, so those are None
+        keys[name] = ResponseCache.make_key(name, models.get(name, p.model), system_prompt, user_message,
+                                            p.temperature, p.max_tokens)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        text = cache.lookup(keys.values())
+        if text is not None:
+            if on_delta is not None:
+                on_delta(text)
+            return text
+    if on_delta is not None:
+        stream = client.stream(system_prompt, user_message, models=models)
+        for delta in stream:
+            on_delta(delta)
+        completion = stream.completion
+    else:
+        completion = client.complete(system_prompt, user_message, models=models)
+    print(f"Generated with {completion.provider} ({completion.model}).")
+    if cache is not None and completion.text:
+        cache.store(keys[completion.provider], completion.text)
+    return completion.text
+
+class ChunkConversionError(RuntimeError):
+    """
+    Some chunks of a chunked conversion failed. `code` is the module stitched
+    from the chunks that did convert; `failed` lists (chunk title, error).
+    """
+
+    def __init__(self, code: str, failed: list):
+        super().__init__(f"{len(failed)} chunk(s) were not converted: "
+                         + '; '.join(f"{title}: {error}" for title, error in failed))
+        self.code = code
+        self.failed = failed
+
+class CodeFenceExtractor:
+    """
+    The Python code of a response while it streams in: the text after the
+    first code fence, up to its closing fence once that arrives. Before any
+    fence the text so far is shown (inline backticks do not hide it). The finished response still goes through
+    extract_python_code.
+    """
+    _OPEN = re.compile(r"```[^`\n]*\n")
+
+    def __init__(self):
+        self.text = ''
+        self._start = None
+        self._end = None
+
+    def feed(self, delta: str) -> str:
+        """Add a piece of the response; returns the code so far."""
+        # a fence may straddle deltas: rescan from the start of the last line
+        line_start = self.text.rfind('\n') + 1
+        tail = max(0, len(self.text) - 2)
+        self.text += delta
+        if self._start is None:
+            match = self._OPEN.search(self.text, line_start)
+            if match:
+                self._start = match.end()
+        if self._start is not None and self._end is None:
+            end = self.text.find('```', max(self._start, tail))
+            if end != -1:
+                self._end = end
+        return self.partial()
+
+    def partial(self) -> str:
+        if self._start is None:
+            # no fence yet (inline `code` is not one); hide a last line that
+            # may be an opening fence still being written
+            head, _, last = self.text.rpartition('\n')
+            return (head if last.lstrip().startswith('`') else self.text).strip()
+        code = self.text[self._start:self._end]
+        if self._end is None:
+            code = code.rstrip('`')  # a closing fence being written
+        return code.strip()
+
+def _streamed_code(system_prompt: str, user_message: str, model: str, use_cache: bool,
+                   on_partial: Optional[Callable[[str], None]]) -> str:
+    # the final code, passing the partial code to `on_partial` as the response streams in
+    if on_partial is None:
+        return extract_python_code(generate_text(system_prompt, user_message, model, use_cache=use_cache))
+    extractor = CodeFenceExtractor()
+    text = generate_text(system_prompt, user_message, model, use_cache=use_cache,
+                         on_delta=lambda delta: on_partial(extractor.feed(delta)))
+    return extract_python_code(text)
+
+def convert_c_to_python(code: str, model: str = DEFAULT_MODEL, top_k_context: int = 30,
+                        store: Optional[GraphStore] = None, migration_id: Optional[str] = None,
+                        embed_model: str = DEFAULT_EMBED_MODEL, use_cache: bool = True,
+                        on_partial: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Convert C source `code` to OOP Python code. Uses short AST context pulled from
+    the graph store (Neo4j unless another store is given). When `migration_id`
+    names the instance the code was ingested as, that context is the nodes most
+    similar to the code plus the call graph of its functions.
+    Tries Groq first, falls back to Ollama if Groq fails; identical requests
+    are answered from the response cache unless `use_cache` is False. With
+    `on_partial` the response is streamed and the Python extracted so far is
+    passed to it as it grows.
+    """
+    context = get_top_ast_context(limit=top_k_context, store=store, code=code,
+                                  migration_id=migration_id, embed_model=embed_model)
+    if migration_id:
+        calls = get_function_context(code, migration_id, store=store)
+        if calls:
+            context = f"{calls}\n{context}"
+
+    user_message = f"// AST context:\n{context}\n\n// C Source:\n{code}\n\n// Conversion instructions:\nConvert the above C into OOP Python with classes, methods, and clear docstrings. Output valid Python code."
+    return _streamed_code(SYSTEM_PROMPT, user_message, model, use_cache, on_partial)
+
+def _convert_chunk(chunk: Chunk, outline: list, model: str, top_k_context: int,
+                   store: Optional[GraphStore], migration_id: Optional[str], embed_model: str,
+                   use_cache: bool, on_partial: Optional[Callable[[str], None]] = None) -> str:
+    context = get_top_ast_context(limit=top_k_context, store=store, code=chunk.text,
+                                  migration_id=migration_id, embed_model=embed_model)
+    if migration_id:
+        names = {u.name for u in chunk.units if u.kind == 'FUNCTION_DECL'}
+        calls = get_function_context(chunk.text, migration_id, store=store, outline=outline, names=names)
+        if calls:
+            context = f"{calls}\n{context}"
+    target = f"the methods of class {chunk.owner}" if chunk.owner else "module-level code"
+    user_message = (f"// AST context:\n{context}\n\n// Declarations (defined elsewhere, for reference):\n"
+                    f"{chunk.context}\n\n// C Source ({chunk.title}):\n{chunk.text}\n\n"
+                    f"// Conversion instructions:\nConvert the C Source into {target} in OOP Python with "
+                    f"clear docstrings. Output valid Python code.")
+    return _streamed_code(SYSTEM_PROMPT + CHUNK_RULES, user_message, model, use_cache, on_partial)
+
+def convert_c_to_python_chunked(code: str, model: str = DEFAULT_MODEL, top_k_context: int = 30,
+                                store: Optional[GraphStore] = None, migration_id: Optional[str] = None,
+                                embed_model: str = DEFAULT_EMBED_MODEL, workers: int = CONVERT_WORKERS,
+                                max_chunk_chars: int = CHUNK_MAX_CHARS, filename: str = 'temp.c',
+                                use_cache: bool = True, on_partial: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Convert large C files chunk by chunk (see backend.chunker): the file is split
+    into declaration-aligned, class-sized chunks that are converted concurrently
+    by up to `workers` requests, then stitched into one module with imports
+    deduplicated. A file that fits in one chunk goes through convert_c_to_python.
+    Responses are cached per chunk, so after an edit only changed chunks are
+    sent again (unless `use_cache` is False). If any chunk fails, the others
+    are still stitched and a ChunkConversionError carrying them is raised.
+
+    With `on_partial` the chunks are streamed: at most every STREAM_REFRESH_S
+    it is passed the code received so far, chunk by chunk in file order
+    (unstitched), from the worker threads.
+    """
+    outline = parse_c_code_str_skeleton(code, filename=filename, bodies=True)
+    chunks = plan_chunks(code, outline, max_chars=max_chunk_chars)
+    if len(chunks) <= 1:
+        return convert_c_to_python(code, model=model, top_k_context=top_k_context, store=store,
+                                   migration_id=migration_id, embed_model=embed_model, use_cache=use_cache,
+                                   on_partial=on_partial)
+    start = time.perf_counter()
+    durations = [0.0] * len(chunks)
+    partials = [''] * len(chunks)
+    refresh = threading.Lock()
+    last_refresh = 0.0
+
+    def chunk_partial(chunk: Chunk, text: str):
+        nonlocal last_refresh
+        partials[chunk.index] = text
+        with refresh:
+            now = time.perf_counter()
+            if now - last_refresh < STREAM_REFRESH_S:
+                return
+            last_refresh = now
+            on_partial('\n\n'.join(f"# --- {c.title} ---\n{p}" for c, p in zip(chunks, partials) if p))
+
+    def convert(chunk: Chunk) -> str:
+        t0 = time.perf_counter()
+        report = (lambda text: chunk_partial(chunk, text)) if on_partial is not None else None
         try:
-            resp = ollama.generate(model=model, prompt=system_prompt + "\n\n" + user_message)
-        except Exception as e2:
-            raise RuntimeError(f"Ollama call failed: {e} / {e2}")
+            return _convert_chunk(chunk, outline, model, top_k_context, store, migration_id, embed_model,
+                                  use_cache, report)
+        finally:
+            durations[chunk.index] = time.perf_counter() - t0
 
-    text = extract_text_from_ollama_response(resp)
-    python_code = extract_python_code(text)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(convert, c) for c in chunks]
+        parts, failed = [], []
+        for chunk, future in zip(chunks, futures):
+            try:
+                parts.append(future.result())
+            except Exception as e:
+                failed.append((chunk.title, e))
+    python_code = stitch_modules(parts)
+    elapsed = time.perf_counter() - start
+    total = sum(durations)
+    print(f"Converted {len(chunks)} chunks with {workers} workers in {elapsed:.2f}s "
+          f"({total:.2f}s of requests, {total / elapsed if elapsed else 1:.1f}x concurrency), "
+          f"{len(failed)} failed")
+    if failed:
+        raise ChunkConversionError(python_code, failed)
     return python_code
 
+def convert_c_to_python_stream(code: str, **kwargs) -> Iterator[str]:
+    """
+    Streaming convert_c_to_python_chunked (same keyword arguments): yields the
+    Python received so far as it grows, and last the finished module. When
+    the consumer falls behind, intermediate updates are skipped. Conversion
+    runs on a background thread; if the consumer stops early it still
+    finishes, and its responses land in the cache.
+    """
+    updates = queue.Queue()
+    done = object()
+    result = {}
+
+    def run():
+        try:
+            result['code'] = convert_c_to_python_chunked(code, on_partial=updates.put, **kwargs)
+        except Exception as e:
+            result['error'] = e
+        finally:
+            updates.put(done)
+
+    threading.Thread(target=run, name='convert-stream', daemon=True).start()
+    while True:
+        latest = updates.get()
+        while latest is not done and not updates.empty():
+            latest = updates.get_nowait()
+        if latest is done:
+            break
+        yield latest
+    if 'error' in result:
+        raise result['error']
+    yield result['code']
+
 def extract_python_code(text: str) -> str:
     """
     Extracts the first Python code block from a string.
@@ -124,25 +401,8 @@ def generate_python_code(prompt: str) -> str:
     if GROQ_API_KEY:
         try:
             print("Trying Groq for code generation...")
-            headers = {
-                "Authorization": f"Bearer {GROQ_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": GROQ_MODEL,
-                "messages": [
-                    {"role": "system", "content": "Convert C code to clean, idiomatic OOP Python. Only output Python code."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 2048,
-                "temperature": 0.2
-            }
-            resp = requests.post(GROQ_CHAT_URL, headers=headers, json=data, timeout=60)
-            resp.raise_for_status()
-            result = resp.json()
-            code = result['choices'][0]['message']['content']
-            print("Using Groq for code generation.")
-            return code
+            system = "Convert C code to clean, idiomatic OOP Python. Only output Python code."
+            return get_llm_client().complete(system, prompt, providers=['groq']).text
         except Exception as e:
             print(f"Groq code generation failed: {e}")
 
@@ -150,30 +410,11 @@ def generate_python_code(prompt: str) -> str:
     print("Falling back to Ollama for code generation...")
     context = get_top_ast_context(limit=30)
 
-    system_prompt = (
-        "You are an expert engineer that converts procedural C code into readable, well-structured OOP Python 3 code.\n"
-        "Rules:\n"
-        "1) Convert C structs with related functions into Python classes.\n"
-        "2) Preserve naming where appropriate and document behavior with docstrings.\n"
-        "3) Provide a short mapping summary of how C constructs map to Python (at top).\n        "
-        "4) Return only the Python source code (no back-and-forth commentary).\n"
-    )
-
     user_message = f"// AST context:\n{context}\n\n// C Source:\n{prompt}\n\n// Conversion instructions:\nConvert the above C into OOP Python with classes, methods, and clear docstrings. Output valid Python code."
 
-    try:
-        resp = ollama.chat(model=DEFAULT_MODEL, messages=[{"role":"system", "content": system_prompt},
-                                                 {"role":"user", "content": user_message}])
-    except Exception as e:
-        # fallback: try generate
-        try:
-            resp = ollama.generate(model=DEFAULT_MODEL, prompt=system_prompt + "\n\n" + user_message)
-        except Exception as e2:
-            raise RuntimeError(f"Ollama call failed: {e} / {e2}")
-
-    text = extract_text_from_ollama_response(resp)
-    python_code = extract_python_code(text)
-    return python_code
+    completion = get_llm_client().complete(SYSTEM_PROMPT, user_message, providers=['ollama'],
+                                           models={'ollama': DEFAULT_MODEL})
+    return extract_python_code(completion.text)
 
 if __name__ == '__main__':
     import sys
@@ -181,6 +422,11 @@ if __name__ == '__main__':
         print("Usage: python backend/llm_converter.py path/to/file.c")
         raise SystemExit(1)
     code = open(sys.argv[1]).read()
-    out = convert_c_to_python(code)
+    try:
+        out = convert_c_to_python_chunked(code, filename=sys.argv[1])
+    except ChunkConversionError as e:
+        print(e.code)
+        print(e, file=sys.stderr)
+        raise SystemExit(1)
     print(out)
 
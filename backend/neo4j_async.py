@@ -0,0 +1,229 @@
+"""
+backend/neo4j_async.py
+Concurrent AST ingestion on the Neo4j async driver.
+
+The AST is split into top-level declaration subtrees. A producer flattens
+them lazily, batch by batch, into a small queue per subtree, and those queues
+wait on a bounded asyncio queue for a fixed pool of writer tasks, each on its
+own session. At most (queue_size + workers) x SUBTREE_QUEUE_BATCHES batches
+are held at once, however large the TU or any single function in it. A
+subtree is always written by one task in pre-order, so every CHILD edge
+finds its parent already committed. The root's edges to the subtrees touch
+a single hot node and are merged last, in one batch, to avoid lock
+contention between writers. Header subtrees whose USR the instance already
+has are never queued, and each batch links its nodes to the canonical Symbols.
+Call-graph edges (backend.call_graph) are derived by the producer as it
+flattens and replace the file's previous ones once every subtree is written.
+
+push_ast_concurrently() runs every push on one background event loop with
+one shared driver, so its connection pool is reused from file to file.
+Transient errors (deadlocks, lock timeouts) are retried by execute_write.
+"""
+import asyncio
+import atexit
+import os
+import threading
+import time
+from typing import Optional, Set, Union
+
+from neo4j import AsyncGraphDatabase
+
+from backend.ast_to_neo4j import DEFAULT_BATCH_SIZE, ast_rows, skip_repeated_headers, symbol_link_rows
+from backend.compact_ast import CompactAST
+from backend.call_graph import CallGraphDeriver
+from backend.code_units import mark_code_units
+from backend.graph_store import (CLEAR_DERIVED_QUERY, DERIVED_EDGE_QUERIES, EDGE_BATCH_QUERY,
+                                 NODE_BATCH_QUERY, SYMBOL_LINK_QUERIES)
+from backend.neo4j_client import NEO4J_PASSWORD, NEO4J_URI, NEO4J_USER
+
+# Connections in the shared driver's pool.
+NEO4J_ASYNC_POOL_SIZE = int(os.getenv('NEO4J_ASYNC_POOL_SIZE', '50'))
+# Batches a subtree may have flattened ahead of the writer that owns it.
+SUBTREE_QUEUE_BATCHES = int(os.getenv('SUBTREE_QUEUE_BATCHES', '2'))
+
+def _make_driver(pool_size: int):
+    return AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD),
+                                     max_connection_pool_size=pool_size)
+
+async def _run_batch(tx, query: str, params: dict):
+    result = await tx.run(query, params)
+    await result.consume()
+
+class AsyncGraphWriter:
+    """
+    Pool of `workers` writer tasks. Each queued subtree is a queue of at most
+    SUBTREE_QUEUE_BATCHES batches of `batch_size` rows, and at most
+    `queue_size` subtrees wait for a writer.
+    """
+
+    def __init__(self, workers: int = 4, batch_size: int = DEFAULT_BATCH_SIZE,
+                 queue_size: Optional[int] = None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size or workers * 2
+        self.nodes_written = 0
+        self._error = None
+
+    async def _write(self, session, query: str, params: dict):
+        # execute_write retries transient failures (deadlocks, lock timeouts) itself
+        await session.execute_write(_run_batch, query, params)
+
+    async def _write_batch(self, session, rows: list, instance_id: str):
+        nodes = [n for n, _ in rows]
+        edges = [e for _, e in rows if e]
+        await self._write(session, NODE_BATCH_QUERY, {'rows': nodes, 'instance_id': instance_id})
+        if edges:
+            await self._write(session, EDGE_BATCH_QUERY, {'rows': edges})
+        for rel, links in symbol_link_rows(nodes).items():
+            await self._write(session, SYMBOL_LINK_QUERIES[rel],
+                              {'rows': links, 'instance_id': instance_id})
+        self.nodes_written += len(nodes)
+
+    async def _worker(self, driver, queue: asyncio.Queue, instance_id: str):
+        async with driver.session() as session:
+            while True:
+                subtree = await queue.get()
+                try:
+                    if subtree is None:
+                        return
+                    # one subtree, batch by batch in pre-order, until its None
+                    while (rows := await subtree.get()) is not None:
+                        # after a failure keep draining so the producer never blocks
+                        if self._error is None:
+                            try:
+                                await self._write_batch(session, rows, instance_id)
+                            except Exception as e:
+                                self._error = e
+                finally:
+                    queue.task_done()
+
+    async def push(self, ast_dict: Union[dict, CompactAST], instance_id: str,
+                   known_symbols: Optional[Set[str]] = None, source: Optional[str] = None, defined_symbols: Optional[Set[str]] = None,
+                   driver=None) -> str:
+        """
+        Write `ast_dict` (a nested AST dict or a CompactAST) under `instance_id`
+        and return the root node id.
+        `known_symbols` are USRs already declared in the instance (see
+        GraphStore.known_symbols) and `defined_symbols` those already defined;
+        header subtrees repeating them are skipped (see is_repeated_header_decl).
+        Code unit roots get their source text from `source` or the main file.
+        Uses `driver` (an AsyncDriver on this loop) if given, else a driver
+        of its own for this push.
+        """
+        start = time.perf_counter()
+        deriver = CallGraphDeriver()
+        # the same row pipeline as push_rows_batched, consumed lazily
+        rows = mark_code_units(ast_rows(ast_dict), source)
+        rows = deriver.observe(rows)
+        rows = skip_repeated_headers(rows, set(known_symbols or ()), set(defined_symbols or ()))
+        root_row, _ = next(rows)
+        root_id = root_row['node_id']
+
+        own_driver = driver is None
+        if own_driver:
+            driver = _make_driver(max(self.workers + 1, 10))
+        try:
+            async with driver.session() as session:
+                await self._write(session, NODE_BATCH_QUERY, {'rows': [root_row], 'instance_id': instance_id})
+            self.nodes_written += 1
+
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            tasks = [asyncio.create_task(self._worker(driver, queue, instance_id))
+                     for _ in range(self.workers)]
+            root_edges = []
+            try:
+                subtree, batch = None, []
+                for node_row, edge_row in rows:
+                    if edge_row['parent_id'] == root_id:
+                        # a new top-level subtree; its edge to the root is merged last
+                        if subtree is not None:
+                            if batch:
+                                await subtree.put(batch)
+                            await subtree.put(None)
+                        subtree, batch = asyncio.Queue(maxsize=SUBTREE_QUEUE_BATCHES), []
+                        await queue.put(subtree)  # blocks while the writers are behind
+                        root_edges.append(edge_row)
+                        edge_row = None
+                    batch.append((node_row, edge_row))
+                    if len(batch) >= self.batch_size:
+                        await subtree.put(batch)
+                        batch = []
+                if subtree is not None:
+                    if batch:
+                        await subtree.put(batch)
+                    await subtree.put(None)
+                for _ in tasks:
+                    await queue.put(None)
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for t in tasks:
+                    t.cancel()
+                raise
+            if self._error is not None:
+                raise self._error
+
+            async with driver.session() as session:
+                for i in range(0, len(root_edges), self.batch_size):
+                    await self._write(session, EDGE_BATCH_QUERY, {'rows': root_edges[i:i + self.batch_size]})
+                if deriver.source:
+                    params = {'instance_id': instance_id, 'source': deriver.source}
+                    await self._write(session, CLEAR_DERIVED_QUERY, {'mid': instance_id, 'source': deriver.source})
+                    for rel, derived in deriver.edges().items():
+                        await self._write(session, DERIVED_EDGE_QUERIES[rel], dict(params, rows=derived))
+        finally:
+            if own_driver:
+                await driver.close()
+
+        elapsed = time.perf_counter() - start
+        rate = self.nodes_written / elapsed if elapsed > 0 else float('inf')
+        print(f"Pushed {self.nodes_written} AST nodes with {self.workers} writers in {elapsed:.2f}s "
+              f"({rate:.0f} nodes/sec)")
+        return root_id
+
+class _SharedDriver:
+    """An event loop thread and the one AsyncDriver used on it, for the whole process."""
+
+    def __init__(self, pool_size: int = NEO4J_ASYNC_POOL_SIZE):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='neo4j-async', daemon=True).start()
+        self.driver = self.run(self._open(pool_size))
+        atexit.register(self.close)
+
+    @staticmethod
+    async def _open(pool_size: int):
+        return _make_driver(pool_size)
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        self.run(self.driver.close())
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def _shared_driver() -> _SharedDriver:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = _SharedDriver()
+    return _shared
+
+def push_ast_concurrently(ast_dict: Union[dict, CompactAST], instance_id: str, workers: int = 4,
+                          batch_size: int = DEFAULT_BATCH_SIZE, known_symbols: Optional[Set[str]] = None,
+                          source: Optional[str] = None, defined_symbols: Optional[Set[str]] = None) -> str:
+    """Synchronous facade over AsyncGraphWriter for the existing pipeline, on the shared driver."""
+    shared = _shared_driver()
+    writer = AsyncGraphWriter(workers=workers, batch_size=batch_size)
+    return shared.run(writer.push(ast_dict, instance_id, known_symbols=known_symbols, source=source,
+                                  defined_symbols=defined_symbols, driver=shared.driver))
+
+if __name__ == '__main__':
+    import sys
+    import ujson as json
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.neo4j_async path/to/ast.json [workers]")
+        raise SystemExit(1)
+    ast = json.loads(open(sys.argv[1]).read())
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print("root node id", push_ast_concurrently(ast, "demo-instance", workers=workers))
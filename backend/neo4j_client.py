@@ -1,30 +1,245 @@
 """Simple neo4j wrapper"""
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Query
 import os
-from typing import Optional, Iterable
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Iterable, Iterator
 
 NEO4J_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
 NEO4J_USER = os.getenv('NEO4J_USER', 'neo4j')
 NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD', 'strongpass123')
 
+# Driver tuning; timeouts are in seconds, NEO4J_QUERY_TIMEOUT=0 means no limit.
+NEO4J_MAX_POOL_SIZE = int(os.getenv('NEO4J_MAX_POOL_SIZE', '50'))
+NEO4J_CONNECTION_TIMEOUT = float(os.getenv('NEO4J_CONNECTION_TIMEOUT', '30'))
+NEO4J_ACQUISITION_TIMEOUT = float(os.getenv('NEO4J_ACQUISITION_TIMEOUT', '60'))
+NEO4J_QUERY_TIMEOUT = float(os.getenv('NEO4J_QUERY_TIMEOUT', '0'))
+NEO4J_FETCH_SIZE = int(os.getenv('NEO4J_FETCH_SIZE', '1000'))
+
+# Set NEO4J_BOOTSTRAP_SCHEMA=0 to skip creating constraints/indexes on first connect.
+NEO4J_BOOTSTRAP_SCHEMA = os.getenv('NEO4J_BOOTSTRAP_SCHEMA', '1') != '0'
+
+# (label, property) pairs that ingestion and context queries look nodes up by.
+SCHEMA_INDEXES = [
+    ('ASTNode', 'node_id'),
+    ('ASTNode', 'migration_id'),
+    ('ASTNode', 'usr'),
+    ('ASTNode', 'kind'),
+    ('CodeUnit', 'migration_id'),
+    ('Symbol', 'symbol_id'),
+    ('Symbol', 'migration_id'),
+    ('Migration', 'migration_id'),
+    ('Migration', 'created_at'),
+]
+
+SCHEMA_STATEMENTS = [
+    'CREATE CONSTRAINT astnode_node_id IF NOT EXISTS FOR (n:ASTNode) REQUIRE n.node_id IS UNIQUE',
+    'CREATE INDEX astnode_migration_id IF NOT EXISTS FOR (n:ASTNode) ON (n.migration_id)',
+    'CREATE INDEX astnode_usr IF NOT EXISTS FOR (n:ASTNode) ON (n.usr)',
+    'CREATE INDEX astnode_kind IF NOT EXISTS FOR (n:ASTNode) ON (n.kind)',
+    'CREATE INDEX codeunit_migration_id IF NOT EXISTS FOR (n:CodeUnit) ON (n.migration_id)',
+    'CREATE CONSTRAINT symbol_id IF NOT EXISTS FOR (s:Symbol) REQUIRE s.symbol_id IS UNIQUE',
+    'CREATE INDEX symbol_migration_id IF NOT EXISTS FOR (s:Symbol) ON (s.migration_id)',
+    'CREATE CONSTRAINT migration_id IF NOT EXISTS FOR (m:Migration) REQUIRE m.migration_id IS UNIQUE',
+    'CREATE INDEX migration_created_at IF NOT EXISTS FOR (m:Migration) ON (m.created_at)',
+]
+
 _driver = None
+_local = threading.local()
+
+# query text -> {'count', 'total_s', 'max_s'}
+_query_stats = {}
+_stats_lock = threading.Lock()
 
 def get_driver():
     global _driver
     if _driver is None:
-        _driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        _driver = GraphDatabase.driver(
+            NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD),
+            max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+            connection_timeout=NEO4J_CONNECTION_TIMEOUT,
+            connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT,
+        )
+        if NEO4J_BOOTSTRAP_SCHEMA:
+            try:
+                ensure_schema(_driver)
+            except Exception as e:
+                print(f"Neo4j schema bootstrap failed: {e}")
     return _driver
 
 def close_driver():
     global _driver
+    session = getattr(_local, 'session', None)
+    if session is not None:
+        session.close()
+        _local.session = None
     if _driver:
         _driver.close()
         _driver = None
 
-def run_cypher(query: str, params: Optional[dict] = None) -> Iterable:
-    driver = get_driver()
+def _session():
+    """Session reused by run_cypher on the calling thread (sessions are not thread-safe)."""
+    session = getattr(_local, 'session', None)
+    if session is None or getattr(_local, 'driver', None) is not _driver or session.closed():
+        session = get_driver().session(fetch_size=NEO4J_FETCH_SIZE)
+        _local.session = session
+        _local.driver = _driver
+    return session
+
+def _query(query: str, timeout: Optional[float] = None):
+    timeout = NEO4J_QUERY_TIMEOUT if timeout is None else timeout
+    return Query(query, timeout=timeout) if timeout else query
+
+def _record_timing(query: str, elapsed: float):
+    with _stats_lock:
+        stats = _query_stats.get(query)
+        if stats is None:
+            stats = _query_stats[query] = {'count': 0, 'total_s': 0.0, 'max_s': 0.0}
+        stats['count'] += 1
+        stats['total_s'] += elapsed
+        stats['max_s'] = max(stats['max_s'], elapsed)
+
+def query_stats() -> dict:
+    """Per-query call counts and wall-clock timings since start (or the last reset)."""
+    with _stats_lock:
+        return {q: dict(v) for q, v in _query_stats.items()}
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+
+def ensure_schema(driver=None):
+    """
+    Create the ASTNode uniqueness constraint and lookup indexes.
+    Every statement uses IF NOT EXISTS, so this is safe to run repeatedly.
+    """
+    driver = driver or get_driver()
+    with driver.session() as session:
+        for statement in SCHEMA_STATEMENTS:
+            session.run(statement).consume()
+
+def check_schema(driver=None) -> list:
+    """
+    Return the (label, property) pairs from SCHEMA_INDEXES that have no online index.
+    """
+    driver = driver or get_driver()
     with driver.session() as session:
-        result = session.run(query, params or {})
-        # return generator of records (list-friendly)
-        return list(result)
+        rows = list(session.run(
+            'SHOW INDEXES YIELD labelsOrTypes, properties, state '
+            'WHERE state = "ONLINE" RETURN labelsOrTypes, properties'
+        ))
+    present = set()
+    for r in rows:
+        labels = r['labelsOrTypes'] or []
+        props = r['properties'] or []
+        # composite indexes can only serve lookups on their leading property
+        if labels and props:
+            present.add((labels[0], props[0]))
+    return [pair for pair in SCHEMA_INDEXES if pair not in present]
+
+def run_cypher(query: str, params: Optional[dict] = None, timeout: Optional[float] = None) -> Iterable:
+    start = time.perf_counter()
+    result = _session().run(_query(query, timeout), params or {})
+    # materialized list of records; use stream_cypher for large reads
+    records = list(result)
+    _record_timing(query, time.perf_counter() - start)
+    return records
+
+def stream_cypher(query: str, params: Optional[dict] = None, fetch_size: int = NEO4J_FETCH_SIZE,
+                  timeout: Optional[float] = None) -> Iterator:
+    """
+    Yield records lazily, pulling `fetch_size` at a time from the server.
+    Uses its own session, which stays open until the iterator is exhausted or closed.
+    """
+    start = time.perf_counter()
+    with get_driver().session(fetch_size=fetch_size) as session:
+        try:
+            yield from session.run(_query(query, timeout), params or {})
+        finally:
+            _record_timing(query, time.perf_counter() - start)
+
+class StatementBatch:
+    """Statements collected inside a transaction() block."""
+
+    def __init__(self):
+        self.statements = []
+
+    def run(self, query: str, params: Optional[dict] = None):
+        self.statements.append((query, params or {}))
+
+def _run_statements(tx, statements: list):
+    for query, params in statements:
+        tx.run(query, params).consume()
+
+@contextmanager
+def transaction(timeout: Optional[float] = None):
+    """
+    Group statements into one managed write transaction:
+
+        with transaction() as tx:
+            tx.run(query_a, params_a)
+            tx.run(query_b, params_b)
+
+    Statements are sent together when the block exits; the driver retries the
+    whole unit on transient failures, so they must be safe to replay.
+    Nothing is sent if the block raises.
+    """
+    batch = StatementBatch()
+    yield batch
+    if not batch.statements:
+        return
+    work = _run_statements
+    timeout = NEO4J_QUERY_TIMEOUT if timeout is None else timeout
+    if timeout:
+        from neo4j import unit_of_work
+        work = unit_of_work(timeout=timeout)(_run_statements)
+    start = time.perf_counter()
+    _session().execute_write(work, batch.statements)
+    _record_timing('transaction', time.perf_counter() - start)
+
+
+def _run_batch(tx, query: str, params: dict):
+    return tx.run(query, params).consume()
+
+def write_batches(query: str, batches: Iterable[list], params: Optional[dict] = None) -> int:
+    """
+    Run `query` once per batch, each in its own managed write transaction.
+    The batch is bound to `$rows`, so `query` is expected to UNWIND it.
+    Returns the total number of rows written.
+    """
+    session = _session()
+    total = 0
+    for rows in batches:
+        if not rows:
+            continue
+        start = time.perf_counter()
+        session.execute_write(_run_batch, query, {**(params or {}), 'rows': rows})
+        _record_timing(query, time.perf_counter() - start)
+        total += len(rows)
+    return total
 
+if __name__ == '__main__':
+    import sys
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ''
+    if cmd == 'bootstrap-schema':
+        ensure_schema()
+        print("Schema bootstrap complete.")
+    elif cmd == 'check-schema':
+        # report the database as it is, without bootstrapping on connect
+        NEO4J_BOOTSTRAP_SCHEMA = False
+        missing = check_schema()
+        for label, prop in missing:
+            print(f"Missing index: :{label}({prop})")
+        if missing:
+            raise SystemExit(1)
+        print("All expected indexes are online.")
+    elif cmd == 'query-stats':
+        # e.g. python -m backend.neo4j_client query-stats "MATCH (n:ASTNode) RETURN count(n)"
+        for q in sys.argv[2:]:
+            run_cypher(q)
+        for q, st in sorted(query_stats().items(), key=lambda kv: -kv[1]['total_s']):
+            print(f"{st['count']:6d} calls {st['total_s']:8.3f}s total {st['max_s']:7.3f}s max  {q.strip()[:80]}")
+    else:
+        print("Usage: python -m backend.neo4j_client [bootstrap-schema|check-schema|query-stats QUERY...]")
+        raise SystemExit(1)
@@ -0,0 +1,142 @@
+"""Content-addressed cache of parsed ASTs (and optionally saved libclang TUs)."""
+import hashlib
+import os
+import zlib
+from pathlib import Path
+from typing import Optional
+
+import ujson as json
+
+from backend.cache import DiskCache, cache_dir
+
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Part of every key; bump when the parser adds or changes node fields so
+# entries in the old shape stop matching.
+AST_FORMAT_VERSION = 5
+
+def _sha256_file(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def _relative_to(path: str, base: Optional[str]) -> str:
+    """`path` relative to `base` if it lies under it, else unchanged."""
+    if base and (path == base or path.startswith(base + os.sep)):
+        return os.path.relpath(path, base)
+    return path
+
+def _rebase_locations(ast: dict, old_base: str, new_base: str):
+    """Move node 'location's under `old_base` to the same place under `new_base`, in place."""
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        loc = node.get('location')
+        if loc and loc != 'None':
+            rel = _relative_to(os.path.abspath(loc), old_base)
+            if not os.path.isabs(rel):
+                node['location'] = os.path.join(new_base, rel)
+        stack.extend(node.get('children') or ())
+
+class ParseCache(DiskCache):
+    """
+    Parse results keyed by a hash of the main file contents, the compiler args
+    and the parse options. Each entry also records the hash of every header the
+    TU included; a lookup only hits if all of them are unchanged on disk.
+    With `save_tu`, libclang's serialized TU is kept next to the database.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = PARSE_CACHE_MAX_BYTES,
+                 save_tu: bool = False):
+        path = path or str(cache_dir() / 'parse.sqlite')
+        super().__init__(path, max_bytes=max_bytes)
+        self.save_tu = save_tu
+        self.tu_dir = self.path.parent / 'tu'
+
+    @staticmethod
+    def make_key(content: bytes, filename: str, args: list, options: dict) -> str:
+        h = hashlib.sha256()
+        h.update(str(AST_FORMAT_VERSION).encode() + b'\0')
+        h.update(content)
+        h.update(b'\0' + os.path.basename(filename).encode())
+        h.update(b'\0' + json.dumps(list(args)).encode())
+        h.update(b'\0' + json.dumps(options, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def tu_path(self, key: str) -> Path:
+        return self.tu_dir / f'{key}.ast'
+
+    def lookup(self, key: str, base: Optional[str] = None) -> Optional[dict]:
+        """
+        Return the cached AST dict, or None if absent or a header changed.
+        Entries stored with a `base` directory are relocatable: their headers
+        are checked under `base`, and node locations are moved there.
+        """
+        blob = self.get(key)
+        if blob is None:
+            return None
+        entry = json.loads(zlib.decompress(blob))
+        for dep, digest in entry['deps'].items():
+            if _sha256_file(os.path.join(base or '', dep)) != digest:
+                # counted as a hit by get(); correct it
+                self.hits -= 1
+                self.misses += 1
+                self.delete(key)
+                return None
+        old_base = entry.get('base')
+        if base and old_base and old_base != base:
+            _rebase_locations(entry['ast'], old_base, base)
+        return entry['ast']
+
+    def store(self, key: str, ast: dict, tu=None, base: Optional[str] = None):
+        """
+        Cache `ast`, fingerprinting the headers `tu` included. Headers under
+        `base` are recorded relative to it, so the entry survives the project
+        directory being moved (see lookup).
+        """
+        base = os.path.abspath(base) if base else None
+        deps = {}
+        if tu is not None:
+            for inc in tu.get_includes():
+                name = os.path.abspath(inc.include.name)
+                digest = _sha256_file(name)
+                if digest:
+                    deps[_relative_to(name, base)] = digest
+            if self.save_tu:
+                self.tu_dir.mkdir(parents=True, exist_ok=True)
+                tu.save(str(self.tu_path(key)))
+        blob = zlib.compress(json.dumps({'deps': deps, 'base': base, 'ast': ast}).encode())
+        self.put(key, blob)
+
+    def load_tu(self, key: str, index=None):
+        """Load a saved TU for `key` without reparsing, or None if it was not saved."""
+        import clang.cindex
+        path = self.tu_path(key)
+        if not path.exists():
+            return None
+        index = index or clang.cindex.Index.create()
+        return index.read(str(path))
+
+    def delete(self, key: str):
+        super().delete(key)
+        self.on_evict(key)
+
+    def on_evict(self, key: str):
+        try:
+            self.tu_path(key).unlink()
+        except OSError:
+            pass
+
+_default_cache = None
+_default_cache_pid = None
+
+def get_parse_cache() -> ParseCache:
+    # A forked worker must not reuse the parent's SQLite connection or lock,
+    # so each process opens its own.
+    global _default_cache, _default_cache_pid
+    if _default_cache is None or _default_cache_pid != os.getpid():
+        _default_cache = ParseCache(save_tu=os.getenv('PARSE_CACHE_SAVE_TU', '0') == '1')
+        _default_cache_pid = os.getpid()
+    return _default_cache
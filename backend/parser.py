@@ -3,119 +3,529 @@ backend/parser.py
 Parse C source into a JSON-serializable AST using libclang.
 """
 import clang.cindex
+import ctypes
 import ujson as json
 from pathlib import Path
 import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, Optional
+from backend.parse_cache import ParseCache, get_parse_cache
 
 # You may need to tell clang where to find its library file.
 # clang.cindex.Config.set_library_file('/usr/lib/x86_64-linux-gnu/libclang-14.so')
 
-def parse_c_file_to_ast_dict(path: str) -> dict:
+def make_location_filter(main_file: str, include_roots: Optional[list] = None):
     """
-    Parse C source file at `path` into a nested dict AST using libclang.
+    Return a predicate that is True for cursors located in `main_file` or under
+    one of `include_roots`. Cursors without a file (builtins) are rejected.
+    """
+    main = os.path.abspath(str(main_file))
+    roots = [os.path.join(os.path.abspath(str(r)), '') for r in include_roots or []]
+
+    def keep(cursor) -> bool:
+        f = cursor.location.file
+        if f is None:
+            return False
+        name = os.path.abspath(f.name)
+        return name == main or any(name.startswith(r) for r in roots)
+
+    return keep
+
+# One flat record per cursor. `stub` marks a cursor whose subtree was pruned;
+# `ref_usr` is the USR a reference points at, `definition` is set on
+# declarations that are also definitions, `operator` spells the operator
+# of unary/binary/compound-assignment expressions and `extent` is the
+# (start offset, end offset, end line) source range of top-level cursors.
+ASTRecord = namedtuple(
+    'ASTRecord',
+    ['node_id', 'parent_id', 'ordinal', 'kind', 'spelling', 'type', 'usr',
+     'file', 'line', 'column', 'stub', 'ref_usr', 'definition', 'operator', 'extent'],
+    defaults=(False, None, False, None, None),
+)
+
+# Cursor kinds that name another declaration (their own USR is empty).
+REFERENCE_KINDS = frozenset({
+    'TYPE_REF', 'MEMBER_REF', 'LABEL_REF', 'VARIABLE_REF',
+    'DECL_REF_EXPR', 'MEMBER_REF_EXPR', 'CALL_EXPR',
+})
+
+_BINARY_OPERATOR_KINDS = ('BINARY_OPERATOR', 'COMPOUND_ASSIGNMENT_OPERATOR')
+_operator_fns = None
+
+def _operator_fn_table() -> dict:
+    # The operator-kind entry points exist in libclang >= 17 but the Python
+    # bindings of that vintage do not wrap them; older libraries lack them.
+    lib = clang.cindex.conf.lib
+    fns = {}
+    for name, kinds in (('Binary', _BINARY_OPERATOR_KINDS), ('Unary', ('UNARY_OPERATOR',))):
+        try:
+            get_kind = getattr(lib, f'clang_getCursor{name}OperatorKind')
+            spell = getattr(lib, f'clang_get{name}OperatorKindSpelling')
+        except AttributeError:
+            continue
+        get_kind.argtypes = [clang.cindex.Cursor]
+        get_kind.restype = ctypes.c_uint
+        spell.argtypes = [ctypes.c_uint]
+        spell.restype = clang.cindex._CXString
+        spell.errcheck = clang.cindex._CXString.from_result
+        for k in kinds:
+            fns[k] = (get_kind, spell)
+    return fns
+
+def _operator_token(cursor, kind: str) -> Optional[str]:
+    # Without the entry points: the operator's own token, i.e. the first token
+    # after the left operand, or the token before/after a unary operand.
+    operands = list(cursor.get_children())
+    tokens = list(cursor.get_tokens())
+    if not operands or not tokens:
+        return None
+    operand = operands[0].extent
+    if kind == 'UNARY_OPERATOR':
+        first = tokens[0]
+        return (first if first.extent.start.offset < operand.start.offset else tokens[-1]).spelling
+    for token in tokens:
+        if token.extent.start.offset >= operand.end.offset:
+            return token.spelling
+    return None
+
+def _operator_spelling(cursor, kind: str) -> Optional[str]:
+    global _operator_fns
+    if _operator_fns is None:
+        _operator_fns = _operator_fn_table()
+    if kind not in _operator_fns:
+        return _operator_token(cursor, kind)
+    get_kind, spell = _operator_fns[kind]
+    op = get_kind(cursor)
+    return spell(op) if op else None
+
+def _is_definition(cursor) -> bool:
+    # libclang reports a file-scope `int n;` or `static int n;` as a plain
+    # declaration, but C makes such a tentative definition a definition;
+    # only `extern` without an initializer merely declares.
+    if cursor.is_definition():
+        return True
+    return (cursor.kind == clang.cindex.CursorKind.VAR_DECL
+            and cursor.semantic_parent is not None
+            and cursor.semantic_parent.kind == clang.cindex.CursorKind.TRANSLATION_UNIT
+            and cursor.storage_class != clang.cindex.StorageClass.EXTERN)
+
+def _cursor_record(cursor, node_id, parent_id, ordinal, stub=False) -> ASTRecord:
+    loc = cursor.location
+    kind = cursor.kind.name
+    usr = cursor.get_usr()
+    ref_usr = operator = None
+    if kind in REFERENCE_KINDS:
+        target = cursor.referenced
+        ref_usr = (target.get_usr() or None) if target is not None else None
+    elif kind in _BINARY_OPERATOR_KINDS or kind == 'UNARY_OPERATOR':
+        operator = _operator_spelling(cursor, kind)
+    extent = None
+    if parent_id == 0:
+        ext = cursor.extent
+        extent = (ext.start.offset, ext.end.offset, ext.end.line)
+    return ASTRecord(
+        node_id, parent_id, ordinal,
+        kind, cursor.spelling, cursor.type.spelling, usr,
+        loc.file.name if loc.file else None, loc.line, loc.column, stub,
+        ref_usr, bool(usr) and _is_definition(cursor), operator, extent,
+    )
+
+def iter_ast_records(cursor, keep=None) -> Iterator[ASTRecord]:
+    """
+    Walk the cursor tree in document order and yield one ASTRecord per cursor.
+    node_id is a sequential integer (the root is 0). Only one child iterator per
+    open ancestor is held, so memory is O(depth). Cursors rejected by `keep`
+    are yielded as stubs and their subtrees are not visited.
+    """
+    yield _cursor_record(cursor, 0, None, 0)
+    next_id = 1
+    # (child iterator, parent node id, next child ordinal)
+    stack = [[iter(cursor.get_children()), 0, 0]]
+    while stack:
+        frame = stack[-1]
+        child = next(frame[0], None)
+        if child is None:
+            stack.pop()
+            continue
+        node_id, ordinal = next_id, frame[2]
+        next_id += 1
+        frame[2] += 1
+        if keep is not None and not keep(child):
+            yield _cursor_record(child, node_id, frame[1], ordinal, stub=True)
+            continue
+        yield _cursor_record(child, node_id, frame[1], ordinal)
+        stack.append([iter(child.get_children()), node_id, 0])
+
+def record_to_dict(record: ASTRecord) -> dict:
+    """Node dict in the format the rest of the pipeline expects (without children)."""
+    node = {
+        'kind': record.kind,
+        'spelling': record.spelling,
+        'location': str(record.file),
+        'line': record.line,
+        'column': record.column,
+        'type': record.type,
+        'usr': record.usr,
+    }
+    if record.stub:
+        node['stub'] = True
+    if record.ref_usr:
+        node['ref_usr'] = record.ref_usr
+    if record.definition:
+        node['definition'] = True
+    if record.operator:
+        node['operator'] = record.operator
+    if record.extent:
+        node['extent_start'], node['extent_end'], node['end_line'] = record.extent
+    return node
+
+def build_ast_dict(records: Iterable[ASTRecord], empty_children: bool = True) -> dict:
+    """
+    Assemble document-ordered records into the nested dict AST in linear time.
+    Only the current ancestor path is tracked, since a record's parent is always
+    on it. With `empty_children=False`, leaves get no 'children' key.
+    Stub records are counted into root['pruned_nodes'] when present.
+    """
+    root = None
+    path = []  # [(node_id, node_dict)] from the root down to the last record
+    pruned = 0
+    for rec in records:
+        node = record_to_dict(rec)
+        if empty_children:
+            node['children'] = []
+        if rec.stub:
+            pruned += 1
+        if rec.parent_id is None:
+            root = node
+        else:
+            while path[-1][0] != rec.parent_id:
+                path.pop()
+            path[-1][1].setdefault('children', []).append(node)
+        path.append((rec.node_id, node))
+    if root is not None and pruned:
+        root['pruned_nodes'] = pruned
+    return root
+
+
+def _location_filter(tu, main_file_only: bool, include_roots: Optional[list]):
+    if main_file_only or include_roots:
+        return make_location_filter(tu.spelling, include_roots)
+    return None
+
+def _file_args(path: Path) -> list:
+    # Add the directory of the file being parsed to the include path
+    # This allows clang to find local header files (e.g., #include "tg.h")
+    return [f'-I{path.parent.resolve()}']
+
+def _code_args(include_roots: Optional[list]) -> list:
+    return [f'-I{os.path.abspath(str(r))}' for r in include_roots or []]
+
+def iter_c_file_records(path: str, main_file_only: bool = False,
+                        include_roots: Optional[list] = None) -> Iterator[ASTRecord]:
+    """
+    Parse C source file at `path` and stream its AST records.
+    Yields nothing if libclang reports errors.
     """
     path = Path(path)
     if not path.exists():
         raise FileNotFoundError(path)
 
     index = clang.cindex.Index.create()
-    
-    # Add the directory of the file being parsed to the include path
-    # This allows clang to find local header files (e.g., #include "tg.h")
-    args = [f'-I{path.parent.resolve()}']
+    tu = index.parse(str(path), args=_file_args(path))
+
+    errors = _error_messages(tu)
+    if errors:
+        for message in errors:
+            print(f"Error parsing file: {message}")
+        print("Parsing failed. Please check the errors above.")
+        return
+
+    yield from iter_ast_records(tu.cursor, _location_filter(tu, main_file_only, include_roots))
+
+def iter_c_code_str_records(code: str, filename='temp.c', main_file_only: bool = False,
+                            include_roots: Optional[list] = None) -> Iterator[ASTRecord]:
+    """
+    Parse a string of C code and stream its AST records.
+    """
+    index = clang.cindex.Index.create()
+    tu = index.parse(filename, args=_code_args(include_roots), unsaved_files=[(filename, code)])
+    yield from iter_ast_records(tu.cursor, _location_filter(tu, main_file_only, include_roots))
+
+def dump_records_jsonl(records: Iterable[ASTRecord], fp) -> int:
+    """Write records to a text file object as JSON lines. Returns the record count."""
+    count = 0
+    for rec in records:
+        fp.write(json.dumps(rec._asdict()))
+        fp.write('\n')
+        count += 1
+    return count
+
+def _finish(root: Optional[dict], filtered: bool) -> dict:
+    if root is None:
+        return {}
+    if filtered:
+        root.setdefault('pruned_nodes', 0)
+        print(f"Pruned {root['pruned_nodes']} cursors outside the main file/include roots.")
+    return root
+
+def _error_messages(tu) -> list:
+    return [d.spelling for d in tu.diagnostics if d.severity >= clang.cindex.Diagnostic.Error]
 
+def _portable_paths(items: list, base: str) -> list:
+    # Paths (or -I flags) under `base` made relative to it, so cache keys do
+    # not change when the same project is parsed from another directory.
+    out = []
+    for item in items:
+        flag = '-I' if item.startswith('-I') else ''
+        p = os.path.abspath(item[len(flag):])
+        if p == base or p.startswith(base + os.sep):
+            item = flag + os.path.relpath(p, base)
+        out.append(item)
+    return out
+
+def _parse_file(path: str, main_file_only: bool = False, include_roots: Optional[list] = None,
+                cache: Optional[ParseCache] = None):
+    """
+    Parse one file into a nested dict AST. Returns (ast, errors); ast is None
+    when libclang reported errors.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(path)
+    args = _file_args(path)
+    key = None
+    base = str(path.parent.resolve())
+    if cache is not None:
+        key = cache.make_key(path.read_bytes(), str(path), _portable_paths(args, base),
+                             {'main_file_only': main_file_only,
+                              'include_roots': _portable_paths([str(r) for r in include_roots or []], base)})
+        cached = cache.lookup(key, base)
+        if cached is not None:
+            return cached, []
+
+    index = clang.cindex.Index.create()
     tu = index.parse(str(path), args=args)
+    errors = _error_messages(tu)
+    if errors:
+        return None, errors
+    records = iter_ast_records(tu.cursor, _location_filter(tu, main_file_only, include_roots))
+    root = _finish(build_ast_dict(records), bool(main_file_only or include_roots))
+    if cache is not None:
+        cache.store(key, root, tu, base)
+    return root, []
 
-    # Check for parsing errors
-    has_errors = False
-    for diag in tu.diagnostics:
-        if diag.severity >= clang.cindex.Diagnostic.Error:
-            print(f"Error parsing file: {diag.spelling}")
-            has_errors = True
-    
-    if has_errors:
+def parse_c_file_to_ast_dict(path: str, main_file_only: bool = False,
+                             include_roots: Optional[list] = None,
+                             cache: Optional[ParseCache] = None) -> dict:
+    """
+    Parse C source file at `path` into a nested dict AST using libclang.
+    With `main_file_only` (or a non-empty `include_roots` allowlist), cursors
+    from other headers are replaced by childless stubs that keep their USR;
+    the root then carries the number of stubbed cursors in 'pruned_nodes'.
+    If a ParseCache is given, unchanged inputs are served without libclang.
+    """
+    root, errors = _parse_file(path, main_file_only, include_roots, cache)
+    if errors:
+        for message in errors:
+            print(f"Error parsing file: {message}")
         print("Parsing failed. Please check the errors above.")
-        # Decide how to handle errors, e.g., return None or an empty dict
         return {}
+    return root
+
+def code_str_cache_key(cache: ParseCache, code: str, filename: str = 'temp.c', main_file_only: bool = False,
+                       include_roots: Optional[list] = None) -> str:
+    """The ParseCache key parse_c_code_str_to_ast uses for `code`."""
+    return cache.make_key(code.encode('utf-8'), filename, _code_args(include_roots),
+                          {'main_file_only': main_file_only, 'include_roots': include_roots or [], 'str': True})
 
-    def node_to_dict_iterative(node):
-        """
-        Iterative traversal of the AST to avoid recursion depth issues.
-        """
-        if not node:
-            return None
-
-        root_dict = {
-            'kind': node.kind.name,
-            'spelling': node.spelling,
-            'location': str(node.location.file),
-            'line': node.location.line,
-            'column': node.location.column,
-            'type': node.type.spelling,
-            'usr': node.get_usr(),
-            'children': []
-        }
-        
-        # Stack for iterative traversal, storing (node, parent_dict)
-        stack = [(node, root_dict)]
-
-        while stack:
-            current_node, parent_dict = stack.pop()
-
-            # Process children in reverse order to maintain original order in the output
-            for child_node in reversed(list(current_node.get_children())):
-                child_dict = {
-                    'kind': child_node.kind.name,
-                    'spelling': child_node.spelling,
-                    'location': str(child_node.location.file),
-                    'line': child_node.location.line,
-                    'column': child_node.location.column,
-                    'type': child_node.type.spelling,
-                    'usr': child_node.get_usr(),
-                    'children': []
-                }
-                parent_dict['children'].insert(0, child_dict)
-                stack.append((child_node, child_dict))
-
-        return root_dict
-
-
-    return node_to_dict_iterative(tu.cursor)
-
-
-def parse_c_code_str_to_ast(code: str, filename='temp.c') -> dict:
+def parse_c_code_str_to_ast(code: str, filename='temp.c', main_file_only: bool = False,
+                            include_roots: Optional[list] = None,
+                            cache: Optional[ParseCache] = None) -> dict:
     """
     Use libclang to parse a string of C code.
+    `main_file_only`, `include_roots` and `cache` behave as in parse_c_file_to_ast_dict.
+    """
+    filtered = bool(main_file_only or include_roots)
+    if cache is None:
+        records = iter_c_code_str_records(code, filename, main_file_only, include_roots)
+        return _finish(build_ast_dict(records, empty_children=False), filtered)
+
+    key = code_str_cache_key(cache, code, filename, main_file_only, include_roots)
+    cached = cache.lookup(key)
+    if cached is not None:
+        return cached
+
+    index = clang.cindex.Index.create()
+    tu = index.parse(filename, args=_code_args(include_roots), unsaved_files=[(filename, code)])
+    records = iter_ast_records(tu.cursor, _location_filter(tu, main_file_only, include_roots))
+    root = _finish(build_ast_dict(records, empty_children=False), filtered)
+    cache.store(key, root, tu)
+    return root
+
+# Declaration-only parsing: function bodies are skipped and missing headers
+# are tolerated, which is enough for outlines and context building.
+SKELETON_OPTIONS = (clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+                    | clang.cindex.TranslationUnit.PARSE_INCOMPLETE)
+# The same with function bodies, for outlines that need definitions and full extents.
+BODY_OUTLINE_OPTIONS = clang.cindex.TranslationUnit.PARSE_INCOMPLETE
+
+OUTLINE_KINDS = {'STRUCT_DECL', 'UNION_DECL', 'ENUM_DECL', 'TYPEDEF_DECL', 'FUNCTION_DECL', 'VAR_DECL'}
+
+def _outline_entry(cursor) -> dict:
+    loc = cursor.location
+    entry = {
+        'kind': cursor.kind.name,
+        'name': cursor.spelling,
+        'usr': cursor.get_usr(),
+        'type': cursor.type.spelling,
+        'file': loc.file.name if loc.file else None,
+        'line': loc.line,
+        'is_definition': _is_definition(cursor),
+        'extent': [cursor.extent.start.offset, cursor.extent.end.offset],
+    }
+    kind = entry['kind']
+    if kind == 'FUNCTION_DECL':
+        entry['result_type'] = cursor.result_type.spelling
+        entry['params'] = [{'name': a.spelling, 'type': a.type.spelling} for a in cursor.get_arguments()]
+    elif kind in ('STRUCT_DECL', 'UNION_DECL'):
+        entry['fields'] = [{'name': c.spelling, 'type': c.type.spelling}
+                           for c in cursor.get_children() if c.kind.name == 'FIELD_DECL']
+    elif kind == 'ENUM_DECL':
+        entry['constants'] = [c.spelling for c in cursor.get_children()]
+    elif kind == 'TYPEDEF_DECL':
+        entry['underlying_type'] = cursor.underlying_typedef_type.spelling
+    return entry
+
+def _skeleton_outline(tu, main_file_only: bool, include_roots: Optional[list]) -> list:
+    keep = _location_filter(tu, main_file_only, include_roots)
+    return [_outline_entry(c) for c in tu.cursor.get_children()
+            if c.kind.name in OUTLINE_KINDS and (keep is None or keep(c))]
+
+def parse_c_file_skeleton(path: str, main_file_only: bool = True,
+                          include_roots: Optional[list] = None, bodies: bool = False) -> list:
+    """
+    Parse only the declarations of a C file (skipping function bodies) and
+    return a flat outline: one dict per struct/union/enum/typedef/function/global.
+    Diagnostics are ignored; the outline is best-effort. With `bodies`, function
+    bodies are parsed too, so definitions are flagged and extents cover them.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(path)
+    index = clang.cindex.Index.create()
+    tu = index.parse(str(path), args=_file_args(path),
+                     options=BODY_OUTLINE_OPTIONS if bodies else SKELETON_OPTIONS)
+    return _skeleton_outline(tu, main_file_only, include_roots)
+
+def parse_c_code_str_skeleton(code: str, filename='temp.c', main_file_only: bool = True,
+                              include_roots: Optional[list] = None, bodies: bool = False) -> list:
+    """String-input counterpart of parse_c_file_skeleton."""
+    index = clang.cindex.Index.create()
+    tu = index.parse(filename, args=_code_args(include_roots), unsaved_files=[(filename, code)],
+                     options=BODY_OUTLINE_OPTIONS if bodies else SKELETON_OPTIONS)
+    return _skeleton_outline(tu, main_file_only, include_roots)
+
+def parse_function_body(path: str, name: str, code: Optional[str] = None) -> Optional[dict]:
+    """
+    Fully parse the file and return the nested dict AST of the definition of
+    function `name` (a spelling or a USR), or None if it is not defined there.
+    Pass `code` to parse unsaved text under the name `path`.
     """
     index = clang.cindex.Index.create()
-    tu = index.parse(filename, args=[], unsaved_files=[(filename, code)])
-
-    def node_to_dict(node):
-        if node is None:
-            return None
-            
-        children = [node_to_dict(c) for c in node.get_children()]
-
-        result = {
-            'kind': node.kind.name,
-            'spelling': node.spelling,
-            'location': str(node.location.file),
-            'line': node.location.line,
-            'column': node.location.column,
-            'type': node.type.spelling,
-            'usr': node.get_usr(),
-        }
-
-        if children:
-            result['children'] = children
-        return result
-
-    return node_to_dict(tu.cursor)
+    if code is None:
+        tu = index.parse(str(path), args=_file_args(Path(path)))
+    else:
+        tu = index.parse(str(path), args=_file_args(Path(path)), unsaved_files=[(str(path), code)])
+    for cursor in tu.cursor.get_children():
+        if (cursor.kind.name == 'FUNCTION_DECL' and cursor.is_definition()
+                and name in (cursor.spelling, cursor.get_usr())):
+            return build_ast_dict(iter_ast_records(cursor))
+    return None
+
+# Outcome of parsing one file of a project; `ast` is None when `errors` is non-empty.
+# `cache_hits`/`cache_misses` are the parse cache lookups made for the file, so
+# the parent can count lookups that happened in worker processes.
+ParseResult = namedtuple('ParseResult', ['path', 'ast', 'errors', 'elapsed', 'cache_hits', 'cache_misses'],
+                         defaults=(0, 0))
+
+C_SOURCE_EXTENSIONS = ('.c',)
+
+def collect_source_files(paths, extensions=C_SOURCE_EXTENSIONS) -> list:
+    """
+    Expand a directory, a single path or a list of either into a sorted list
+    of source files. Headers are reached through includes, not parsed directly.
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files = []
+    for p in paths:
+        p = Path(p)
+        if p.is_dir():
+            files.extend(f for f in sorted(p.rglob('*')) if f.suffix in extensions and f.is_file())
+        else:
+            files.append(p)
+    return [str(f) for f in files]
+
+def _parse_project_file(path: str, main_file_only: bool, include_roots: Optional[list],
+                        use_cache: bool, compact: bool = False) -> ParseResult:
+    # Runs in a worker process; never raises so one bad file cannot abort the batch.
+    start = time.perf_counter()
+    cache = get_parse_cache() if use_cache else None
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    try:
+        ast, errors = _parse_file(path, main_file_only, include_roots, cache)
+        if compact and ast is not None:
+            from backend.compact_ast import CompactAST
+            ast = CompactAST.from_dict(ast)
+    except Exception as e:
+        ast, errors = None, [f"{type(e).__name__}: {e}"]
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return ParseResult(path, ast, errors, time.perf_counter() - start, hits, misses)
+
+def parse_project(paths, workers: Optional[int] = None, main_file_only: bool = False,
+                  include_roots: Optional[list] = None, use_cache: bool = False,
+                  compact: bool = False) -> Iterator[ParseResult]:
+    """
+    Parse every source file under `paths` in a pool of `workers` processes
+    (default: CPU count) and yield a ParseResult as each file finishes.
+    Failed files are yielded with their diagnostics instead of raising.
+    Cache lookups made by the workers are added to this process's parse cache counters.
+    With `compact`, each AST is converted to a backend.compact_ast.CompactAST
+    in the worker, so this process never holds the nested dict.
+    """
+    files = collect_source_files(paths)
+    if not files:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        for f in files:
+            yield _parse_project_file(f, main_file_only, include_roots, use_cache, compact)
+        return
+    cache = get_parse_cache() if use_cache else None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_parse_project_file, f, main_file_only, include_roots, use_cache, compact)
+                   for f in files]
+        for fut in as_completed(futures):
+            result = fut.result()
+            if cache is not None:
+                cache.hits += result.cache_hits
+                cache.misses += result.cache_misses
+            yield result
 
 if __name__ == '__main__':
     import sys
     if len(sys.argv) < 2:
-        print("Usage: python backend/parser.py path/to/file.c")
+        print("Usage: python backend/parser.py path/to/file.c [--main-file-only] [--jsonl] [--cache]")
         raise SystemExit(1)
-    ast = parse_c_file_to_ast_dict(sys.argv[1])
-    print(json.dumps(ast, indent=2))
\ No newline at end of file
+    main_only = '--main-file-only' in sys.argv
+    if '--jsonl' in sys.argv:
+        dump_records_jsonl(iter_c_file_records(sys.argv[1], main_file_only=main_only), sys.stdout)
+    else:
+        cache = get_parse_cache() if '--cache' in sys.argv else None
+        ast = parse_c_file_to_ast_dict(sys.argv[1], main_file_only=main_only, cache=cache)
+        print(json.dumps(ast, indent=2))
+        if cache is not None:
+            print(cache.stats(), file=sys.stderr)
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+backend/retrieval.py
+Similarity retrieval of AST context for the code being converted.
+
+The code is embedded with the same model (and cache) as the graph's code
+units, then the store's vector search returns the k nearest embedded units of
+the migration instance: Neo4j's vector index on ASTNode.embedding, a
+brute-force cosine scan in MemoryGraphStore, or the local index in
+backend.vector_index when VECTOR_BACKEND=local.
+"""
+import os
+import time
+from collections import namedtuple
+from typing import Optional
+
+from backend.embedding_cache import get_embedding_cache, normalize_text
+from backend.graph_store import GraphStore, get_graph_store
+from backend.vector_index import USE_LOCAL_VECTOR_INDEX, LocalVectorIndex, get_vector_index
+from backend.vectorizer import DEFAULT_EMBED_MODEL, embed_texts
+
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '20'))
+
+# nodes: [{'node_id', 'kind', 'spelling', 'source', 'score'}] best first; timings in seconds.
+RetrievalResult = namedtuple('RetrievalResult', ['nodes', 'embed_s', 'query_s'])
+
+def embed_query(text: str, model: str = DEFAULT_EMBED_MODEL, use_cache: bool = True) -> list:
+    """Embed a query text, going through the embedding cache when enabled."""
+    text = normalize_text(text)
+    cache = get_embedding_cache() if use_cache else None
+    if cache is not None:
+        hit = cache.lookup(model, [text])
+        if text in hit:
+            return hit[text]
+    embedding = embed_texts([text], model=model)[0]
+    if cache is not None:
+        cache.store(model, {text: embedding})
+    return embedding
+
+def retrieve_similar(code: str, migration_id: Optional[str], k: int = RETRIEVAL_TOP_K,
+                     model: str = DEFAULT_EMBED_MODEL, store: Optional[GraphStore] = None,
+                     use_cache: bool = True, vector_index: Optional[LocalVectorIndex] = None) -> RetrievalResult:
+    """Top-k nodes of `migration_id` most similar to `code`, with embed/query latency."""
+    store = store or get_graph_store()
+    if vector_index is None and USE_LOCAL_VECTOR_INDEX:
+        vector_index = get_vector_index()
+    start = time.perf_counter()
+    embedding = embed_query(code, model=model, use_cache=use_cache)
+    embedded = time.perf_counter()
+    if vector_index is not None:
+        hits = vector_index.search(embedding, k, migration_id=migration_id)
+        props = {r['node_id']: r for r in store.get_nodes([h[0] for h in hits], ['kind', 'spelling', 'source'])}
+        nodes = [dict(props.get(node_id, {'node_id': node_id}), score=score) for node_id, score in hits]
+    else:
+        nodes = store.similar_nodes(embedding, k, migration_id=migration_id)
+    done = time.perf_counter()
+    print(f"Retrieved {len(nodes)}/{k} similar nodes: embed {(embedded - start) * 1000:.0f} ms, "
+          f"search {(done - embedded) * 1000:.0f} ms")
+    return RetrievalResult(nodes, embedded - start, done - embedded)
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 3:
+        print("Usage: python -m backend.retrieval path/to/file.c migration_id [k]")
+        raise SystemExit(1)
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else RETRIEVAL_TOP_K
+    result = retrieve_similar(open(sys.argv[1]).read(), sys.argv[2], k=k)
+    for n in result.nodes:
+        print(f"{n['score']:.3f} {n['kind']} {n['spelling']}")
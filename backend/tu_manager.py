@@ -0,0 +1,125 @@
+"""
+backend/tu_manager.py
+Keep libclang translation units alive between edits and reparse them in place.
+"""
+import ctypes
+import hashlib
+import os
+import time
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+import clang.cindex
+
+from backend.parser import build_ast_dict, iter_ast_records, make_location_filter
+
+# Outcome of TUManager.update(); declaration keys are USRs (or kind:spelling).
+UpdateResult = namedtuple('UpdateResult', ['tu', 'reparsed', 'changed', 'added', 'removed', 'elapsed'])
+
+_is_from_main_file = None
+
+def _from_main_file(location) -> bool:
+    # clang_Location_isFromMainFile is not wrapped by the Python bindings; one
+    # direct call is much cheaper than resolving location.file.name per cursor.
+    global _is_from_main_file
+    if _is_from_main_file is None:
+        fn = clang.cindex.conf.lib.clang_Location_isFromMainFile
+        fn.argtypes = [clang.cindex.SourceLocation]
+        fn.restype = ctypes.c_uint
+        _is_from_main_file = fn
+    return bool(_is_from_main_file(location))
+
+def _decl_key(cursor) -> str:
+    return cursor.get_usr() or f"{cursor.kind.name}:{cursor.spelling}"
+
+def declaration_fingerprints(tu, code: str) -> dict:
+    """
+    Map each top-level declaration in the main file to a hash of its source text.
+    Repeated keys (e.g. a prototype and its definition) get a #n suffix.
+    """
+    data = code.encode('utf-8')
+    prints = {}
+    for cursor in tu.cursor.get_children():
+        if not _from_main_file(cursor.location):
+            continue
+        start, end = cursor.extent.start.offset, cursor.extent.end.offset
+        key = _decl_key(cursor)
+        n = 1
+        while key in prints:
+            n += 1
+            key = f"{_decl_key(cursor)}#{n}"
+        prints[key] = hashlib.sha1(data[start:end]).hexdigest()
+    return prints
+
+class TUManager:
+    """
+    Session-scoped store of the last TU per document. The first update() of a
+    document parses it with a precompiled preamble; later updates call
+    libclang's reparse() with the new text as an unsaved file, which reuses
+    the preamble (headers) and only redoes the main file.
+    """
+
+    # Completion-result caching is deliberately left off: it makes every
+    # reparse rebuild the completion cache and erases the preamble savings.
+    PARSE_OPTIONS = clang.cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE
+
+    def __init__(self, args: Optional[list] = None, max_documents: int = 8):
+        self.index = clang.cindex.Index.create()
+        self.args = list(args or [])
+        self.max_documents = max_documents
+        self._docs = OrderedDict()  # doc_id -> [tu, filename, fingerprints]
+
+    def update(self, doc_id: str, code: str, filename: str = 'temp.c') -> UpdateResult:
+        """Bring `doc_id` up to date with `code` and report which declarations changed."""
+        start = time.perf_counter()
+        unsaved = [(filename, code)]
+        doc = self._docs.get(doc_id)
+        if doc is not None and doc[1] == filename:
+            tu, _, old = doc
+            tu.reparse(unsaved_files=unsaved)
+            reparsed = True
+        else:
+            tu = self.index.parse(filename, args=self.args, unsaved_files=unsaved,
+                                  options=self.PARSE_OPTIONS)
+            # The first reparse builds the preamble, so later edits are cheap.
+            tu.reparse(unsaved_files=unsaved)
+            old, reparsed = {}, False
+        new = declaration_fingerprints(tu, code)
+        self._docs[doc_id] = [tu, filename, new]
+        self._docs.move_to_end(doc_id)
+        while len(self._docs) > self.max_documents:
+            self._docs.popitem(last=False)
+
+        changed = sorted(k for k in new.keys() & old.keys() if new[k] != old[k])
+        added = sorted(new.keys() - old.keys())
+        removed = sorted(old.keys() - new.keys())
+        return UpdateResult(tu, reparsed, changed, added, removed, time.perf_counter() - start)
+
+    def ast_dict(self, doc_id: str, main_file_only: bool = False, include_roots: Optional[list] = None) -> dict:
+        """Nested dict AST of the document's current TU, as parse_c_code_str_to_ast builds it."""
+        tu = self._docs[doc_id][0]
+        filtered = bool(main_file_only or include_roots)
+        keep = make_location_filter(tu.spelling, include_roots) if filtered else None
+        root = build_ast_dict(iter_ast_records(tu.cursor, keep), empty_children=False)
+        if filtered:
+            root.setdefault('pruned_nodes', 0)
+        return root
+
+    def discard(self, doc_id: str):
+        self._docs.pop(doc_id, None)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.tu_manager path/to/file.c")
+        raise SystemExit(1)
+    path = sys.argv[1]
+    code = open(path).read()
+    manager = TUManager(args=[f'-I{os.path.dirname(path) or "."}'])
+    first = manager.update(path, code, filename=path)
+    second = manager.update(path, code + '\nint __tu_manager_probe;\n', filename=path)
+    print(f"initial parse: {first.elapsed:.3f}s, reparse after edit: {second.elapsed:.3f}s, "
+          f"added={second.added} changed={second.changed}")
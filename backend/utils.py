@@ -1,7 +1,8 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from backend.neo4j_client import run_cypher
+from backend.graph_store import GraphStore, get_graph_store
+from backend.vector_index import USE_LOCAL_VECTOR_INDEX, get_vector_index
 
 def load_env(env_path: str = None):
     if env_path:
@@ -14,11 +15,44 @@ def ensure_outputs_dir(path='outputs'):
     p.mkdir(exist_ok=True)
     return p
 
-def delete_graph_instance(instance_id: str):
+def delete_graph_instance(instance_id: str, store: GraphStore = None) -> dict:
     """
-    Delete all nodes and relationships that were created for a given migration instance.
+    Delete all nodes and relationships that were created for a given migration instance,
+    and its vectors when they are kept in the local vector index (compacting
+    it once enough rows are tombstoned).
+    Returns {'nodes': n, 'relationships': r} removed.
     """
-    query = "MATCH (n) WHERE n.instance_id = $instance_id DETACH DELETE n"
-    params = {'instance_id': instance_id}
-    run_cypher(query, params)
+    removed = (store or get_graph_store()).delete_instance(instance_id)
+    if USE_LOCAL_VECTOR_INDEX:
+        index = get_vector_index()
+        if index.delete_migration(instance_id):
+            index.compact_if_sparse()
+            index.save()
+    return removed
+
+def sweep_expired_instances(max_age_hours: float = None, store: GraphStore = None) -> dict:
+    """
+    Garbage-collect migration instances older than `max_age_hours`
+    (default: GRAPH_INSTANCE_TTL_HOURS, 24). Returns removed counts per instance.
+    """
+    if max_age_hours is None:
+        max_age_hours = float(os.getenv('GRAPH_INSTANCE_TTL_HOURS', '24'))
+    store = store or get_graph_store()
+    removed = {}
+    for instance_id in store.expired_instances(max_age_hours * 3600):
+        removed[instance_id] = delete_graph_instance(instance_id, store=store)
+    return removed
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] not in ('delete', 'sweep'):
+        print("Usage: python -m backend.utils delete INSTANCE_ID | sweep [MAX_AGE_HOURS]")
+        raise SystemExit(1)
+    if sys.argv[1] == 'delete':
+        counts = delete_graph_instance(sys.argv[2])
+        print(f"Removed {counts['nodes']} nodes and {counts['relationships']} relationships")
+    else:
+        age = float(sys.argv[2]) if len(sys.argv) > 2 else None
+        for instance_id, counts in sweep_expired_instances(age).items():
+            print(f"{instance_id}: removed {counts['nodes']} nodes and {counts['relationships']} relationships")
 
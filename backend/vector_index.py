@@ -0,0 +1,330 @@
+"""
+backend/vector_index.py
+Local vector index for node embeddings, kept outside the graph database.
+
+Vectors live in a memory-mapped float32 matrix (one unit-length row per
+node) with the node ids and owning migration in side tables, all under one
+directory, so reopening an index reads no text and parses nothing. Search is
+a vectorized brute-force cosine top-k over the matrix or, when hnswlib is
+installed and the index holds at least ANN_MIN_VECTORS rows, an HNSW graph
+over the same rows. Deleting a migration tombstones its rows; compact()
+reclaims the space, and compact_if_sparse() does so once enough are dead.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import ujson as json
+
+try:
+    import hnswlib
+except ImportError:  # optional: graph-based ANN for large indexes
+    hnswlib = None
+
+# VECTOR_BACKEND=local keeps embeddings here instead of on the graph's nodes.
+USE_LOCAL_VECTOR_INDEX = os.getenv('VECTOR_BACKEND', 'graph') == 'local'
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', os.path.join('outputs', 'vectors'))
+ANN_MIN_VECTORS = int(os.getenv('ANN_MIN_VECTORS', '50000'))
+HNSW_M = int(os.getenv('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '200'))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '100'))
+# ANN candidates fetched per result when a search is scoped to one migration.
+ANN_OVERSAMPLE = int(os.getenv('ANN_OVERSAMPLE', '4'))
+# Deleting a migration compacts the index once this fraction of rows is dead.
+COMPACT_TOMBSTONE_RATIO = float(os.getenv('VECTOR_COMPACT_RATIO', '0.25'))
+
+_DELETED = -1
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class LocalVectorIndex:
+    """
+    Cosine-similarity index persisted under `path`:
+      vectors.f32  capacity x dim float32 matrix (memory-mapped)
+      owners.npy   migration number per row, -1 for deleted rows
+      meta.json    dim, row count, node ids and migration ids
+      ann.bin      HNSW graph, when one has been built
+    """
+
+    def __init__(self, path: Optional[str] = None, dim: Optional[int] = None, use_ann: Optional[bool] = None):
+        self.path = Path(path or VECTOR_INDEX_DIR)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.use_ann = hnswlib is not None and use_ann is not False
+        self.dim = dim
+        self.count = 0
+        self.capacity = 0
+        self.ids = []
+        self.migrations = []
+        self.owners = np.empty(0, dtype=np.int32)
+        self.matrix = None
+        self._ann = None
+        meta_path = self.path / 'meta.json'
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            self.dim, self.count, self.capacity = meta['dim'], meta['count'], meta['capacity']
+            self.ids, self.migrations = meta['ids'], meta['migrations']
+            self.owners = np.full(self.capacity, _DELETED, dtype=np.int32)
+            self.owners[:self.count] = np.load(self.path / 'owners.npy')
+            if self.capacity:
+                self.matrix = np.memmap(self.path / 'vectors.f32', dtype=np.float32, mode='r+',
+                                        shape=(self.capacity, self.dim))
+            if self.matrix is not None and self.use_ann and (self.path / 'ann.bin').exists():
+                self._ann = hnswlib.Index(space='ip', dim=self.dim)
+                self._ann.load_index(str(self.path / 'ann.bin'), max_elements=self.capacity)
+                self._ann.set_ef(HNSW_EF_SEARCH)
+        self._row = {node_id: i for i, node_id in enumerate(self.ids) if self.owners[i] != _DELETED}
+
+    def __len__(self):
+        return len(self._row)
+
+    def _migration_number(self, migration_id: str) -> int:
+        if migration_id not in self.migrations:
+            self.migrations.append(migration_id)
+        return self.migrations.index(migration_id)
+
+    def _grow(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(1024, self.capacity * 2, needed)
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+        with open(self.path / 'vectors.f32', 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self.matrix = np.memmap(self.path / 'vectors.f32', dtype=np.float32, mode='r+',
+                                shape=(capacity, self.dim))
+        owners = np.full(capacity, _DELETED, dtype=np.int32)
+        owners[:self.count] = self.owners[:self.count]
+        self.owners = owners
+        self.capacity = capacity
+        if self._ann is not None:
+            self._ann.resize_index(capacity)
+
+    def add(self, node_ids: List[str], vectors, migration_id: str):
+        """Insert or replace the vectors of `node_ids` under `migration_id`."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(node_ids):
+            raise ValueError("expected one vector per node id")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"vector dimension {vectors.shape[1]} != index dimension {self.dim}")
+        owner = self._migration_number(migration_id)
+        rows = np.empty(len(node_ids), dtype=np.int64)
+        new = sum(1 for n in set(node_ids) if n not in self._row)
+        self._grow(self.count + new)
+        for i, node_id in enumerate(node_ids):
+            row = self._row.get(node_id)
+            if row is None:
+                row = self._row[node_id] = self.count
+                self.ids.append(node_id)
+                self.count += 1
+            rows[i] = row
+        self.matrix[rows] = _normalize(vectors)
+        self.owners[rows] = owner
+        if self._ann is not None:
+            self._ann.add_items(self.matrix[rows], rows)
+        elif self.use_ann and len(self) >= ANN_MIN_VECTORS:
+            self.build_ann()
+
+    def delete_migration(self, migration_id: str) -> int:
+        """Tombstone every row of `migration_id`; returns how many were removed."""
+        if migration_id not in self.migrations:
+            return 0
+        owner = self.migrations.index(migration_id)
+        rows = np.nonzero(self.owners[:self.count] == owner)[0]
+        self.owners[rows] = _DELETED
+        for row in rows:
+            del self._row[self.ids[row]]
+            if self._ann is not None:
+                self._ann.mark_deleted(int(row))
+        return len(rows)
+
+    def build_ann(self):
+        """(Re)build the HNSW graph over all live rows."""
+        if hnswlib is None:
+            raise RuntimeError("hnswlib is not installed")
+        ann = hnswlib.Index(space='ip', dim=self.dim)
+        ann.init_index(max_elements=max(self.capacity, 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        live = np.nonzero(self.owners[:self.count] != _DELETED)[0]
+        if len(live):
+            ann.add_items(self.matrix[live], live)
+        ann.set_ef(HNSW_EF_SEARCH)
+        self._ann = ann
+
+    def _live_mask(self, migration_id: Optional[str]) -> Optional[np.ndarray]:
+        owners = self.owners[:self.count]
+        if migration_id is None:
+            return owners != _DELETED
+        if migration_id not in self.migrations:
+            return None
+        return owners == self.migrations.index(migration_id)
+
+    def search_brute(self, query, k: int, migration_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Exact top-k by cosine similarity over the whole matrix."""
+        mask = self._live_mask(migration_id)
+        if mask is None or not self.count:
+            return []
+        q = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.matrix[:self.count] @ q
+        scores[~mask] = -np.inf
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def search(self, query, k: int, migration_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k (node_id, cosine similarity) pairs, best first. Uses the HNSW
+        graph when there is one, falling back to the exact scan if the
+        migration filter leaves fewer than k of its candidates.
+        """
+        if self._ann is None or not len(self):
+            return self.search_brute(query, k, migration_id)
+        q = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))
+        fetch = min(len(self), k * ANN_OVERSAMPLE if migration_id else k)
+        self._ann.set_ef(max(HNSW_EF_SEARCH, fetch))
+        labels, distances = self._ann.knn_query(q, k=fetch)
+        wanted = None
+        if migration_id is not None:
+            if migration_id not in self.migrations:
+                return []
+            wanted = self.migrations.index(migration_id)
+        hits = [(self.ids[row], 1.0 - float(d)) for row, d in zip(labels[0], distances[0])
+                if wanted is None or self.owners[row] == wanted][:k]
+        if len(hits) < k and migration_id is not None:
+            return self.search_brute(query, k, migration_id)
+        return hits
+
+    def tombstone_ratio(self) -> float:
+        """Fraction of stored rows that belong to deleted migrations."""
+        return (self.count - len(self)) / self.count if self.count else 0.0
+
+    def compact(self):
+        """
+        Drop tombstoned rows from the matrix (and the HNSW graph), and forget
+        migrations that have no rows left. Call save() afterwards.
+        """
+        live = np.nonzero(self.owners[:self.count] != _DELETED)[0]
+        if len(live) == self.count:
+            return
+        vectors = np.array(self.matrix[live])
+        kept = sorted(set(self.owners[live].tolist()))
+        renumber = np.full(len(self.migrations), _DELETED, dtype=np.int32)
+        renumber[kept] = np.arange(len(kept), dtype=np.int32)
+        owners = renumber[self.owners[live]]
+        ids = [self.ids[i] for i in live]
+        self.matrix.flush()
+        del self.matrix
+        self.matrix, self.capacity, self.count = None, 0, 0
+        self.ids, self.owners, self._row = [], np.empty(0, dtype=np.int32), {}
+        self.migrations = [self.migrations[i] for i in kept]
+        (self.path / 'vectors.f32').unlink()
+        if not ids:
+            # nothing left: an empty index that add() grows again
+            self._ann = None
+            (self.path / 'ann.bin').unlink(missing_ok=True)
+            return
+        self._grow(len(ids))
+        self.matrix[:len(ids)] = vectors
+        self.owners[:len(ids)] = owners
+        self.ids, self.count = ids, len(ids)
+        self._row = {node_id: i for i, node_id in enumerate(ids)}
+        if self._ann is not None:
+            self.build_ann()
+
+    def compact_if_sparse(self, ratio: float = COMPACT_TOMBSTONE_RATIO) -> bool:
+        """compact() once more than `ratio` of the rows are tombstoned; True if it ran."""
+        if self.tombstone_ratio() <= ratio:
+            return False
+        self.compact()
+        return True
+
+    def save(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+        elif self.dim is None:
+            return
+        np.save(self.path / 'owners.npy', self.owners[:self.count])
+        if self._ann is not None:
+            self._ann.save_index(str(self.path / 'ann.bin'))
+        (self.path / 'meta.json').write_text(json.dumps({
+            'dim': self.dim, 'count': self.count, 'capacity': self.capacity,
+            'ids': self.ids, 'migrations': self.migrations,
+        }))
+
+_default_index = None
+
+def get_vector_index() -> LocalVectorIndex:
+    """The process-wide index under VECTOR_INDEX_DIR."""
+    global _default_index
+    if _default_index is None:
+        _default_index = LocalVectorIndex()
+    return _default_index
+
+def benchmark(sizes: Iterable[int] = (10_000, 100_000, 1_000_000), dim: int = 768,
+              queries: int = 100, k: int = 10, path: str = os.path.join('outputs', 'vector_bench')):
+    """
+    Recall@k of the HNSW graph against the exact scan, and query latency of
+    both. Vectors are drawn around 1000 random centres (embeddings of code
+    cluster; uniform noise is a worst case no ANN does well on). Prints one
+    line per size.
+    """
+    import shutil
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((1000, dim), dtype=np.float32)
+
+    def sample(m):
+        return centres[rng.integers(0, len(centres), m)] + 0.5 * rng.standard_normal((m, dim), dtype=np.float32)
+
+    q = sample(queries)
+    for n in sizes:
+        shutil.rmtree(path, ignore_errors=True)
+        index = LocalVectorIndex(path, dim=dim, use_ann=False)
+        chunk = 100_000
+        for start in range(0, n, chunk):
+            m = min(chunk, n - start)
+            index.add([f'n{i}' for i in range(start, start + m)],
+                       sample(m), 'bench')
+
+        t = time.perf_counter()
+        exact = [index.search_brute(v, k) for v in q]
+        brute_ms = (time.perf_counter() - t) * 1000 / queries
+        line = f"{n:>9} vectors  dim {dim}  brute-force {brute_ms:7.2f} ms/query"
+        if hnswlib is None:
+            print(line + "  (hnswlib not installed; ANN skipped)")
+            continue
+        t = time.perf_counter()
+        index.build_ann()
+        build_s = time.perf_counter() - t
+        t = time.perf_counter()
+        approx = [index.search(v, k) for v in q]
+        ann_ms = (time.perf_counter() - t) * 1000 / queries
+        recall = np.mean([len({i for i, _ in a} & {i for i, _ in e}) / k for a, e in zip(approx, exact)])
+        print(line + f"  hnsw {ann_ms:6.2f} ms/query  recall@{k} {recall:.3f}  build {build_s:.1f}s")
+    shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local vector index tools.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    bench = sub.add_parser('bench', help='recall and latency of HNSW against brute force')
+    bench.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    bench.add_argument('--dim', type=int, default=768)
+    bench.add_argument('--queries', type=int, default=100)
+    bench.add_argument('-k', type=int, default=10)
+    info = sub.add_parser('info', help='summarize the index under VECTOR_INDEX_DIR')
+    args = parser.parse_args()
+    if args.cmd == 'bench':
+        benchmark(args.sizes, dim=args.dim, queries=args.queries, k=args.k)
+    else:
+        index = get_vector_index()
+        print(f"{len(index)} live vectors of dim {index.dim} in {len(index.migrations)} migrations "
+              f"({index.count} rows, capacity {index.capacity}, ann={'yes' if index._ann else 'no'})")
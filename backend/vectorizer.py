@@ -1,61 +1,137 @@
-"""Attach embeddings to ASTNode nodes using Ollama embeddings and save into Neo4j."""
+"""Attach embeddings to code units (backend.code_units) using Ollama embeddings and save into Neo4j."""
 import ollama
 ollama.api_url = "http://host.docker.internal:11434"
 
-from .neo4j_client import run_cypher
-import math
-import ast
+from .code_units import unit_text
+from .embedding_cache import EmbeddingCache, get_embedding_cache, normalize_text
+from .graph_store import GraphStore, get_graph_store
+from .vector_index import USE_LOCAL_VECTOR_INDEX, LocalVectorIndex, get_vector_index
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from typing import List, Optional
 
-def embed_text(text: str, model: str = 'nomic-embed-text:latest') -> list:
+DEFAULT_EMBED_MODEL = 'nomic-embed-text:latest'
+
+# Inputs per embed request, concurrent requests, and retries per request.
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', '4'))
+EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', '4'))
+
+# Source characters embedded per code unit; nomic-embed-text reads ~2k tokens.
+EMBED_UNIT_MAX_CHARS = int(os.getenv('EMBED_UNIT_MAX_CHARS', '6000'))
+
+def _retryable(e: Exception) -> bool:
+    # Client errors (unknown model, bad input) will not get better on retry.
+    if isinstance(e, ollama.ResponseError):
+        return e.status_code == 429 or e.status_code >= 500
+    return True
+
+def _parse_embeddings(resp) -> List[list]:
+    embeddings = getattr(resp, 'embeddings', None)
+    if embeddings is None and isinstance(resp, dict):
+        embeddings = resp.get('embeddings')
+    if not isinstance(embeddings, list):
+        raise RuntimeError("Unexpected embedding response from Ollama")
+    return [[float(x) for x in e] for e in embeddings]
+
+def embed_texts(texts: List[str], model: str = DEFAULT_EMBED_MODEL,
+                max_retries: int = EMBED_MAX_RETRIES) -> List[list]:
     """
-    Call ollama embeddings. Converts returned response into a float list.
+    Embed many texts in one request with Ollama's batch embed API, retrying
+    transient failures with jittered exponential backoff. Returns one float
+    list per input, in order.
     """
-    try:
-        resp = ollama.embeddings(model=model, prompt=text)
-        print("Ollama response:", resp)
-    except Exception as e:
-        raise RuntimeError(f"Ollama embeddings call failed: {e}")
-
-    # If response is a string like "embedding=[...]", parse it
-    if isinstance(resp, str) and resp.startswith("embedding="):
+    for attempt in range(max_retries + 1):
         try:
-            # Extract the list part and parse it safely
-            embedding_str = resp[len("embedding="):]
-            embedding = ast.literal_eval(embedding_str)
-            return [float(x) for x in embedding]
+            embeddings = _parse_embeddings(ollama.embed(model=model, input=texts))
+            break
         except Exception as e:
-            raise RuntimeError(f"Failed to parse embedding string: {e}")
-
-    # resp might be a dict or list depending on ollama client version
-    if isinstance(resp, dict):
-        # standard key
-        if 'embedding' in resp and isinstance(resp['embedding'], list):
-            return [float(x) for x in resp['embedding']]
-        # outputs
-        if 'outputs' in resp and isinstance(resp['outputs'], list):
-            for out in resp['outputs']:
-                if 'embedding' in out:
-                    return [float(x) for x in out['embedding']]
-        # fallback: search for any list of numbers
-        for v in resp.values():
-            if isinstance(v, list) and all(isinstance(x, (int,float)) for x in v):
-                return [float(x) for x in v]
-    elif isinstance(resp, list):
-        return [float(x) for x in resp]
-
-    raise RuntimeError("Unexpected embedding response from Ollama")
-
-def attach_embeddings_to_nodes(limit: int = 200, model: str = 'nomic-embed-text:latest'):
-    rows = run_cypher('MATCH (n:ASTNode) RETURN n.node_id AS node_id, n.nodetype AS nodetype, n.name AS name LIMIT $limit', {'limit': limit})
+            if attempt == max_retries or not _retryable(e):
+                raise RuntimeError(f"Ollama embeddings call failed: {e}")
+            time.sleep(min(8.0, 0.25 * 2 ** attempt) * (0.5 + random.random()))
+    if len(embeddings) != len(texts):
+        raise RuntimeError(f"Ollama returned {len(embeddings)} embeddings for {len(texts)} inputs")
+    return embeddings
+
+def embed_text(text: str, model: str = DEFAULT_EMBED_MODEL) -> list:
+    """Embed a single text (see embed_texts)."""
+    return embed_texts([text], model=model)[0]
+
+def attach_embeddings_to_nodes(limit: int = 200, model: str = DEFAULT_EMBED_MODEL,
+                               store: GraphStore = None, batch_size: int = EMBED_BATCH_SIZE,
+                               workers: int = EMBED_WORKERS, cache: Optional[EmbeddingCache] = None,
+                               use_cache: bool = True, migration_id: Optional[str] = None,
+                               vector_index: Optional[LocalVectorIndex] = None) -> int:
+    """
+    Embed up to `limit` code units (of `migration_id`, if given): the AST
+    roots of functions, records, typedefs and globals, as their kind, name and
+    source text. Statements and expressions are not embedded. Texts are
+    deduplicated first and looked up in the persistent embedding cache; only
+    the misses are sent, `batch_size` texts per request with at most `workers`
+    requests in flight. Vectors are written back `batch_size` nodes per store
+    call (one UNWIND on Neo4j), or into the local vector index instead when
+    one is given or VECTOR_BACKEND=local. Returns the number of units embedded.
+    """
+    store = store or get_graph_store()
+    cache = cache or (get_embedding_cache() if use_cache else None)
+    if vector_index is None and USE_LOCAL_VECTOR_INDEX:
+        vector_index = get_vector_index()
+    start = time.perf_counter()
+    rows = store.fetch_nodes(['kind', 'spelling', 'source'], limit, migration_id=migration_id,
+                             units_only=True)
+    nodes_by_text = defaultdict(list)
     for r in rows:
-        node_id = r['node_id']
-        nodetype = r.get('nodetype', '')
-        name = r.get('name', '')
-        text = f"AST node type: {nodetype}. name: {name}"
-        emb = embed_text(text, model=model)
-        # store embedding
-        run_cypher('MATCH (n:ASTNode {node_id:$node_id}) SET n.embedding = $emb', {'node_id': node_id, 'emb': emb})
+        nodes_by_text[normalize_text(unit_text(r, EMBED_UNIT_MAX_CHARS))].append(r['node_id'])
+
+    done = 0
+    pending = []
+
+    def flush(batch):
+        if vector_index is not None:
+            vector_index.add([r['node_id'] for r in batch], [r['embedding'] for r in batch],
+                             migration_id or '')
+        else:
+            store.set_embeddings(batch)
+
+    def write(embeddings: dict):
+        nonlocal done
+        for text, emb in embeddings.items():
+            pending.extend({'node_id': node_id, 'embedding': emb} for node_id in nodes_by_text[text])
+        while len(pending) >= batch_size:
+            flush(pending[:batch_size])
+            done += batch_size
+            del pending[:batch_size]
+
+    cached = cache.lookup(model, nodes_by_text) if cache is not None else {}
+    write(cached)
+    missing = [t for t in nodes_by_text if t not in cached]
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(embed_texts, texts, model): texts for texts in batches}
+        for future in as_completed(futures):
+            # cache and graph writes stay on this thread; only HTTP runs concurrently
+            embeddings = dict(zip(futures[future], future.result()))
+            if cache is not None:
+                cache.store(model, embeddings)
+            write(embeddings)
+    if pending:
+        flush(pending)
+        done += len(pending)
+    if vector_index is not None:
+        vector_index.save()
+
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else float('inf')
+    print(f"Embedded {done} code units ({len(nodes_by_text)} unique texts, {len(cached)} cached, "
+          f"{len(batches)} requests) in {elapsed:.2f}s ({rate:.0f} embeddings/sec)")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Embedding cache: {stats['hit_rate']:.0%} hit rate, {stats['entries']} entries, "
+              f"{stats['bytes']} bytes")
+    return done
 
 if __name__ == '__main__':
     attach_embeddings_to_nodes()
-
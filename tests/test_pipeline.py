@@ -0,0 +1,185 @@
+"""
+Pipeline tests that need no database, LLM or network: parsing (libclang),
+the in-memory graph store, code units, call-graph derivation, chunking and
+stitching, the compact AST, the local vector index and the token budget.
+Run with `python -m pytest tests`.
+"""
+import numpy as np
+import pytest
+
+from backend.ast_to_neo4j import is_repeated_header_decl, push_ast_to_neo4j, records_to_rows
+from backend.call_graph import CallGraphDeriver
+from backend.chunker import plan_chunks, stitch_modules
+from backend.compact_ast import CompactAST
+from backend.graph_store import MemoryGraphStore
+from backend.llm_client import TokenBudget
+from backend.parser import iter_c_code_str_records, parse_c_code_str_skeleton, parse_c_file_to_ast_dict
+from backend.utils import delete_graph_instance
+from backend.vector_index import LocalVectorIndex
+
+POINT_C = """\
+typedef struct Point { int x; int y; } Point;
+
+extern int shared;
+int moves;
+
+/* Make a point. */
+static Point make_point(int x, int y) {
+    Point p = {x, y};
+    return p;
+}
+
+void point_move(Point *p, int dx) {
+    p->x += dx;
+    moves++;
+}
+
+int total(void) {
+    Point p = make_point(1, 2);
+    point_move(&p, shared);
+    return p.x + moves;
+}
+"""
+
+@pytest.fixture
+def point_file(tmp_path):
+    path = tmp_path / 'point.c'
+    path.write_text(POINT_C)
+    return path
+
+def _units(store, instance_id):
+    ids = store.lookup('unit', True) & store.lookup('migration_id', instance_id)
+    return {store.nodes[i]['spelling']: store.nodes[i] for i in ids}
+
+def test_memory_store_pipeline(point_file):
+    store = MemoryGraphStore()
+    ast = parse_c_file_to_ast_dict(str(point_file))
+    push_ast_to_neo4j(ast, 'mig-1', store=store)
+
+    units = _units(store, 'mig-1')
+    # definitions only: no unit for the `extern` declaration
+    assert {'Point', 'moves', 'make_point', 'point_move', 'total'} <= set(units)
+    assert 'shared' not in units
+    assert units['make_point']['source'].startswith('static Point make_point(int x, int y)')
+
+    defined = store.defined_symbols('mig-1')
+    assert any(usr.endswith('@make_point') for usr in defined)
+    total = next(usr for usr in defined if usr.endswith('@F@total'))
+    related = {(r['rel'], r['name']) for r in store.related_symbols('mig-1', [total]) if r['outgoing']}
+    assert ('CALLS', 'make_point') in related and ('CALLS', 'point_move') in related
+    assert ('READS_GLOBAL', 'moves') in related
+
+    store.set_embeddings([{'node_id': node['node_id'], 'embedding': [float(i == n) for i in range(3)]}
+                          for n, node in enumerate(units.values())])
+    hit = store.similar_nodes([1.0, 0.0, 0.0], 1, migration_id='mig-1')[0]
+    assert hit['score'] == pytest.approx(1.0)
+
+    assert store.expired_instances(-1) == ['mig-1']
+    removed = delete_graph_instance('mig-1', store=store)
+    assert removed['nodes'] > len(units)
+    assert not store.nodes and not store.symbols and store.expired_instances(-1) == []
+
+def test_repeated_push_keeps_one_copy_of_header_decls(tmp_path):
+    (tmp_path / 'shape.h').write_text('struct Shape { int sides; };\nint area(struct Shape *s);\n')
+    for name in ('a.c', 'b.c'):
+        (tmp_path / name).write_text('#include "shape.h"\nint f_%s(struct Shape *s) { return area(s); }\n'
+                                     % name[0])
+    store = MemoryGraphStore()
+    for name in ('a.c', 'b.c'):
+        push_ast_to_neo4j(parse_c_file_to_ast_dict(str(tmp_path / name)), 'mig', store=store)
+    shapes = [i for i in store.lookup('kind', 'STRUCT_DECL') if store.nodes[i]['spelling'] == 'Shape']
+    assert len(shapes) == 1
+
+def test_header_definition_after_forward_declaration_is_kept():
+    known, defined = set(), set()
+    header = '/proj/shape.h'
+    fwd = {'usr': 'c:@S@Shape', 'location': header}
+    body = {'usr': 'c:@S@Shape', 'location': header, 'definition': True}
+    assert not is_repeated_header_decl(fwd, '/proj/a.c', known, defined)
+    assert not is_repeated_header_decl(body, '/proj/a.c', known, defined)
+    assert is_repeated_header_decl(body, '/proj/b.c', known, defined)
+    assert is_repeated_header_decl(fwd, '/proj/b.c', known, defined)
+
+def test_call_graph_deriver_counts_reads_and_writes():
+    code = 'int g;\nvoid set(int v) { g = v; }\nint get(void) { return g; }\nvoid bump(void) { g += get(); }\n'
+    deriver = CallGraphDeriver()
+    for _ in deriver.observe(records_to_rows(iter_c_code_str_records(code, 'cg.c'))):
+        pass
+    edges = {(rel, row['src'].rsplit('@', 1)[-1], row['dst'].rsplit('@', 1)[-1]): row['count']
+             for rel, rows in deriver.edges().items() for row in rows}
+    assert edges[('WRITES_GLOBAL', 'set', 'g')] == 1
+    assert ('READS_GLOBAL', 'set', 'g') not in edges
+    assert edges[('READS_GLOBAL', 'get', 'g')] == 1
+    assert edges[('READS_GLOBAL', 'bump', 'g')] == 1 and edges[('WRITES_GLOBAL', 'bump', 'g')] == 1
+    assert edges[('CALLS', 'bump', 'get')] == 1
+
+def test_compact_ast_round_trip_and_graft(point_file, tmp_path):
+    ast = parse_c_file_to_ast_dict(str(point_file))
+    compact = CompactAST.from_dict(ast)
+    assert compact.to_dict() == ast
+    assert CompactAST.from_json(compact.to_json()).to_dict() == ast
+
+    other_path = tmp_path / 'other.c'
+    other_path.write_text('int other(void) { return 1; }\n')
+    other = parse_c_file_to_ast_dict(str(other_path))
+    compact.graft(CompactAST.from_dict(other))
+    ast['children'].extend(other['children'])
+    assert compact.to_dict() == ast
+
+def test_chunks_follow_layout_and_stitch_back():
+    outline = parse_c_code_str_skeleton(POINT_C, filename='point.c', bodies=True)
+    chunks = plan_chunks(POINT_C, outline, max_chars=200)
+    titles = [c.title for c in chunks]
+    assert any(t.startswith('class Point') for t in titles)
+    names = [u.name for c in chunks for u in c.units]
+    assert 'shared' not in names and len(names) == len(set(names))
+    # other chunks see full prototypes, storage class and return type included
+    context = '\n'.join(c.context for c in chunks if 'make_point' not in [u.name for u in c.units])
+    assert 'static Point make_point(int x, int y);' in context
+
+    module = stitch_modules([
+        '"""Points."""\nimport math\n\nclass Point:\n    def move(self):\n        pass\n',
+        'import math\nimport os\n\nclass Point:\n    def norm(self):\n        return math.hypot(1, 2)\n'
+        '\nif __name__ == "__main__":\n    print(1)\n',
+        'def total():\n    return 0\n',
+    ])
+    assert module.count('import math') == 1 and module.count('class Point') == 1
+    assert 'def move' in module and 'def norm' in module
+    assert module.rstrip().endswith('print(1)')
+    compile(module, 'stitched.py', 'exec')
+
+def test_local_vector_index_search_delete_and_compact(tmp_path):
+    index = LocalVectorIndex(str(tmp_path / 'vectors'), use_ann=False)
+    index.add(['a', 'b'], np.eye(2, 4), 'm1')
+    index.add(['c'], np.ones((1, 4)), 'm2')
+    assert index.search_brute([1, 0, 0, 0], 1)[0][0] == 'a'
+    assert [n for n, _ in index.search_brute([1, 0, 0, 0], 5, migration_id='m2')] == ['c']
+
+    assert index.delete_migration('m1') == 2
+    assert index.compact_if_sparse(0.5)
+    index.save()
+    reopened = LocalVectorIndex(str(tmp_path / 'vectors'), use_ann=False)
+    assert reopened.migrations == ['m2'] and [n for n, _ in reopened.search_brute([1, 1, 1, 1], 3)] == ['c']
+
+    # compacting away every row leaves an empty, reusable index
+    reopened.delete_migration('m2')
+    reopened.compact()
+    reopened.save()
+    empty = LocalVectorIndex(str(tmp_path / 'vectors'), use_ann=False)
+    assert len(empty) == 0 and empty.search_brute([1, 0, 0, 0], 3) == []
+    empty.add(['d'], np.ones((1, 4)), 'm3')
+    assert empty.search_brute([1, 1, 1, 1], 1)[0][0] == 'd'
+
+def test_token_budget_waits_and_follows_headers():
+    budget = TokenBudget(600)
+    assert budget.delay(600) == 0.0
+    budget.spend(600)
+    # 10 tokens per second refill
+    assert budget.delay(100) == pytest.approx(10.0, abs=0.1)
+    budget.refund(100)
+    assert budget.delay(100) == pytest.approx(0.0, abs=0.1)
+
+    budget.observe(limit=1200, remaining=0, reset=30.0)
+    assert budget.capacity == 1200
+    assert budget.delay(1) == pytest.approx(30.0, abs=0.1)
+    assert TokenBudget(0).delay(10 ** 6) == 0.0